@@ -1,20 +1,143 @@
 from abc import ABC, abstractmethod
-from typing import Generic, List, TypeVar
+import asyncio
+from typing import Dict, Generic, List, Optional, TypeVar
 
 from pydantic import BaseModel
 
+from newhelm.rate_limiting import RateLimit
 from newhelm.single_turn_prompt_response import PromptInteraction
+from newhelm.sut import SUTCompletion
 
 
 AnnotationType = TypeVar("AnnotationType", bound=BaseModel)
+CompletionRequestType = TypeVar("CompletionRequestType", bound=BaseModel)
+CompletionAnnotationType = TypeVar("CompletionAnnotationType", bound=BaseModel)
 
 
 class BaseAnnotator(ABC, Generic[AnnotationType]):
     """The base class for all annotators."""
 
+    rate_limit: Optional[RateLimit] = None
+    """If set, runners wait as needed so calls to annotate stay under this limit."""
+
+    def count_requests(self, interactions: List[PromptInteraction]) -> int:
+        """How many requests annotating `interactions` counts against `rate_limit`.
+
+        By default, one for each completion.
+        """
+        return sum(
+            len(interaction.response.completions) for interaction in interactions
+        )
+
     @abstractmethod
     def annotate_test_item(
         self, interactions: List[PromptInteraction]
     ) -> AnnotationType:
         """Returns an annotation for a single TestItem's interactions."""
         pass
+
+    async def annotate_test_item_async(
+        self, interactions: List[PromptInteraction]
+    ) -> AnnotationType:
+        """Async version of `annotate_test_item`, for use in an asyncio event loop.
+
+        Annotators that make network calls can override this with a native asyncio
+        implementation. By default it runs `annotate_test_item` in a separate thread.
+        """
+        return await asyncio.to_thread(self.annotate_test_item, interactions)
+
+
+class BaseCompletionAnnotator(
+    BaseAnnotator[AnnotationType],
+    Generic[AnnotationType, CompletionRequestType, CompletionAnnotationType],
+):
+    """Base class for annotators that score each completion independently.
+
+    Each completion is reduced to a request holding everything its score depends on.
+    Identical requests are only scored once, and runners can cache the score for each
+    request on its own, so the same completion text is scored once across TestItems.
+    """
+
+    @abstractmethod
+    def make_completion_request(
+        self, interaction: PromptInteraction, completion: SUTCompletion
+    ) -> CompletionRequestType:
+        """Everything needed to score a single completion."""
+        pass
+
+    @abstractmethod
+    def annotate_completions(
+        self, requests: List[CompletionRequestType]
+    ) -> List[CompletionAnnotationType]:
+        """Score each request, returning the scores in the same order."""
+        pass
+
+    async def annotate_completions_async(
+        self, requests: List[CompletionRequestType]
+    ) -> List[CompletionAnnotationType]:
+        """Async version of `annotate_completions`, running it in a separate thread by default."""
+        return await asyncio.to_thread(self.annotate_completions, requests)
+
+    @abstractmethod
+    def make_annotation(
+        self, completion_annotations: List[List[CompletionAnnotationType]]
+    ) -> AnnotationType:
+        """Combine the scores for each interaction's completions into one annotation."""
+        pass
+
+    def make_completion_requests(
+        self, interactions: List[PromptInteraction]
+    ) -> List[List[CompletionRequestType]]:
+        """Make the requests for every completion, grouped by interaction."""
+        return [
+            [
+                self.make_completion_request(interaction, completion)
+                for completion in interaction.response.completions
+            ]
+            for interaction in interactions
+        ]
+
+    def count_requests(self, interactions: List[PromptInteraction]) -> int:
+        """One for each distinct completion request, as each is scored once."""
+        return len(
+            unique_completion_requests(self.make_completion_requests(interactions))
+        )
+
+    def annotate_test_item(
+        self, interactions: List[PromptInteraction]
+    ) -> AnnotationType:
+        requests = self.make_completion_requests(interactions)
+        unique = unique_completion_requests(requests)
+        scores = dict(
+            zip(unique.keys(), self.annotate_completions(list(unique.values())))
+        )
+        return self.make_annotation(
+            [[scores[completion_request_key(r)] for r in row] for row in requests]
+        )
+
+    async def annotate_test_item_async(
+        self, interactions: List[PromptInteraction]
+    ) -> AnnotationType:
+        requests = self.make_completion_requests(interactions)
+        unique = unique_completion_requests(requests)
+        annotations = await self.annotate_completions_async(list(unique.values()))
+        scores = dict(zip(unique.keys(), annotations))
+        return self.make_annotation(
+            [[scores[completion_request_key(r)] for r in row] for row in requests]
+        )
+
+
+def completion_request_key(request: BaseModel) -> str:
+    """Identify equal completion requests."""
+    return request.model_dump_json()
+
+
+def unique_completion_requests(
+    requests: List[List[CompletionRequestType]],
+) -> Dict[str, CompletionRequestType]:
+    """Map the key of each distinct request to the request, in order of first use."""
+    unique: Dict[str, CompletionRequestType] = {}
+    for row in requests:
+        for request in row:
+            unique.setdefault(completion_request_key(request), request)
+    return unique
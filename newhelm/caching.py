@@ -1,7 +1,31 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import ExitStack, closing
+import hashlib
+import json
+import logging
 import os
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+import uuid
 from pydantic import BaseModel
-from sqlitedict import SqliteDict  # type: ignore
+from sqlitedict import SqliteDict, decode as decode_legacy_value  # type: ignore
+import zstandard
 
 from newhelm.typed_data import TypedData
 from newhelm.general import normalize_filename
@@ -28,25 +52,73 @@ class BaseCache(ABC):
     def update_cache(self, request, response):
         pass
 
+    def get_cached_responses(self, requests: List) -> List:
+        """Look up many requests at once, returning None for each one that isn't cached."""
+        return [self.get_cached_response(request) for request in requests]
+
+    async def get_or_call_async(self, request, async_callable):
+        """Return the cached value, otherwise cache awaiting `async_callable`"""
+        response = self.get_cached_response(request)
+        if response is not None:
+            return response
+        response = await async_callable(request)
+        self.update_cache(request, response)
+        return response
+
 
 class SqlDictCache(BaseCache):
     """Cache the response from a method using the request as the key.
 
     Will create a `file_identifier`.sqlite file in `data_dir` to persist
-    the cache.
+    the cache. Each entry is keyed by a digest of the request, and stores the
+    zstd compressed JSON of both the request and the response. Files written
+    before this format are still read and written in their original format
+    until they are converted with `migrate_cache_file`.
+
+    The connection is meant to stay open for a whole run: writes are committed
+    in groups, after `commit_every` writes or `commit_interval_seconds` since
+    the last commit, whichever comes first. Anything still uncommitted is
+    committed when the cache exits, even if that is because of an exception.
+    The last time each entry was read or written is committed along with the
+    writes, so `compact_cache_file` can evict the entries that aren't being used.
+    Without `track_access`, reads are not recorded, so a cache that is only read,
+    such as when replaying a run, leaves the file untouched.
     """
 
-    def __init__(self, data_dir, file_identifier):
+    def __init__(
+        self,
+        data_dir,
+        file_identifier,
+        commit_every: int = 100,
+        commit_interval_seconds: float = 5.0,
+        track_access: bool = True,
+    ):
+        assert commit_every > 0, f"Cannot commit every {commit_every} writes."
         self.data_dir = data_dir
         self.fname = normalize_filename(f"{file_identifier}.sqlite")
+        self.commit_every = commit_every
+        self.commit_interval_seconds = commit_interval_seconds
+        self.track_access = track_access
+        self._lock = threading.Lock()
+        self._uncommitted_writes = 0
+        self._last_commit = time.monotonic()
+        self._access_times: Dict[str, float] = {}
         self.cached_responses = self._load_cached_responses()
 
     def __enter__(self):
+        # Reopens the connection if this cache was previously closed.
         self.cached_responses.__enter__()
         return self
 
     def __exit__(self, *exc_info):
-        self.cached_responses.close()
+        self.flush()
+        with self._lock:
+            self.cached_responses.close()
+
+    def flush(self):
+        """Commit all writes made so far."""
+        with self._lock:
+            self._commit()
 
     def get_or_call(self, request, callable):
         """Return the cached value, otherwise cache calling `callable`"""
@@ -60,41 +132,958 @@ class SqlDictCache(BaseCache):
     def get_cached_response(self, request):
         if not self._can_encode(request):
             return None
-        encoded_request = self._encode_request(request)
+        encoded_request = self._encode_request(TypedData.from_instance(request))
         encoded_response = self.cached_responses.get(encoded_request)
         if encoded_response:
+            self._record_access([encoded_request])
             return self._decode_response(encoded_response)
         else:
             return None
 
+    def get_cached_responses(self, requests: List) -> List:
+        """Look up many requests with a few large queries."""
+        keys = [
+            self._encode_request(TypedData.from_instance(request))
+            if self._can_encode(request)
+            else None
+            for request in requests
+        ]
+        unique_keys = list({key for key in keys if key is not None})
+        found = {}
+        for start in range(0, len(unique_keys), _MAX_KEYS_PER_QUERY):
+            chunk = unique_keys[start : start + _MAX_KEYS_PER_QUERY]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.cached_responses.conn.select(
+                f'SELECT key, value FROM "{self.cached_responses.tablename}" '
+                f"WHERE key IN ({placeholders})",
+                chunk,
+            )
+            for key, value in rows:
+                found[key] = self.cached_responses.decode(value)
+        self._record_access(found.keys())
+        return [
+            self._decode_response(found[key]) if key in found else None for key in keys
+        ]
+
     def update_cache(self, request, response):
         if not self._can_encode(request) or not self._can_encode(response):
             return
-        encoded_request = self._encode_request(request)
-        encoded_response = self._encode_response(response)
-        self.cached_responses[encoded_request] = encoded_response
-        self.cached_responses.commit()
+        typed_request = TypedData.from_instance(request)
+        encoded_request = self._encode_request(typed_request)
+        encoded_response = self._encode_response(typed_request, response)
+        with self._lock:
+            if self.cached_responses.journal_mode != _WAL:
+                self._enable_wal()
+            self.cached_responses[encoded_request] = encoded_response
+            self._uncommitted_writes += 1
+            if self.track_access and not self.legacy_format:
+                self._access_times[encoded_request] = time.time()
+            if (
+                self._uncommitted_writes >= self.commit_every
+                or time.monotonic() - self._last_commit >= self.commit_interval_seconds
+            ):
+                self._commit()
+
+    def _record_access(self, keys: Iterable[str]):
+        if not self.track_access or self.legacy_format:
+            # Access times are only kept once the file is migrated.
+            return
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._access_times[key] = now
+
+    def _commit(self):
+        if self._access_times:
+            if self.cached_responses.journal_mode != _WAL:
+                self._enable_wal()
+            self.cached_responses.conn.execute(_CREATE_ACCESS_TABLE)
+            self.cached_responses.conn.executemany(
+                f'INSERT OR REPLACE INTO "{_ACCESS_TABLE}" (key, last_access) '
+                "VALUES (?, ?)",
+                list(self._access_times.items()),
+            )
+            self._access_times = {}
+            self.cached_responses.commit()
+        elif self._uncommitted_writes:
+            self.cached_responses.commit()
+        self._uncommitted_writes = 0
+        self._last_commit = time.monotonic()
+
+    def _enable_wal(self):
+        """Let readers in other connections proceed while this one is writing.
+
+        Existing files are switched over before the first write rather than on open,
+        so that opening a cache that is only read doesn't modify the file.
+        """
+        self.cached_responses.conn.select_one(f"PRAGMA journal_mode={_WAL}")
+        # Make sure reopening the connection doesn't switch back.
+        self.cached_responses.journal_mode = _WAL
 
     def _load_cached_responses(self):
         os.makedirs(self.data_dir, exist_ok=True)
         path = os.path.join(self.data_dir, self.fname)
-        return SqliteDict(path)
+        journal_mode = _journal_mode(path)
+        self.legacy_format = _is_legacy_cache_file(path)
+        if self.legacy_format:
+            return SqliteDict(path, journal_mode=journal_mode)
+        return _open_cache_table(path, journal_mode=journal_mode)
 
     def _can_encode(self, obj) -> bool:
         # Encoding currently requires Pydanic objects.
         return isinstance(obj, BaseModel)
 
-    def _encode_response(self, response) -> TypedData:
-        return TypedData.from_instance(response)
+    def _encode_response(self, typed_request: TypedData, response):
+        typed_response = TypedData.from_instance(response)
+        if self.legacy_format:
+            return typed_response
+        return CacheEntry(request=typed_request, response=typed_response)
+
+    def _decode_response(self, encoded_response):
+        if self.legacy_format:
+            return encoded_response.to_instance()
+        return encoded_response.response.to_instance()
+
+    def _encode_request(self, typed_request: TypedData) -> str:
+        if self.legacy_format:
+            return typed_request.model_dump_json()
+        return request_digest(typed_request)
+
+
+class CacheEntry(BaseModel):
+    """What SqlDictCache stores for each request.
+
+    The response is all that is needed to serve the cache, the request is kept
+    to make the cache possible to inspect.
+    """
+
+    request: TypedData
+    response: TypedData
+
+
+def request_digest(typed_request: TypedData) -> str:
+    """A fixed size key for the request, independent of how its JSON is laid out."""
+    canonical = json.dumps(
+        json.loads(typed_request.model_dump_json()),
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+_WAL = "WAL"
+_DIGEST_PATTERN = re.compile("[0-9a-f]{64}")
+# Stay well below SQLite's limit on the number of parameters in a query.
+_MAX_KEYS_PER_QUERY = 500
+_CACHE_TABLE = "cache_entries"
+# Caches from before CacheEntry used SqliteDict's default table and pickled values.
+_LEGACY_CACHE_TABLE = "unnamed"
+_ACCESS_TABLE = "cache_access"
+_CREATE_ACCESS_TABLE = (
+    f'CREATE TABLE IF NOT EXISTS "{_ACCESS_TABLE}" '
+    "(key TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+)
+
+
+def _compress_entry(entry: CacheEntry) -> bytes:
+    return zstandard.compress(entry.model_dump_json().encode("utf-8"))
+
+
+def _decompress_entry(data: bytes) -> CacheEntry:
+    return CacheEntry.model_validate_json(zstandard.decompress(data))
+
+
+def _open_cache_table(path: str, **kwargs) -> SqliteDict:
+    return SqliteDict(
+        path,
+        tablename=_CACHE_TABLE,
+        encode=_compress_entry,
+        decode=_decompress_entry,
+        **kwargs,
+    )
+
+
+def _is_legacy_cache_file(path: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    # Not using SqliteDict.get_tablenames, as it leaves its connection open.
+    with closing(sqlite3.connect(path)) as connection:
+        tables = _table_names(connection)
+    return _LEGACY_CACHE_TABLE in tables and _CACHE_TABLE not in tables
+
+
+def _table_names(connection: sqlite3.Connection) -> List[str]:
+    return [
+        name
+        for (name,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+        )
+    ]
+
+
+def migrate_cache_file(path: str) -> int:
+    """Convert a cache file written before CacheEntry, in place.
+
+    Returns how many entries were converted, which is 0 if the file was already current.
+    """
+    if not _is_legacy_cache_file(path):
+        return 0
+    migrated = 0
+    with SqliteDict(path, flag="r") as legacy, _open_cache_table(path) as current:
+        for request_json, typed_response in legacy.items():
+            typed_request = TypedData.model_validate_json(request_json)
+            current[request_digest(typed_request)] = CacheEntry(
+                request=typed_request, response=typed_response
+            )
+            migrated += 1
+        current.commit()
+    with closing(sqlite3.connect(path)) as connection:
+        connection.execute(f'DROP TABLE "{_LEGACY_CACHE_TABLE}"')
+        connection.commit()
+        # Give the space used by the long keys back to the file system.
+        connection.execute("VACUUM")
+    return migrated
+
+
+class CacheFileSummary(BaseModel):
+    entries: int
+    entry_bytes: int
+    """The size of the keys and values, before any SQLite overhead."""
+    file_bytes: int
+
+
+def summarize_cache_file(path: str) -> CacheFileSummary:
+    """Count the entries in a cache file, without modifying it."""
+    with closing(_connect_read_only(path)) as connection:
+        tables = _table_names(connection)
+        entries, entry_bytes = 0, 0
+        for table in (_CACHE_TABLE, _LEGACY_CACHE_TABLE):
+            if table in tables:
+                entries, entry_bytes = connection.execute(
+                    f'SELECT COUNT(*), COALESCE(SUM(LENGTH(key) + LENGTH(value)), 0) FROM "{table}"'
+                ).fetchone()
+                break
+    return CacheFileSummary(
+        entries=entries, entry_bytes=entry_bytes, file_bytes=os.path.getsize(path)
+    )
+
+
+class CompactionResult(BaseModel):
+    evicted_entries: int
+    file_bytes_before: int
+    file_bytes_after: int
+
+
+def compact_cache_file(
+    path: str,
+    max_bytes: Optional[int] = None,
+    max_age_seconds: Optional[float] = None,
+) -> CompactionResult:
+    """Evict unused entries from a cache file and give the space back to the file system.
+
+    Entries not read or written in the last `max_age_seconds` are evicted, then the least
+    recently used ones until the rest take up at most `max_bytes` (as in CacheFileSummary's
+    entry_bytes). Entries written before access times were kept count as used now.
+    Files in the legacy format are migrated first.
+    """
+    file_bytes_before = os.path.getsize(path)
+    migrate_cache_file(path)
+    now = time.time()
+    evicted: List[str] = []
+    with closing(sqlite3.connect(path)) as connection:
+        if _CACHE_TABLE in _table_names(connection):
+            connection.execute(_CREATE_ACCESS_TABLE)
+            connection.execute(
+                f'INSERT OR IGNORE INTO "{_ACCESS_TABLE}" (key, last_access) '
+                f'SELECT key, ? FROM "{_CACHE_TABLE}"',
+                (now,),
+            )
+            connection.execute(
+                f'DELETE FROM "{_ACCESS_TABLE}" '
+                f'WHERE key NOT IN (SELECT key FROM "{_CACHE_TABLE}")'
+            )
+            rows = connection.execute(
+                "SELECT e.key, LENGTH(e.key) + LENGTH(e.value), a.last_access "
+                f'FROM "{_CACHE_TABLE}" e JOIN "{_ACCESS_TABLE}" a USING (key) '
+                "ORDER BY a.last_access DESC"
+            ).fetchall()
+            kept_bytes = 0
+            full = False
+            for key, size, last_access in rows:
+                expired = (
+                    max_age_seconds is not None and last_access < now - max_age_seconds
+                )
+                full = full or (max_bytes is not None and kept_bytes + size > max_bytes)
+                if expired or full:
+                    evicted.append(key)
+                else:
+                    kept_bytes += size
+            for start in range(0, len(evicted), _MAX_KEYS_PER_QUERY):
+                chunk = evicted[start : start + _MAX_KEYS_PER_QUERY]
+                placeholders = ",".join("?" * len(chunk))
+                for table in (_CACHE_TABLE, _ACCESS_TABLE):
+                    connection.execute(
+                        f'DELETE FROM "{table}" WHERE key IN ({placeholders})', chunk
+                    )
+            connection.commit()
+        connection.execute("VACUUM")
+    return CompactionResult(
+        evicted_entries=len(evicted),
+        file_bytes_before=file_bytes_before,
+        file_bytes_after=os.path.getsize(path),
+    )
+
+
+def find_cache_files(paths: List[str]) -> List[str]:
+    """Expand any directories in `paths` into the cache files they contain."""
+    cache_files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            cache_files.append(path)
+            continue
+        for directory, _, files in sorted(os.walk(path)):
+            for fname in sorted(files):
+                if fname.endswith(".sqlite") and fname != CACHE_STATISTICS_FILE:
+                    cache_files.append(os.path.join(directory, fname))
+    return cache_files
+
+
+def _connect_read_only(path: str) -> sqlite3.Connection:
+    uri = f"{pathlib.Path(path).resolve().as_uri()}?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+
+def _find_caches(paths: List[str]) -> List[str]:
+    """Expand any directories in `paths` into their cache files and DirectoryCaches."""
+    caches = []
+    for path in paths:
+        if not os.path.isdir(path) or _is_directory_cache(path):
+            caches.append(path)
+            continue
+        for directory, subdirectories, files in os.walk(path):
+            subdirectories.sort()
+            if _is_directory_cache(directory):
+                caches.append(directory)
+                # Its subdirectories only hold its entries.
+                subdirectories.clear()
+                continue
+            for fname in sorted(files):
+                if fname.endswith(".sqlite") and fname != CACHE_STATISTICS_FILE:
+                    caches.append(os.path.join(directory, fname))
+    return caches
+
+
+def _is_directory_cache(path: str) -> bool:
+    """Whether `path` holds DirectoryCache entries, going by how they are laid out."""
+    for prefix in os.listdir(path):
+        subdirectory = os.path.join(path, prefix)
+        if len(prefix) != 2 or not os.path.isdir(subdirectory):
+            continue
+        for fname in os.listdir(subdirectory):
+            if _DIGEST_PATTERN.fullmatch(fname) and fname.startswith(prefix):
+                return True
+    return False
+
+
+def _read_cache_entries(path: str) -> Iterator[Tuple[str, CacheEntry]]:
+    """Yield the key and entry for everything in a cache file, in either format."""
+    if os.path.isdir(path):
+        yield from _read_directory_cache_entries(path)
+        return
+    with closing(_connect_read_only(path)) as connection:
+        tables = _table_names(connection)
+        if _CACHE_TABLE in tables:
+            for key, value in connection.execute(
+                f'SELECT key, value FROM "{_CACHE_TABLE}" ORDER BY rowid'
+            ):
+                yield key, _decompress_entry(value)
+        elif _LEGACY_CACHE_TABLE in tables:
+            for request_json, value in connection.execute(
+                f'SELECT key, value FROM "{_LEGACY_CACHE_TABLE}" ORDER BY rowid'
+            ):
+                typed_request = TypedData.model_validate_json(request_json)
+                yield request_digest(typed_request), CacheEntry(
+                    request=typed_request, response=decode_legacy_value(value)
+                )
+
+
+def _read_directory_cache_entries(directory: str) -> Iterator[Tuple[str, CacheEntry]]:
+    """Yield the key and entry for everything in a DirectoryCache's directory."""
+    for prefix in sorted(os.listdir(directory)):
+        subdirectory = os.path.join(directory, prefix)
+        if not os.path.isdir(subdirectory):
+            continue
+        for fname in sorted(os.listdir(subdirectory)):
+            if not _DIGEST_PATTERN.fullmatch(fname):
+                # Such as another writer's temporary file.
+                continue
+            path = os.path.join(subdirectory, fname)
+            data = _read_if_exists(path)
+            if data is None:
+                continue
+            try:
+                entry = _decompress_entry(data)
+            except Exception:
+                logging.warning(
+                    f"Ignoring unreadable cache entry {path}", exc_info=True
+                )
+                continue
+            yield fname, entry
+
+
+class _BundleHeader(BaseModel):
+    bundle_format: int = 1
+
+
+class _BundleLine(BaseModel):
+    caches: List[str]
+    """Paths relative to the data_dir of every cache holding this entry."""
+    entry: CacheEntry
+
+
+def export_cache_bundle(bundle_path: str, data_dir: str, paths: List[str]) -> int:
+    """Write the entries of the caches in `paths` to a single compressed bundle.
+
+    `paths` can be cache files, DirectoryCache directories, or directories to search
+    for either, all within `data_dir`. An entry that is in several caches, such as the
+    same SUT response cached by different Tests, is written once. Entries are
+    streamed, so only their digests are held in memory. Returns how many distinct
+    entries were written.
+    """
+    cache_files = _find_caches(paths)
+    names = {path: _bundle_name(data_dir, path) for path in cache_files}
+    caches_per_entry: Dict[str, List[str]] = {}
+    for path in cache_files:
+        for _, entry in _read_cache_entries(path):
+            caches_per_entry.setdefault(_entry_digest(entry), []).append(names[path])
+    written = 0
+    with zstandard.open(bundle_path, "wt", encoding="utf-8") as bundle:
+        bundle.write(_BundleHeader().model_dump_json() + "\n")
+        for path in cache_files:
+            for _, entry in _read_cache_entries(path):
+                caches = caches_per_entry.pop(_entry_digest(entry), None)
+                if caches is None:
+                    # Already written along with an earlier cache.
+                    continue
+                line = _BundleLine(caches=caches, entry=entry)
+                bundle.write(line.model_dump_json() + "\n")
+                written += 1
+    return written
+
+
+class BundleImportResult(BaseModel):
+    added: int = 0
+    already_cached: int = 0
+
+
+def import_cache_bundle(
+    bundle_path: str, data_dir: str, shared_cache: bool = False
+) -> BundleImportResult:
+    """Merge a bundle written by `export_cache_bundle` into the caches in `data_dir`.
+
+    Entries a cache already has are left untouched, so importing the same bundle twice
+    writes nothing the second time. Cache files in the legacy format are migrated first.
+    With `shared_cache`, entries go to DirectoryCaches, otherwise to cache files, no
+    matter which kind of cache they were exported from.
+    """
+    result = BundleImportResult()
+    with ExitStack() as stack:
+        caches: Dict[str, SqliteDict] = {}
+
+        def _merge_into_directory(name: str, entries: Dict[str, CacheEntry]):
+            directory = _path_in_data_dir(data_dir, name)
+            for key, entry in entries.items():
+                path = _directory_entry_path(directory, key)
+                if os.path.exists(path):
+                    result.already_cached += 1
+                else:
+                    _write_atomically(path, _compress_entry(entry))
+                    result.added += 1
+
+        def _open(name: str) -> SqliteDict:
+            if name not in caches:
+                path = _path_in_data_dir(data_dir, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                migrate_cache_file(path)
+                caches[name] = stack.enter_context(
+                    _open_cache_table(path, journal_mode=_journal_mode(path))
+                )
+            return caches[name]
+
+        def _merge(lines: List[_BundleLine]):
+            pending: Dict[str, Dict[str, CacheEntry]] = {}
+            for line in lines:
+                key = request_digest(line.entry.request)
+                for name in line.caches:
+                    target = _cache_name(name, shared_cache)
+                    pending.setdefault(target, {})[key] = line.entry
+            for name, entries in pending.items():
+                if shared_cache:
+                    _merge_into_directory(name, entries)
+                    continue
+                cache = _open(name)
+                existing = _existing_keys(cache, list(entries.keys()))
+                for key, entry in entries.items():
+                    if key in existing:
+                        result.already_cached += 1
+                    else:
+                        cache[key] = entry
+                        result.added += 1
+                cache.commit()
+
+        with zstandard.open(bundle_path, "rt", encoding="utf-8") as bundle:
+            header = _BundleHeader.model_validate_json(next(bundle))
+            assert header == _BundleHeader(), f"Unsupported cache bundle {header}."
+            batch: List[_BundleLine] = []
+            for text in bundle:
+                batch.append(_BundleLine.model_validate_json(text))
+                if len(batch) == _MAX_KEYS_PER_QUERY:
+                    _merge(batch)
+                    batch = []
+            _merge(batch)
+    return result
+
+
+def _cache_name(name: str, shared_cache: bool) -> str:
+    """The name in a bundle of the same cache, as a DirectoryCache or a cache file."""
+    if name.endswith(".sqlite"):
+        return name[: -len(".sqlite")] if shared_cache else name
+    return name if shared_cache else f"{name}.sqlite"
+
+
+def _existing_keys(cache: SqliteDict, keys: List[str]) -> set:
+    placeholders = ",".join("?" * len(keys))
+    rows = cache.conn.select(
+        f'SELECT key FROM "{cache.tablename}" WHERE key IN ({placeholders})', keys
+    )
+    return {key for (key,) in rows}
+
+
+def _entry_digest(entry: CacheEntry) -> str:
+    return hashlib.sha256(entry.model_dump_json().encode("utf-8")).hexdigest()
+
+
+def _bundle_name(data_dir: str, path: str) -> str:
+    relative = os.path.relpath(path, data_dir)
+    if relative.startswith(os.pardir):
+        raise ValueError(f"Cache file {path} is not in {data_dir}.")
+    return pathlib.PurePath(relative).as_posix()
+
+
+def _path_in_data_dir(data_dir: str, name: str) -> str:
+    parts = pathlib.PurePosixPath(name).parts
+    if name.startswith("/") or os.pardir in parts:
+        raise ValueError(f"Cache bundle refers to a file outside the data_dir: {name}")
+    return os.path.join(data_dir, *parts)
+
+
+def _journal_mode(path: str) -> str:
+    if not os.path.exists(path) or _uses_wal(path):
+        return _WAL
+    return "DELETE"
+
+
+def _uses_wal(path) -> bool:
+    """Check the SQLite file header, as SqliteDict sets the journal mode on connecting."""
+    with open(path, "rb") as f:
+        header = f.read(20)
+    # Bytes 18 and 19 are the file format versions, which are 2 for WAL.
+    return len(header) == 20 and header[18] == 2
+
+
+_T = TypeVar("_T")
+
+
+class DirectoryCache(BaseCache):
+    """Cache each response in its own file, so any number of processes can share it.
+
+    Will create a `file_identifier` directory in `data_dir`, holding one file per
+    request named by its digest. Entries are written to a temporary file and then
+    renamed into place, which is atomic on POSIX file systems including NFS. So
+    readers never see a partial entry and writers never need a lock, even when
+    they are on different hosts sharing the file system. If two processes write
+    the same request, the last one wins. File system errors are retried
+    with exponential backoff, since shared file systems can fail transiently.
+    """
+
+    def __init__(
+        self,
+        data_dir,
+        file_identifier,
+        max_attempts: int = 5,
+        initial_backoff_seconds: float = 0.05,
+    ):
+        assert max_attempts > 0, f"Cannot try {max_attempts} times."
+        self.directory = os.path.join(data_dir, normalize_filename(file_identifier))
+        self.max_attempts = max_attempts
+        self.initial_backoff_seconds = initial_backoff_seconds
+
+    def __enter__(self):
+        self._retry(lambda: os.makedirs(self.directory, exist_ok=True))
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def get_or_call(self, request, callable):
+        """Return the cached value, otherwise cache calling `callable`"""
+        response = self.get_cached_response(request)
+        if response is not None:
+            return response
+        response = callable(request)
+        self.update_cache(request, response)
+        return response
+
+    def get_cached_response(self, request):
+        if not isinstance(request, BaseModel):
+            return None
+        path = self._entry_path(request_digest(TypedData.from_instance(request)))
+        data = self._retry(lambda: _read_if_exists(path))
+        if data is None:
+            return None
+        try:
+            entry = _decompress_entry(data)
+        except Exception:
+            # Someone else may have written a bad entry, so treat it as missing.
+            logging.warning(f"Ignoring unreadable cache entry {path}", exc_info=True)
+            return None
+        return entry.response.to_instance()
+
+    def update_cache(self, request, response):
+        if not isinstance(request, BaseModel) or not isinstance(response, BaseModel):
+            return
+        typed_request = TypedData.from_instance(request)
+        entry = CacheEntry(
+            request=typed_request, response=TypedData.from_instance(response)
+        )
+        path = self._entry_path(request_digest(typed_request))
+        data = _compress_entry(entry)
+        self._retry(lambda: _write_atomically(path, data))
+
+    def _entry_path(self, digest: str) -> str:
+        return _directory_entry_path(self.directory, digest)
+
+    def _retry(self, operation: Callable[[], _T]) -> _T:
+        backoff = self.initial_backoff_seconds
+        attempt = 1
+        while True:
+            try:
+                return operation()
+            except OSError:
+                if attempt >= self.max_attempts:
+                    raise
+                logging.warning(
+                    f"Retrying cache operation in {self.directory}", exc_info=True
+                )
+            time.sleep(backoff)
+            backoff *= 2
+            attempt += 1
+
+
+def _directory_entry_path(directory: str, digest: str) -> str:
+    # Spread entries over subdirectories so no directory gets too large.
+    return os.path.join(directory, digest[:2], digest)
+
+
+def _read_if_exists(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomically(path: str, data: bytes):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Unique per writer, so concurrent writers never share a temporary file.
+    temp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class CacheStatistics(BaseModel):
+    hits: int = 0
+    misses: int = 0
+
+
+class CountingCache(BaseCache):
+    """Count how often lookups in the wrapped cache find a response."""
+
+    def __init__(self, cache: BaseCache):
+        self.cache = cache
+        self.statistics = CacheStatistics()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.cache.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cache.__exit__(*exc_info)
+
+    def get_or_call(self, request, callable):
+        """Return the cached value, otherwise cache calling `callable`"""
+        response = self.get_cached_response(request)
+        if response is not None:
+            return response
+        response = callable(request)
+        self.update_cache(request, response)
+        return response
+
+    def get_cached_response(self, request):
+        return self.get_cached_responses([request])[0]
+
+    def get_cached_responses(self, requests: List) -> List:
+        responses = self.cache.get_cached_responses(requests)
+        hits = sum(response is not None for response in responses)
+        with self._lock:
+            self.statistics.hits += hits
+            self.statistics.misses += len(responses) - hits
+        return responses
+
+    def update_cache(self, request, response):
+        self.cache.update_cache(request, response)
+
+
+class MemoryCacheStatistics(CacheStatistics):
+    evictions: int = 0
+
 
-    def _decode_response(self, encoded_response: TypedData):
-        return encoded_response.to_instance()
+class MemoryCache(BaseCache):
+    """Keep recently used responses in memory, in front of the wrapped cache.
 
-    def _encode_request(self, request) -> str:
-        return TypedData.from_instance(request).model_dump_json()
+    Responses are kept as objects, so a hit skips both reading from the wrapped
+    cache and rebuilding the response. Callers share the returned objects, so they
+    must not modify them. The least recently used responses are evicted once
+    their estimated size passes `max_bytes`. Every write goes through to the
+    wrapped cache as well.
+    """
+
+    def __init__(self, cache: BaseCache, max_bytes: int = 64 * 1024 * 1024):
+        assert max_bytes >= 0, f"Cannot limit memory to {max_bytes} bytes."
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.statistics = MemoryCacheStatistics()
+        self.current_bytes = 0
+        self._entries: OrderedDict[str, Tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.cache.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cache.__exit__(*exc_info)
 
-    def _decode_request(self, request_json: str):
-        return TypedData.model_validate_json(request_json).to_instance()
+    def get_or_call(self, request, callable):
+        """Return the cached value, otherwise cache calling `callable`"""
+        response = self.get_cached_response(request)
+        if response is not None:
+            return response
+        response = callable(request)
+        self.update_cache(request, response)
+        return response
+
+    def get_cached_response(self, request):
+        return self.get_cached_responses([request])[0]
+
+    def get_cached_responses(self, requests: List) -> List:
+        responses: List[Any] = [None] * len(requests)
+        # Requests not in memory, with their index and key
+        missing: List[Tuple[int, Optional[str]]] = []
+        with self._lock:
+            for index, request in enumerate(requests):
+                key = None
+                if isinstance(request, BaseModel):
+                    key = request_digest(TypedData.from_instance(request))
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                        self.statistics.hits += 1
+                        responses[index] = entry[0]
+                        continue
+                    self.statistics.misses += 1
+                missing.append((index, key))
+        if not missing:
+            return responses
+        found = self.cache.get_cached_responses(
+            [requests[index] for index, _ in missing]
+        )
+        for (index, key), response in zip(missing, found):
+            responses[index] = response
+            if key is not None and response is not None:
+                self._remember(key, response)
+        return responses
+
+    def update_cache(self, request, response):
+        self.cache.update_cache(request, response)
+        if isinstance(request, BaseModel) and isinstance(response, BaseModel):
+            self._remember(request_digest(TypedData.from_instance(request)), response)
+
+    def _remember(self, key: str, response: BaseModel):
+        # The size of the serialized response is a reasonable proxy for its memory use.
+        size = len(key) + len(response.model_dump_json())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (response, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.statistics.evictions += 1
+
+
+CACHE_STATISTICS_FILE = "cache_statistics.sqlite"
+CACHE_STATISTICS_DIRECTORY = ".cache_statistics"
+
+
+class _RunCacheStatistics(BaseModel):
+    """One run's statistics, stored in their own file by `record_cache_statistics`."""
+
+    file_identifier: str
+    test_uid: str
+    statistics: CacheStatistics
+
+
+def record_cache_statistics(
+    data_dir: str,
+    file_identifier: str,
+    test_uid: str,
+    statistics: CacheStatistics,
+    shared: bool = False,
+):
+    """Add `statistics` to the running totals for this cache and Test in `data_dir`.
+
+    `file_identifier` is the one the cache was created with, such as the SUT's uid.
+    If `data_dir` is `shared` by many processes, like a DirectoryCache, each run's
+    statistics are written atomically to a file of their own instead of updating
+    totals in SQLite, whose locks aren't reliable on shared file systems.
+    """
+    if shared:
+        run = _RunCacheStatistics(
+            file_identifier=file_identifier, test_uid=test_uid, statistics=statistics
+        )
+        path = os.path.join(
+            data_dir, CACHE_STATISTICS_DIRECTORY, f"{uuid.uuid4().hex}.json"
+        )
+        _write_atomically(path, run.model_dump_json().encode())
+        return
+    os.makedirs(data_dir, exist_ok=True)
+    with _open_statistics(data_dir) as totals:
+        key = json.dumps([file_identifier, test_uid])
+        total = totals.get(key, CacheStatistics())
+        total.hits += statistics.hits
+        total.misses += statistics.misses
+        totals[key] = total
+        totals.commit()
+
+
+def load_cache_statistics(data_dir: str) -> Dict[Tuple[str, str], CacheStatistics]:
+    """Get the totals written by `record_cache_statistics`, keyed by (file_identifier, test_uid)."""
+    totals: Dict[Tuple[str, str], CacheStatistics] = {}
+    if os.path.exists(os.path.join(data_dir, CACHE_STATISTICS_FILE)):
+        with _open_statistics(data_dir) as recorded:
+            for key, value in recorded.items():
+                file_identifier, test_uid = json.loads(key)
+                totals[(file_identifier, test_uid)] = value
+    runs_directory = os.path.join(data_dir, CACHE_STATISTICS_DIRECTORY)
+    if os.path.isdir(runs_directory):
+        for fname in sorted(os.listdir(runs_directory)):
+            if not fname.endswith(".json"):
+                continue
+            with open(os.path.join(runs_directory, fname), "r") as f:
+                run = _RunCacheStatistics.model_validate_json(f.read())
+            total = totals.setdefault(
+                (run.file_identifier, run.test_uid), CacheStatistics()
+            )
+            total.hits += run.statistics.hits
+            total.misses += run.statistics.misses
+    return totals
+
+
+def _open_statistics(data_dir: str) -> SqliteDict:
+    return SqliteDict(
+        os.path.join(data_dir, CACHE_STATISTICS_FILE),
+        tablename="cache_statistics",
+        encode=lambda statistics: statistics.model_dump_json(),
+        decode=CacheStatistics.model_validate_json,
+    )
+
+
+class MissingCacheEntries(LookupError):
+    """Exception describing requests that had to be cached already, but weren't."""
+
+    def __init__(self, descriptions: Sequence[str]):
+        assert descriptions, "Must have at least 1 description to raise an error."
+        self.descriptions = descriptions
+
+    def __str__(self):
+        message = f"Missing {len(self.descriptions)} cache entries:\n"
+        for description in self.descriptions:
+            message += description + "\n"
+        return message
+
+
+def describe_cache_entry(file_identifier: str, request) -> str:
+    """Describe which cache entry `request` needs, for MissingCacheEntries."""
+    if not isinstance(request, BaseModel):
+        return f"{file_identifier}: cannot cache {request!r}"
+    typed_request = TypedData.from_instance(request)
+    request_json = typed_request.model_dump_json()
+    if len(request_json) > _MAX_DESCRIBED_REQUEST_LENGTH:
+        request_json = request_json[:_MAX_DESCRIBED_REQUEST_LENGTH] + "..."
+    return f"{file_identifier}: {request_digest(typed_request)} {request_json}"
+
+
+_MAX_DESCRIBED_REQUEST_LENGTH = 200
+
+
+class ReplayOnlyCache(BaseCache):
+    """Serve responses from `cache`, raising MissingCacheEntries instead of calling anything."""
+
+    def __init__(self, cache: BaseCache, file_identifier: str):
+        self.cache = cache
+        self.file_identifier = file_identifier
+
+    def __enter__(self):
+        self.cache.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cache.__exit__(*exc_info)
+
+    def get_or_call(self, request, callable):
+        return self._get_or_raise(request)
+
+    async def get_or_call_async(self, request, async_callable):
+        return self._get_or_raise(request)
+
+    def get_cached_response(self, request):
+        return self.cache.get_cached_response(request)
+
+    def get_cached_responses(self, requests: List) -> List:
+        return self.cache.get_cached_responses(requests)
+
+    def update_cache(self, request, response):
+        self.cache.update_cache(request, response)
+
+    def _get_or_raise(self, request):
+        response = self.get_cached_response(request)
+        if response is None:
+            raise MissingCacheEntries(
+                [describe_cache_entry(self.file_identifier, request)]
+            )
+        return response
 
 
 class NoCache(BaseCache):
@@ -0,0 +1,182 @@
+from typing import Any, Callable, Dict, List, Type, TypeVar
+
+from pydantic import BaseModel
+
+from newhelm.annotation import Annotation
+from newhelm.base_annotator import (
+    BaseCompletionAnnotator,
+    completion_request_key,
+    unique_completion_requests,
+)
+from newhelm.cascade_statistics import CHEAP_TIER, EXPENSIVE_TIER
+from newhelm.single_turn_prompt_response import PromptInteraction
+from newhelm.sut import SUTCompletion
+
+_BaseModelType = TypeVar("_BaseModelType", bound=BaseModel)
+
+
+class CascadeCompletionRequest(BaseModel):
+    """The requests each tier would need to score a single completion."""
+
+    cheap: Annotation
+    expensive: Annotation
+
+
+class CascadeCompletion(BaseModel):
+    """The score for a single completion, and which tier produced it."""
+
+    tier: str
+    annotation: Annotation
+
+
+class CascadeAnnotation(BaseModel):
+    """The expensive annotator's annotation, with some completions scored by the cheap one.
+
+    Tests using a CascadeAnnotator get this wrapper rather than the expensive
+    annotator's annotation, so read the latter with `get_annotation`.
+    """
+
+    annotation: Annotation
+    """Made by the expensive annotator's `make_annotation` from every tier's scores."""
+
+    tiers: List[List[str]]
+    """Which tier scored each completion, grouped by interaction."""
+
+    def get_annotation(self, cls: Type[_BaseModelType]) -> _BaseModelType:
+        """Convenience function for getting the strongly typed annotation."""
+        return self.annotation.to_instance(cls)
+
+
+class CascadeAnnotator(
+    BaseCompletionAnnotator[
+        CascadeAnnotation, CascadeCompletionRequest, CascadeCompletion
+    ]
+):
+    """Only send the completions a cheap annotator isn't confident about to an expensive one.
+
+    Both annotators must score completions using the same type, so the result looks
+    the same no matter which tier scored a completion. `is_confident` decides if the
+    cheap annotator's score for a completion can be used as is.
+    """
+
+    def __init__(
+        self,
+        cheap: BaseCompletionAnnotator,
+        expensive: BaseCompletionAnnotator,
+        is_confident: Callable[[Any], bool],
+    ):
+        self.cheap = cheap
+        self.expensive = expensive
+        self.is_confident = is_confident
+
+    def make_completion_request(
+        self, interaction: PromptInteraction, completion: SUTCompletion
+    ) -> CascadeCompletionRequest:
+        return CascadeCompletionRequest(
+            cheap=Annotation.from_instance(
+                self.cheap.make_completion_request(interaction, completion)
+            ),
+            expensive=Annotation.from_instance(
+                self.expensive.make_completion_request(interaction, completion)
+            ),
+        )
+
+    def annotate_completions(
+        self, requests: List[CascadeCompletionRequest]
+    ) -> List[CascadeCompletion]:
+        cheap_scores = self.cheap.annotate_completions(
+            [request.cheap.to_instance() for request in requests]
+        )
+        confident = self._check_confidence(requests, cheap_scores)
+        ambiguous = self._ambiguous_requests(requests, confident)
+        expensive_scores = []
+        if ambiguous:
+            expensive_scores = self.expensive.annotate_completions(
+                list(ambiguous.values())
+            )
+        return self._combine(
+            requests, cheap_scores, confident, ambiguous, expensive_scores
+        )
+
+    async def annotate_completions_async(
+        self, requests: List[CascadeCompletionRequest]
+    ) -> List[CascadeCompletion]:
+        cheap_scores = await self.cheap.annotate_completions_async(
+            [request.cheap.to_instance() for request in requests]
+        )
+        confident = self._check_confidence(requests, cheap_scores)
+        ambiguous = self._ambiguous_requests(requests, confident)
+        expensive_scores = []
+        if ambiguous:
+            expensive_scores = await self.expensive.annotate_completions_async(
+                list(ambiguous.values())
+            )
+        return self._combine(
+            requests, cheap_scores, confident, ambiguous, expensive_scores
+        )
+
+    def make_annotation(
+        self, completion_annotations: List[List[CascadeCompletion]]
+    ) -> CascadeAnnotation:
+        annotation = self.expensive.make_annotation(
+            [
+                [completion.annotation.to_instance() for completion in row]
+                for row in completion_annotations
+            ]
+        )
+        return CascadeAnnotation(
+            annotation=Annotation.from_instance(annotation),
+            tiers=[
+                [completion.tier for completion in row]
+                for row in completion_annotations
+            ],
+        )
+
+    def _check_confidence(
+        self, requests: List[CascadeCompletionRequest], cheap_scores: List
+    ) -> List[bool]:
+        assert len(cheap_scores) == len(requests), (
+            f"Cheap annotator returned {len(cheap_scores)} scores "
+            f"for {len(requests)} requests."
+        )
+        return [self.is_confident(score) for score in cheap_scores]
+
+    def _ambiguous_requests(
+        self, requests: List[CascadeCompletionRequest], confident: List[bool]
+    ) -> Dict[str, Any]:
+        """Map the key of each distinct request for the expensive annotator to the request."""
+        return unique_completion_requests(
+            [
+                [request.expensive.to_instance()]
+                for request, is_confident in zip(requests, confident)
+                if not is_confident
+            ]
+        )
+
+    def _combine(
+        self,
+        requests: List[CascadeCompletionRequest],
+        cheap_scores: List,
+        confident: List[bool],
+        ambiguous: Dict[str, Any],
+        expensive_scores: List,
+    ) -> List[CascadeCompletion]:
+        assert len(expensive_scores) == len(ambiguous), (
+            f"Expensive annotator returned {len(expensive_scores)} scores "
+            f"for {len(ambiguous)} requests."
+        )
+        by_key = dict(zip(ambiguous.keys(), expensive_scores))
+        completions = []
+        for request, cheap_score, is_confident in zip(
+            requests, cheap_scores, confident
+        ):
+            if is_confident:
+                tier, score = CHEAP_TIER, cheap_score
+            else:
+                expensive_request: BaseModel = request.expensive.to_instance()
+                tier = EXPENSIVE_TIER
+                score = by_key[completion_request_key(expensive_request)]
+            completions.append(
+                CascadeCompletion(tier=tier, annotation=Annotation.from_instance(score))
+            )
+        return completions
@@ -0,0 +1,34 @@
+from typing import List
+
+from pydantic import BaseModel, computed_field
+
+CHEAP_TIER = "cheap"
+EXPENSIVE_TIER = "expensive"
+
+
+class CascadeStatistics(BaseModel):
+    """How much of a run's annotation work each tier of a CascadeAnnotator did."""
+
+    cheap_completions: int = 0
+    expensive_completions: int = 0
+
+    @computed_field  # type: ignore[misc]
+    @property
+    def fraction_saved(self) -> float:
+        """Fraction of completions that didn't need the expensive annotator."""
+        total = self.cheap_completions + self.expensive_completions
+        return self.cheap_completions / total if total else 0.0
+
+    def count(self, tiers: List[List[str]]):
+        """Add which tier scored each completion, grouped by interaction, to the totals."""
+        for row in tiers:
+            for tier in row:
+                if tier == CHEAP_TIER:
+                    self.cheap_completions += 1
+                else:
+                    self.expensive_completions += 1
+
+    def add(self, other: "CascadeStatistics"):
+        """Add the totals from another run, such as a different shard."""
+        self.cheap_completions += other.cheap_completions
+        self.expensive_completions += other.expensive_completions
@@ -1,7 +1,20 @@
-from typing import Optional
+import os
+from typing import List, Optional
 import click
 
+from newhelm.caching import (
+    CACHE_STATISTICS_DIRECTORY,
+    CACHE_STATISTICS_FILE,
+    compact_cache_file,
+    export_cache_bundle,
+    find_cache_files,
+    import_cache_bundle,
+    load_cache_statistics,
+    migrate_cache_file,
+    summarize_cache_file,
+)
 from newhelm.command_line import (
+    DATA_DIR_OPTION,
     SUT_OPTION,
     display_header,
     display_list_item,
@@ -150,6 +163,125 @@ def run_sut(
     click.echo(f"Normalized response: {result.model_dump_json(indent=2)}\n")
 
 
+@newhelm_cli.group()
+def cache() -> None:
+    """Manage the files that cache SUT responses and annotations."""
+
+
+@cache.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+def migrate(paths: List[str]) -> None:
+    """Convert cache files to the current format.
+
+    PATHS can be cache files or directories to search for .sqlite files, such as run_data.
+    """
+    for path in find_cache_files(paths):
+        migrated = migrate_cache_file(path)
+        if migrated:
+            click.echo(f"Migrated {migrated} entries in {path}")
+        else:
+            click.echo(f"Already up to date: {path}")
+
+
+@cache.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--max-bytes",
+    type=click.IntRange(min=0),
+    help="Evict the least recently used entries until each cache holds at most this much.",
+)
+@click.option(
+    "--max-age-days",
+    type=click.FloatRange(min=0),
+    help="Evict entries that haven't been used in this many days.",
+)
+def compact(
+    paths: List[str], max_bytes: Optional[int], max_age_days: Optional[float]
+) -> None:
+    """Evict unused entries from cache files and shrink the files.
+
+    PATHS can be cache files or directories to search for .sqlite files, such as run_data.
+    Without any limits this just gives unused space back to the file system.
+    """
+    max_age_seconds = None if max_age_days is None else max_age_days * 24 * 60 * 60
+    for path in find_cache_files(paths):
+        result = compact_cache_file(path, max_bytes, max_age_seconds)
+        click.echo(
+            f"Compacted {path}: evicted {result.evicted_entries} entries, "
+            f"{result.file_bytes_before} -> {result.file_bytes_after} bytes"
+        )
+
+
+@cache.command()
+@DATA_DIR_OPTION
+def stats(data_dir: str) -> None:
+    """Show the size of each cache, and how often each Test found its entries already cached."""
+    for directory, directories, files in sorted(os.walk(data_dir)):
+        cache_files = [
+            os.path.join(directory, fname)
+            for fname in sorted(files)
+            if fname.endswith(".sqlite") and fname != CACHE_STATISTICS_FILE
+        ]
+        has_statistics = (
+            CACHE_STATISTICS_FILE in files or CACHE_STATISTICS_DIRECTORY in directories
+        )
+        if not cache_files and not has_statistics:
+            continue
+        display_header(directory)
+        for path in cache_files:
+            summary = summarize_cache_file(path)
+            display_list_item(
+                f"file={os.path.basename(path)} entries={summary.entries} "
+                f"entry_bytes={summary.entry_bytes} file_bytes={summary.file_bytes}"
+            )
+        for (identifier, test_uid), statistics in sorted(
+            load_cache_statistics(directory).items()
+        ):
+            lookups = statistics.hits + statistics.misses
+            hit_ratio = statistics.hits / lookups if lookups else 0.0
+            display_list_item(
+                f"cache={identifier} test={test_uid} hits={statistics.hits} "
+                f"misses={statistics.misses} hit_ratio={hit_ratio:.1%}"
+            )
+
+
+@cache.command("export")
+@click.argument("bundle", type=click.Path(dir_okay=False))
+@click.argument("paths", nargs=-1, type=click.Path(exists=True))
+@DATA_DIR_OPTION
+def export_caches(bundle: str, paths: List[str], data_dir: str) -> None:
+    """Write cache entries to a single compressed BUNDLE file.
+
+    PATHS can be cache files or directories within --data-dir, such as the directory of a
+    single Test or a single SUT's cache file. Caches written with --shared-cache are
+    included too. Defaults to everything in --data-dir.
+    """
+    try:
+        written = export_cache_bundle(bundle, data_dir, paths or [data_dir])
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="PATHS") from e
+    click.echo(f"Exported {written} entries to {bundle}")
+
+
+@cache.command("import")
+@click.argument("bundle", type=click.Path(exists=True, dir_okay=False))
+@DATA_DIR_OPTION
+@click.option(
+    "--shared-cache",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Import into the caches that runs with --shared-cache use.",
+)
+def import_caches(bundle: str, data_dir: str, shared_cache: bool) -> None:
+    """Merge the entries in a BUNDLE file into the caches in --data-dir."""
+    result = import_cache_bundle(bundle, data_dir, shared_cache)
+    click.echo(
+        f"Imported {result.added} entries from {bundle}, "
+        f"{result.already_cached} were already cached"
+    )
+
+
 if __name__ == "__main__":
     load_plugins()
     newhelm_cli()
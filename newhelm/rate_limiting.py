@@ -0,0 +1,200 @@
+import asyncio
+from contextlib import contextmanager
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+from pydantic import BaseModel
+
+from newhelm.general import normalize_filename
+
+RequestType = TypeVar("RequestType")
+ResponseType = TypeVar("ResponseType")
+
+# Rough number of characters per token for English text.
+_CHARACTERS_PER_TOKEN = 4
+
+
+class RateLimit(BaseModel):
+    """How much a SUT or annotator may be called, typically its provider's quota."""
+
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+class RateLimiter:
+    """Token bucket that makes callers wait until they are under a RateLimit.
+
+    Each bucket refills continuously and holds at most one second's worth, or a single
+    call's worth at low rates, so calls are spread evenly rather than sent in bursts.
+    A call that needs more than the bucket has is still let through once the bucket
+    would have refilled enough, so requests larger than the bucket don't block forever.
+
+    Given a `state_path`, the buckets are kept in that file instead of in memory, so
+    every process using the same file shares the same limit. This relies on `fcntl`
+    file locks, so it isn't available on Windows.
+    """
+
+    def __init__(self, limit: RateLimit, state_path: Optional[str] = None):
+        for name, value in limit:
+            assert value is None or value > 0, f"Cannot limit {name} to {value}."
+        self.limit = limit
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = _BucketState(updated=time.time())
+        if state_path is not None:
+            directory = os.path.dirname(state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, requests: int = 1, tokens: int = 0):
+        """Block until `requests` calls using a total of `tokens` tokens can be made."""
+        delay = self._reserve(requests, tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, requests: int = 1, tokens: int = 0):
+        """Async version of `acquire`, which waits without blocking the event loop."""
+        if self.state_path is None:
+            delay = self._reserve(requests, tokens)
+        else:
+            # Locking and reading the shared file can block, so do it in a thread.
+            delay = await asyncio.get_running_loop().run_in_executor(
+                None, self._reserve, requests, tokens
+            )
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _reserve(self, requests: int, tokens: int) -> float:
+        """Take what the call needs from the buckets, returning how long to wait first."""
+        with self._locked_state() as state:
+            now = time.time()
+            elapsed = max(0.0, now - state.updated)
+            state.updated = now
+            state.requests, request_delay = _take(
+                state.requests, requests, self.limit.requests_per_minute, elapsed
+            )
+            state.tokens, token_delay = _take(
+                state.tokens, tokens, self.limit.tokens_per_minute, elapsed
+            )
+        return max(request_delay, token_delay)
+
+    @contextmanager
+    def _locked_state(self) -> Iterator["_BucketState"]:
+        with self._lock:
+            if self.state_path is None:
+                yield self._state
+                return
+            import fcntl
+
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    state = (
+                        _BucketState.model_validate_json(content)
+                        if content
+                        else _BucketState(updated=time.time())
+                    )
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(state.model_dump_json())
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class _BucketState(BaseModel):
+    """How full each bucket is, as of `updated`. None means the bucket is full."""
+
+    updated: float
+    requests: Optional[float] = None
+    tokens: Optional[float] = None
+
+
+def _take(
+    level: Optional[float],
+    amount: int,
+    per_minute: Optional[float],
+    elapsed: float,
+):
+    """Take `amount` from a bucket, returning its new level and how long to wait."""
+    if per_minute is None:
+        return None, 0.0
+    per_second = per_minute / 60
+    # Below one a second, the first call would otherwise have to wait for a refill.
+    capacity = max(1.0, per_second)
+    level = capacity if level is None else min(capacity, level + elapsed * per_second)
+    # The level goes negative when callers have to wait, so later callers queue up.
+    level -= amount
+    return level, max(0.0, -level / per_second)
+
+
+def make_rate_limiter(
+    limit: Optional[RateLimit], state_directory: Optional[str], name: str
+) -> Optional[RateLimiter]:
+    """Make a RateLimiter if there is a `limit`, sharing it through `state_directory` if given."""
+    if limit is None:
+        return None
+    state_path = None
+    if state_directory is not None:
+        state_path = os.path.join(state_directory, normalize_filename(f"{name}.json"))
+    return RateLimiter(limit, state_path)
+
+
+def estimate_tokens(request: Any) -> int:
+    """Roughly how many tokens sending `request` costs, based on its length."""
+    if isinstance(request, BaseModel):
+        text = request.model_dump_json()
+    else:
+        text = json.dumps(request, default=str)
+    return math.ceil(len(text) / _CHARACTERS_PER_TOKEN)
+
+
+def _one_request(request: Any) -> int:
+    return 1
+
+
+def rate_limited(
+    function: Callable[[RequestType], ResponseType],
+    rate_limiter: Optional[RateLimiter],
+    count_tokens: Callable[[RequestType], int] = estimate_tokens,
+    count_requests: Callable[[RequestType], int] = _one_request,
+) -> Callable[[RequestType], ResponseType]:
+    """Wrap `function` so every call first waits for `rate_limiter`.
+
+    Each call counts as `count_requests` requests, for functions that make several.
+    """
+    if rate_limiter is None:
+        return function
+    limiter = rate_limiter
+
+    def _limited(request: RequestType) -> ResponseType:
+        limiter.acquire(requests=count_requests(request), tokens=count_tokens(request))
+        return function(request)
+
+    return _limited
+
+
+def rate_limited_async(
+    function: Callable[[RequestType], Awaitable[ResponseType]],
+    rate_limiter: Optional[RateLimiter],
+    count_tokens: Callable[[RequestType], int] = estimate_tokens,
+    count_requests: Callable[[RequestType], int] = _one_request,
+) -> Callable[[RequestType], Awaitable[ResponseType]]:
+    """Async version of `rate_limited`."""
+    if rate_limiter is None:
+        return function
+    limiter = rate_limiter
+
+    async def _limited(request: RequestType) -> ResponseType:
+        await limiter.acquire_async(
+            requests=count_requests(request), tokens=count_tokens(request)
+        )
+        return await function(request)
+
+    return _limited
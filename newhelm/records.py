@@ -1,16 +1,25 @@
-from typing import Dict, List, Mapping
+import os
+import uuid
+from typing import Dict, Iterator, List, Mapping, Optional, TextIO
 
-from pydantic import AwareDatetime, BaseModel, Field
-from newhelm.annotation import Annotation
-from typing import Dict, List, Mapping
+from pydantic import (
+    AwareDatetime,
+    BaseModel,
+    Field,
+    SerializerFunctionWrapHandler,
+    ValidationError,
+    model_serializer,
+)
 from newhelm.annotation import Annotation
 from newhelm.base_test import TestResult
+from newhelm.cascade_statistics import CascadeStatistics
 from newhelm.general import current_local_datetime
 from newhelm.record_init import InitializationRecord
 from newhelm.single_turn_prompt_response import (
     PromptInteraction,
     TestItem,
 )
+from newhelm.sut import SUTResponse
 
 
 class TestItemRecord(BaseModel):
@@ -37,5 +46,254 @@ class TestRecord(BaseModel):
     # there to b different schemas for different TestImplementationClasses.
     test_item_records: List[TestItemRecord]
     result: TestResult
+    cascade_statistics: Dict[str, CascadeStatistics] = Field(default_factory=dict)
+    """For each CascadeAnnotator, how many completions each of its tiers scored."""
+
+    @model_serializer(mode="wrap")
+    def _serialize(self, handler: SerializerFunctionWrapHandler):
+        return _drop_empty_cascade_statistics(self, handler(self))
+
+    __test__ = False
+
+
+class Shard(BaseModel):
+    """Which part of a Test's TestItems a run processed, see `shard_test_items`."""
+
+    index: int
+    count: int
+
+
+class TestRecordHeader(BaseModel):
+    """Everything in a TestRecord that is known before any TestItems are processed."""
+
+    run_timestamp: AwareDatetime = Field(default_factory=current_local_datetime)
+    test_uid: str
+    test_initialization: InitializationRecord
+    dependency_versions: Mapping[str, str]
+    sut_uid: str
+    sut_initialization: InitializationRecord
+    shard: Optional[Shard] = None
+    """Only set if the run processed one shard of the TestItems."""
+
+    __test__ = False
+
+
+class TestRecordSummary(BaseModel):
+    """Everything in a TestRecord that is only known after every TestItem is processed."""
+
+    result: TestResult
+    cascade_statistics: Dict[str, CascadeStatistics] = Field(default_factory=dict)
+
+    @model_serializer(mode="wrap")
+    def _serialize(self, handler: SerializerFunctionWrapHandler):
+        return _drop_empty_cascade_statistics(self, handler(self))
+
+    __test__ = False
+
+
+def _drop_empty_cascade_statistics(model, data: dict) -> dict:
+    """Runs without a CascadeAnnotator serialize as they did before cascades existed."""
+    if not model.cascade_statistics:
+        data.pop("cascade_statistics", None)
+    return data
+
+
+def make_test_record(
+    header: TestRecordHeader,
+    test_item_records: List[TestItemRecord],
+    summary: TestRecordSummary,
+) -> TestRecord:
+    """Combine the parts of a streamed TestRecord."""
+    return TestRecord(
+        **{name: value for name, value in header if name != "shard"},
+        test_item_records=test_item_records,
+        **dict(summary),
+    )
+
+
+class _StreamedTestItemRecord(BaseModel):
+    """A TestItemRecord that doesn't repeat the TestItem's prompts in its interactions."""
+
+    test_item: TestItem
+    responses: Optional[List[SUTResponse]] = None
+    """The SUT's response to each of the TestItem's prompts, in order."""
+    interactions: Optional[List[PromptInteraction]] = None
+    """Only used if the interactions aren't one per prompt, in order."""
+    annotations: Dict[str, Annotation]
+    measurements: Dict[str, float]
+
+    @classmethod
+    def from_record(cls, record: TestItemRecord) -> "_StreamedTestItemRecord":
+        prompts = [interaction.prompt for interaction in record.interactions]
+        if prompts == record.test_item.prompts:
+            return cls(
+                test_item=record.test_item,
+                responses=[interaction.response for interaction in record.interactions],
+                annotations=record.annotations,
+                measurements=record.measurements,
+            )
+        return cls(
+            test_item=record.test_item,
+            interactions=record.interactions,
+            annotations=record.annotations,
+            measurements=record.measurements,
+        )
+
+    def to_record(self) -> TestItemRecord:
+        interactions = self.interactions
+        if interactions is None:
+            assert self.responses is not None
+            interactions = [
+                PromptInteraction(prompt=prompt, response=response)
+                for prompt, response in zip(self.test_item.prompts, self.responses)
+            ]
+        return TestItemRecord(
+            test_item=self.test_item,
+            interactions=interactions,
+            annotations=self.annotations,
+            measurements=self.measurements,
+        )
+
+
+class _StreamedLine(BaseModel):
+    """Each line of a streamed TestRecord sets exactly one of these."""
+
+    header: Optional[TestRecordHeader] = None
+    item: Optional[_StreamedTestItemRecord] = None
+    summary: Optional[TestRecordSummary] = None
+
+
+class TestRecordWriter:
+    """Write a TestRecord one line at a time, so it never has to be in memory at once.
+
+    The file is a header line, one line per TestItemRecord, then a summary line.
+    Use `TestRecordReader` to read it back. Lines go to a temporary file, which only
+    replaces `path` if the context exits without an exception, so a failed run
+    leaves any existing file at `path` alone.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[TextIO] = None
+        self._temp_path: Optional[str] = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Unique per writer, so concurrent writers never share a temporary file.
+        self._temp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        self._file = open(self._temp_path, "w")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        assert self._temp_path is not None
+        if exc_type is None:
+            os.replace(self._temp_path, self.path)
+        else:
+            os.remove(self._temp_path)
+        self._temp_path = None
+
+    def write_header(self, header: TestRecordHeader):
+        self._write(_StreamedLine(header=header))
+
+    def write_test_item_record(self, record: TestItemRecord):
+        self._write(_StreamedLine(item=_StreamedTestItemRecord.from_record(record)))
+
+    def write_summary(self, summary: TestRecordSummary):
+        self._write(_StreamedLine(summary=summary))
+
+    def _write(self, line: _StreamedLine):
+        assert self._file is not None, "TestRecordWriter must be used as a context."
+        # Only leave out the unused parts of the line, as nested None values matter.
+        unused = {name for name, value in line if value is None}
+        self._file.write(line.model_dump_json(exclude=unused) + "\n")
+
+    __test__ = False
+
+
+def write_test_record(test_record: TestRecord, path: str):
+    """Write an in memory TestRecord in the format of TestRecordWriter."""
+    with TestRecordWriter(path) as writer:
+        writer.write_header(
+            TestRecordHeader(
+                **{
+                    name: getattr(test_record, name)
+                    for name in TestRecordHeader.model_fields
+                    if name != "shard"
+                }
+            )
+        )
+        for record in test_record.test_item_records:
+            writer.write_test_item_record(record)
+        writer.write_summary(
+            TestRecordSummary(
+                **{
+                    name: getattr(test_record, name)
+                    for name in TestRecordSummary.model_fields
+                }
+            )
+        )
+
+
+class TestRecordReader:
+    """Read a file written by TestRecordWriter, one TestItemRecord at a time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "r") as f:
+            content = f.readline()
+        if not content:
+            raise ValueError(f"{path} is empty, so it doesn't hold a TestRecord.")
+        try:
+            first_line = _StreamedLine.model_validate_json(content)
+        except ValidationError as e:
+            raise ValueError(
+                f"{path} doesn't start with a TestRecord header: {e}"
+            ) from e
+        if first_line.header is None:
+            raise ValueError(f"{path} doesn't start with a TestRecord header.")
+        self.header: TestRecordHeader = first_line.header
+
+    def test_item_records(self) -> Iterator[TestItemRecord]:
+        """Lazily read each TestItemRecord, in order."""
+        for line in self._lines():
+            if line.item is not None:
+                yield line.item.to_record()
+
+    @property
+    def summary(self) -> Optional[TestRecordSummary]:
+        """The summary, or None if the run didn't finish writing the record."""
+        with open(self.path, "rb") as f:
+            # The summary is the last line, so avoid reading all the items to find it.
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            last_line = b""
+            while position > 0:
+                step = min(position, 1 << 16)
+                position -= step
+                f.seek(position)
+                last_line = f.read(step) + last_line
+                if last_line.rstrip(b"\n").rfind(b"\n") >= 0:
+                    break
+        content = last_line.rstrip(b"\n")
+        line = _StreamedLine.model_validate_json(content[content.rfind(b"\n") + 1 :])
+        return line.summary
+
+    def to_test_record(self) -> TestRecord:
+        """Read everything into a single TestRecord."""
+        summary = self.summary
+        assert summary is not None, f"{self.path} is missing its summary."
+        return make_test_record(self.header, list(self.test_item_records()), summary)
+
+    def _lines(self) -> Iterator[_StreamedLine]:
+        with open(self.path, "r") as f:
+            next(f)  # Skip the header
+            for line in f:
+                yield _StreamedLine.model_validate_json(line)
 
     __test__ = False
@@ -0,0 +1,172 @@
+import asyncio
+from contextlib import ExitStack
+from typing import Dict, List, Optional
+from tqdm import tqdm
+from newhelm.annotation import Annotation
+from newhelm.base_test import BasePromptResponseTest
+from newhelm.caching import BaseCache
+from newhelm.rate_limiting import RateLimiter, rate_limited_async
+from newhelm.records import Shard, TestItemRecord, TestRecord, TestRecordWriter
+from newhelm.runners.simple_test_runner import (
+    AnnotateTestItemRequest,
+    AnnotatorData,
+    TestRunSetup,
+    measure_test_item,
+    prefetch_sut_responses,
+    translate_prompt,
+)
+from newhelm.single_turn_prompt_response import PromptInteraction, TestItem
+from newhelm.sut import AsyncPromptResponseSUT, PromptResponseSUT
+
+
+async def run_prompt_response_test_async(
+    test: BasePromptResponseTest,
+    sut: PromptResponseSUT,
+    data_dir: str,
+    max_test_items: Optional[int] = None,
+    use_caching: bool = True,
+    disable_progress_bar: bool = False,
+    max_concurrency: int = 100,
+    shared_cache: bool = False,
+    global_sut_cache: bool = False,
+    replay_only: bool = False,
+    resume: bool = False,
+    record_writer: Optional[TestRecordWriter] = None,
+    shard: Optional[Shard] = None,
+    rate_limit_directory: Optional[str] = None,
+) -> TestRecord:
+    """Run a single Test on a single SUT using one asyncio event loop.
+
+    Up to `max_concurrency` TestItems are in flight at once. With a `record_writer`,
+    a TestItem only starts once the one `2 * max_concurrency` before it is done, so
+    few records wait on a slow one. SUTs that implement AsyncPromptResponseSUT and
+    annotators that override `annotate_test_item_async` run natively in the event
+    loop, everything else runs in a thread. All of a Test's annotators work on a
+    TestItem at the same time.
+    TestItemRecords are returned in the same order as the TestItems.
+    See `run_prompt_response_test` for the other options.
+    """
+    assert (
+        max_concurrency > 0
+    ), f"Cannot run a test with max_concurrency {max_concurrency}."
+    run = TestRunSetup(
+        test,
+        sut,
+        data_dir,
+        max_test_items,
+        use_caching,
+        shared_cache,
+        global_sut_cache,
+        replay_only,
+        resume,
+        record_writer,
+        shard,
+        rate_limit_directory,
+    )
+    semaphore = asyncio.Semaphore(max_concurrency)
+    progress = tqdm(
+        desc=run.progress_description,
+        total=len(run.test_items),
+        disable=disable_progress_bar,
+    )
+
+    async def _process(index: int, sut_cache: BaseCache):
+        async with semaphore:
+            record = await _process_test_item_async(
+                run.test_items[index],
+                test,
+                sut,
+                sut_cache,
+                run.annotators,
+                run.sut_rate_limiter,
+            )
+        run.add_test_item_record(index, record)
+        progress.update()
+
+    with ExitStack() as stack:
+        run.open_caches(stack)
+        run.open_journal(stack)
+        stack.callback(progress.close)
+        sut_cache = prefetch_sut_responses(
+            run, disable_progress_bar=disable_progress_bar
+        )
+        look_ahead = len(run.test_items)
+        if record_writer is not None:
+            # Records wait for every earlier one to be written, so bound how many can.
+            look_ahead = 2 * max_concurrency
+        tasks: List[asyncio.Future] = []
+        try:
+            for index in range(len(run.test_items)):
+                if index >= look_ahead:
+                    await tasks[index - look_ahead]
+                tasks.append(asyncio.ensure_future(_process(index, sut_cache)))
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Make sure nothing is still running when the caches close.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    return run.make_test_record()
+
+
+async def _process_test_item_async(
+    item: TestItem,
+    test: BasePromptResponseTest,
+    sut: PromptResponseSUT,
+    sut_cache: BaseCache,
+    annotators: List[AnnotatorData],
+    sut_rate_limiter: Optional[RateLimiter] = None,
+) -> TestItemRecord:
+    evaluate = rate_limited_async(
+        _get_evaluate_async(sut), sut_rate_limiter, sut.estimate_tokens
+    )
+    interactions: List[PromptInteraction] = []
+    for prompt in item.prompts:
+        sut_request = translate_prompt(sut, prompt)
+        try:
+            sut_response = await sut_cache.get_or_call_async(sut_request, evaluate)
+        except Exception as e:
+            raise Exception(
+                f"Exception while handling SUT request `{sut_request}` for TestItem `{item}`"
+            ) from e
+        response = sut.translate_response(sut_request, sut_response)
+        interactions.append(PromptInteraction(prompt=prompt, response=response))
+
+    annotations = await asyncio.gather(
+        *[_annotate_async(annotator, interactions) for annotator in annotators]
+    )
+    # gather keeps the order of its inputs, so the keys are always in the same order.
+    annotations_per_annotator: Dict[str, Annotation] = {
+        annotator.key: annotation
+        for annotator, annotation in zip(annotators, annotations)
+    }
+    return measure_test_item(test, item, interactions, annotations_per_annotator)
+
+
+async def _annotate_async(
+    annotator: AnnotatorData, interactions: List[PromptInteraction]
+) -> Annotation:
+    request = AnnotateTestItemRequest(interactions=interactions)
+
+    async def _do_annotation(interaction_list: AnnotateTestItemRequest):
+        return await annotator.annotate_async(interaction_list.interactions)
+
+    try:
+        annotation = await annotator.cache.get_or_call_async(request, _do_annotation)
+    except Exception as e:
+        raise Exception(
+            f"Exception while handling annotation for {annotator.key} on {interactions}"
+        ) from e
+    return Annotation.from_instance(annotation)
+
+
+def _get_evaluate_async(sut: PromptResponseSUT):
+    """Get an awaitable version of the SUT's evaluate, using a thread for sync-only SUTs."""
+    if isinstance(sut, AsyncPromptResponseSUT):
+        return sut.evaluate_async
+
+    async def _evaluate_in_thread(request):
+        return await asyncio.to_thread(sut.evaluate, request)
+
+    return _evaluate_in_thread
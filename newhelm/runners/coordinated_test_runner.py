@@ -0,0 +1,192 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import ExitStack
+import os
+import socket
+import threading
+import time
+import traceback
+from typing import Optional
+from tqdm import tqdm
+from newhelm.base_test import BasePromptResponseTest
+from newhelm.records import TestRecord, TestRecordWriter
+from newhelm.runners.run_journal import journal_key
+from newhelm.runners.simple_test_runner import (
+    TestRunSetup,
+    annotate_with_all,
+    collect_sut_interactions,
+    measure_test_item,
+)
+from newhelm.runners.work_queue import DONE, FAILED, SKIPPED, WorkQueue
+from newhelm.sut import PromptResponseSUT
+
+
+def run_prompt_response_test_coordinated(
+    test: BasePromptResponseTest,
+    sut: PromptResponseSUT,
+    data_dir: str,
+    work_queue: WorkQueue,
+    max_test_items: Optional[int] = None,
+    disable_progress_bar: bool = False,
+    resume: bool = False,
+    record_writer: Optional[TestRecordWriter] = None,
+    poll_seconds: float = 1.0,
+) -> TestRecord:
+    """Let `run_worker` processes do the work of running a single Test on a single SUT.
+
+    Every TestItem is put in `work_queue`, then this waits until workers have finished
+    all of them and aggregates their TestItemRecords, in the same order as the TestItems.
+    Restarting with the same `work_queue` picks up where the previous coordinator left
+    off. With `resume`, TestItems already in the journal are skipped by the workers.
+    See `run_prompt_response_test` for the other options.
+    """
+    run = TestRunSetup(
+        test,
+        sut,
+        data_dir,
+        max_test_items,
+        use_caching=False,
+        resume=resume,
+        record_writer=record_writer,
+    )
+    # Fill with every TestItem, so the queue is the same however much was resumed.
+    pending = {position: index for index, position in enumerate(run.positions)}
+    work_queue.fill(
+        test.uid,
+        sut.uid,
+        run.all_test_items,
+        skip={
+            position
+            for position in range(len(run.all_test_items))
+            if position not in pending
+        },
+    )
+
+    with ExitStack() as stack:
+        run.open_journal(stack)
+        progress = stack.enter_context(
+            tqdm(
+                desc=run.progress_description,
+                total=len(run.all_test_items),
+                disable=disable_progress_bar,
+            )
+        )
+        while True:
+            counts = work_queue.counts()
+            finished = counts[DONE] + counts[FAILED] + counts[SKIPPED]
+            progress.update(finished - progress.n)
+            if work_queue.is_finished():
+                break
+            time.sleep(poll_seconds)
+
+        errors = work_queue.errors()
+        if errors:
+            position, error = min(errors.items())
+            raise Exception(
+                f"{len(errors)} TestItems failed too many times in {work_queue.path}. "
+                f"The first one, `{run.all_test_items[position]}`, failed with:\n{error}"
+            )
+        for position, record in work_queue.records():
+            # A worker may finish a TestItem the journal already has, keep the journal's.
+            if position in pending:
+                run.add_test_item_record(pending[position], record)
+    return run.make_test_record()
+
+
+def run_worker(
+    test: BasePromptResponseTest,
+    sut: PromptResponseSUT,
+    data_dir: str,
+    work_queue: WorkQueue,
+    use_caching: bool = True,
+    shared_cache: bool = False,
+    global_sut_cache: bool = False,
+    max_workers: int = 1,
+    worker_id: Optional[str] = None,
+    poll_seconds: float = 1.0,
+    rate_limit_directory: Optional[str] = None,
+) -> int:
+    """Process TestItems leased from `work_queue` until none are left.
+
+    Any number of workers on the machine holding the queue can share it, see
+    `WorkQueue` for why it must be local. While a worker runs, it renews its leases in
+    the background, so if it dies its TestItems go back to the queue for another
+    worker. A TestItem that raises is retried by the queue, possibly by a different
+    worker. Workers sharing `data_dir` should use `shared_cache`, and can share rate
+    limits through `rate_limit_directory`.
+    Returns how many TestItems this worker finished.
+    """
+    assert max_workers > 0, f"Cannot run a worker using {max_workers} threads."
+    if work_queue.run_uids() != (test.uid, sut.uid):
+        raise ValueError(
+            f"{work_queue.path} doesn't hold a run for test={test.uid} sut={sut.uid}."
+        )
+    run = TestRunSetup(
+        test,
+        sut,
+        data_dir,
+        None,
+        use_caching,
+        shared_cache,
+        global_sut_cache,
+        rate_limit_directory=rate_limit_directory,
+    )
+    # Leases only name the TestItem, so every worker needs the full list.
+    test_items = {journal_key(item): item for item in run.test_items}
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    with ExitStack() as stack:
+        run.open_caches(stack)
+        _keep_leases(stack, work_queue, worker_id)
+        annotation_executor: Optional[Executor] = None
+        if len(run.annotators) > 1:
+            annotation_executor = stack.enter_context(
+                ThreadPoolExecutor(max_workers * (len(run.annotators) - 1))
+            )
+
+        def _work() -> int:
+            finished = 0
+            while True:
+                lease = work_queue.lease(worker_id)
+                if lease is None:
+                    if work_queue.is_finished():
+                        return finished
+                    # Other workers hold the rest, wait in case their leases expire.
+                    time.sleep(poll_seconds)
+                    continue
+                item = test_items.get(lease.item_key)
+                if item is None:
+                    work_queue.fail(
+                        lease, f"Worker {worker_id} doesn't have this TestItem."
+                    )
+                    continue
+                try:
+                    interactions = collect_sut_interactions(
+                        item, sut, run.sut_cache, run.sut_rate_limiter
+                    )
+                    annotations = annotate_with_all(
+                        run.annotators, interactions, annotation_executor
+                    )
+                    record = measure_test_item(test, item, interactions, annotations)
+                except Exception as e:
+                    work_queue.fail(lease, "".join(traceback.format_exception(e)))
+                    continue
+                work_queue.complete(lease, record)
+                finished += 1
+
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers))
+        futures = [executor.submit(_work) for _ in range(max_workers)]
+        return sum(future.result() for future in futures)
+
+
+def _keep_leases(stack: ExitStack, work_queue: WorkQueue, worker_id: str):
+    """Renew `worker_id`'s leases in the background for the lifetime of `stack`."""
+    stopped = threading.Event()
+
+    def _heartbeat():
+        while not stopped.wait(work_queue.lease_seconds / 3):
+            work_queue.heartbeat(worker_id)
+
+    thread = threading.Thread(target=_heartbeat, daemon=True)
+    thread.start()
+    stack.callback(thread.join)
+    stack.callback(stopped.set)
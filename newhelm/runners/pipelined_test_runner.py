@@ -0,0 +1,234 @@
+from contextlib import ExitStack
+from queue import Empty, Full, Queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from tqdm import tqdm
+from newhelm.annotation import Annotation
+from newhelm.base_test import BasePromptResponseTest
+from newhelm.records import Shard, TestRecord, TestRecordWriter
+from newhelm.runners.simple_test_runner import (
+    AnnotatorData,
+    TestRunSetup,
+    annotate_interactions,
+    collect_sut_interactions,
+    measure_test_item,
+    prefetch_sut_responses,
+)
+from newhelm.single_turn_prompt_response import PromptInteraction, TestItem
+from newhelm.sut import PromptResponseSUT
+
+
+def run_prompt_response_test_pipelined(
+    test: BasePromptResponseTest,
+    sut: PromptResponseSUT,
+    data_dir: str,
+    max_test_items: Optional[int] = None,
+    use_caching: bool = True,
+    disable_progress_bar: bool = False,
+    workers_per_stage: int = 1,
+    max_queue_size: Optional[int] = None,
+    shared_cache: bool = False,
+    global_sut_cache: bool = False,
+    replay_only: bool = False,
+    resume: bool = False,
+    record_writer: Optional[TestRecordWriter] = None,
+    shard: Optional[Shard] = None,
+    rate_limit_directory: Optional[str] = None,
+) -> TestRecord:
+    """Run a single Test on a single SUT as a pipeline of independent stages.
+
+    SUT calls, each annotator and measurement are separate stages connected by
+    bounded queues, so the SUT can work on later TestItems while annotators
+    are busy with earlier ones. Each of the SUT and annotator stages has
+    `workers_per_stage` threads. Each queue holds at most `max_queue_size` TestItems
+    (default twice `workers_per_stage`), which bounds how far the SUT can get ahead of
+    the annotators. TestItemRecords are returned in the same order as the TestItems.
+    See `run_prompt_response_test` for the other options.
+    """
+    assert (
+        workers_per_stage > 0
+    ), f"Cannot run a test using {workers_per_stage} workers per stage."
+    if max_queue_size is None:
+        max_queue_size = 2 * workers_per_stage
+    assert max_queue_size > 0, f"Cannot run a test with queue size {max_queue_size}."
+    run = TestRunSetup(
+        test,
+        sut,
+        data_dir,
+        max_test_items,
+        use_caching,
+        shared_cache,
+        global_sut_cache,
+        replay_only,
+        resume,
+        record_writer,
+        shard,
+        rate_limit_directory,
+    )
+    pipeline = _Pipeline(max_queue_size)
+    with ExitStack() as stack:
+        run.open_caches(stack)
+        run.open_journal(stack)
+        sut_cache = prefetch_sut_responses(
+            run, disable_progress_bar=disable_progress_bar
+        )
+
+        def _call_sut(work: _WorkInProgress):
+            work.interactions = collect_sut_interactions(
+                work.item, sut, sut_cache, run.sut_rate_limiter
+            )
+
+        pipeline.add_stage(_call_sut, workers_per_stage)
+        for annotator in run.annotators:
+            pipeline.add_stage(_make_annotation_stage(annotator), workers_per_stage)
+        stack.callback(pipeline.stop)
+        progress = stack.enter_context(
+            tqdm(
+                desc=run.progress_description,
+                total=len(run.test_items),
+                disable=disable_progress_bar,
+            )
+        )
+        pipeline.start(
+            _WorkInProgress(index, item) for index, item in enumerate(run.test_items)
+        )
+        # Measurement is the final stage, run in this thread.
+        for work in pipeline.results():
+            run.add_test_item_record(
+                work.index,
+                measure_test_item(test, work.item, work.interactions, work.annotations),
+            )
+            progress.update()
+    return run.make_test_record()
+
+
+class _WorkInProgress:
+    """Everything known about a single TestItem as it moves through the pipeline."""
+
+    def __init__(self, index: int, item: TestItem):
+        self.index = index
+        self.item = item
+        self.interactions: List[PromptInteraction] = []
+        self.annotations: Dict[str, Annotation] = {}
+
+
+def _make_annotation_stage(annotator: AnnotatorData):
+    def _annotate(work: _WorkInProgress):
+        work.annotations[annotator.key] = annotate_interactions(
+            annotator, work.interactions
+        )
+
+    return _annotate
+
+
+class _Stopped(Exception):
+    """Raised inside a worker thread when the pipeline is shutting down."""
+
+
+_DONE = object()
+"""Put in a queue to signal that no more work will be added."""
+
+
+class _Pipeline:
+    """Pools of threads connected by bounded queues.
+
+    Each stage takes work from its input queue, modifies it in place and passes
+    it to the next stage's queue. When a queue is full, the stage feeding it blocks,
+    which provides backpressure all the way back to the input.
+    """
+
+    _POLL_SECONDS = 0.1
+
+    def __init__(self, max_queue_size: int):
+        self.max_queue_size = max_queue_size
+        self.queues: List[Queue] = [Queue(max_queue_size)]
+        self.threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def add_stage(self, work: Callable[[Any], None], num_workers: int):
+        inputs = self.queues[-1]
+        outputs: Queue = Queue(self.max_queue_size)
+        self.queues.append(outputs)
+        remaining_workers = [num_workers]
+        lock = threading.Lock()
+
+        def _worker():
+            while True:
+                value = self._get(inputs)
+                if value is _DONE:
+                    with lock:
+                        remaining_workers[0] -= 1
+                        last_worker = remaining_workers[0] == 0
+                    if last_worker:
+                        self._put(outputs, _DONE)
+                    else:
+                        # Let the other workers in this stage know too.
+                        self._put(inputs, _DONE)
+                    return
+                work(value)
+                self._put(outputs, value)
+
+        for _ in range(num_workers):
+            self.threads.append(threading.Thread(target=self._run_safely(_worker)))
+
+    def start(self, inputs):
+        def _feed():
+            for value in inputs:
+                self._put(self.queues[0], value)
+            self._put(self.queues[0], _DONE)
+
+        self.threads.append(threading.Thread(target=self._run_safely(_feed)))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def results(self):
+        """Yield the output of the final stage, raising if any stage failed."""
+        while True:
+            try:
+                value = self._get(self.queues[-1])
+            except _Stopped:
+                break
+            if value is _DONE:
+                return
+            yield value
+        self._raise_first_error()
+
+    def stop(self):
+        self._stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _raise_first_error(self):
+        if self._errors:
+            raise self._errors[0]
+
+    def _run_safely(self, target):
+        def _wrapped():
+            try:
+                target()
+            except _Stopped:
+                pass
+            except BaseException as e:
+                self._errors.append(e)
+                self._stopping.set()
+
+        return _wrapped
+
+    def _get(self, queue: Queue):
+        while not self._stopping.is_set():
+            try:
+                return queue.get(timeout=self._POLL_SECONDS)
+            except Empty:
+                pass
+        raise _Stopped()
+
+    def _put(self, queue: Queue, value):
+        while not self._stopping.is_set():
+            try:
+                queue.put(value, timeout=self._POLL_SECONDS)
+                return
+            except Full:
+                pass
+        raise _Stopped()
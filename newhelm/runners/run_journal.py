@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+from typing import BinaryIO, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from newhelm.general import normalize_filename
+from newhelm.records import TestItemRecord
+from newhelm.single_turn_prompt_response import TestItem
+
+
+class _JournalHeader(BaseModel):
+    """The first line of every journal."""
+
+    journal_format: int = 1
+    test_uid: str
+    sut_uid: str
+
+
+class _JournalLine(BaseModel):
+    item_key: str
+    record: TestItemRecord
+
+
+class RunJournal:
+    """Append-only log of the TestItemRecords a run has finished.
+
+    Every record is written as its own line as soon as it is made, so if the run
+    dies, a later run can pick up where it left off. Records are matched to TestItems
+    by their content, so resuming with a different `max_test_items` reuses every
+    TestItem the two runs have in common. While a run has the journal open, it holds
+    an exclusive lock on it, so another run of the same Test and SUT sharing the
+    directory fails rather than overwriting it.
+    """
+
+    def __init__(self, directory: str, test_uid: str, sut_uid: str):
+        # One Test class can be registered under several uids, so key by uid.
+        self.path = os.path.join(
+            directory,
+            normalize_filename(test_uid),
+            normalize_filename(f"{sut_uid}.jsonl"),
+        )
+        self.header = _JournalHeader(test_uid=test_uid, sut_uid=sut_uid)
+        self._file: Optional[BinaryIO] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, List[TestItemRecord]]:
+        """Read every record in the journal, keyed by the `journal_key` of its TestItem.
+
+        A line cut short by the previous run dying is dropped.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        records: Dict[str, List[TestItemRecord]] = {}
+        with open(self.path, "rb") as f:
+            # Anything without a final newline was never fully written.
+            lines = (line for line in f if line.endswith(b"\n"))
+            first_line = next(lines, None)
+            if first_line is None:
+                return {}
+            header = _JournalHeader.model_validate_json(first_line)
+            if header != self.header:
+                raise ValueError(
+                    f"Cannot resume from {self.path}: it was written for "
+                    f"test={header.test_uid} sut={header.sut_uid}."
+                )
+            for line in lines:
+                entry = _JournalLine.model_validate_json(line)
+                records.setdefault(entry.item_key, []).append(entry.record)
+        return records
+
+    def start(self) -> "RunJournal":
+        """Open the journal for a new run, discarding anything already in it."""
+        self._open()
+        assert self._file is not None
+        self._file.truncate(0)
+        self._write(self.header.model_dump_json())
+        return self
+
+    def resume(self) -> "RunJournal":
+        """Open the journal to add to a previous run's records."""
+        if not os.path.exists(self.path):
+            return self.start()
+        self._open()
+        assert self._file is not None
+        # Drop any partially written line so new lines start cleanly.
+        complete_lines = _end_of_last_line(self._file)
+        if complete_lines == 0:
+            return self.start()
+        self._file.truncate(complete_lines)
+        return self
+
+    def append(self, item: TestItem, record: TestItemRecord):
+        """Write a finished record right away. This is safe to call from any thread."""
+        line = _JournalLine(item_key=journal_key(item), record=record)
+        self._write(line.model_dump_json())
+
+    def close(self):
+        if self._file is not None:
+            # Closing the file releases its lock.
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Append mode, so nothing is lost before the lock is held.
+        self._file = open(self.path, "ab+")
+        try:
+            _lock_exclusively(self._file)
+        except BlockingIOError:
+            self.close()
+            raise ValueError(
+                f"Cannot open {self.path}: another run of "
+                f"test={self.header.test_uid} sut={self.header.sut_uid} is using it."
+            )
+
+    def _write(self, line: str):
+        assert self._file is not None, "The journal must be opened before writing."
+        with self._lock:
+            self._file.write(line.encode() + b"\n")
+            self._file.flush()
+
+
+def _lock_exclusively(f: BinaryIO):
+    """Lock `f` until it is closed, raising BlockingIOError if someone else has it."""
+    try:
+        import fcntl
+    except ImportError:
+        # File locks need `fcntl`, which isn't available on Windows.
+        return
+    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _end_of_last_line(f: BinaryIO) -> int:
+    """The size of `f` up to and including its last newline, reading from the end."""
+    position = f.seek(0, os.SEEK_END)
+    while position > 0:
+        step = min(position, 1 << 16)
+        position -= step
+        f.seek(position)
+        newline = f.read(step).rfind(b"\n")
+        if newline >= 0:
+            return position + newline + 1
+    return 0
+
+
+def journal_key(item: TestItem) -> str:
+    """Identify a TestItem by its content."""
+    return hashlib.sha256(item.model_dump_json().encode()).hexdigest()
@@ -0,0 +1,142 @@
+from typing import Dict, List, Optional, Sequence
+
+from newhelm.base_test import BasePromptResponseTest, TestResult
+from newhelm.cascade_statistics import CascadeStatistics
+from newhelm.records import (
+    Shard,
+    TestItemRecord,
+    TestRecord,
+    TestRecordHeader,
+    TestRecordReader,
+    TestRecordSummary,
+    TestRecordWriter,
+    make_test_record,
+)
+from newhelm.runners.run_journal import journal_key
+from newhelm.single_turn_prompt_response import MeasuredTestItem, TestItem
+
+# The parts of the header every shard of a run must agree on.
+_MATCHING_HEADER_FIELDS = [
+    "test_uid",
+    "test_initialization",
+    "dependency_versions",
+    "sut_uid",
+    "sut_initialization",
+]
+
+
+def make_shard(index: int, count: int) -> Optional[Shard]:
+    """Describe one of `count` shards, or None if the run isn't split up."""
+    assert count > 0, f"Cannot split a run into {count} shards."
+    assert 0 <= index < count, f"Shard index {index} must be in [0, {count})."
+    if count == 1:
+        return None
+    return Shard(index=index, count=count)
+
+
+def shard_test_items(test_items: List[TestItem], shard: Shard) -> List[TestItem]:
+    """Keep just the TestItems that belong to `shard`.
+
+    TestItems are assigned by a hash of their content, so every machine computes the
+    same partition no matter what order `make_test_items` returns them in.
+    """
+    return [
+        item
+        for item in test_items
+        if int(journal_key(item), 16) % shard.count == shard.index
+    ]
+
+
+def merge_test_records(
+    test: BasePromptResponseTest,
+    paths: Sequence[str],
+    record_writer: Optional[TestRecordWriter] = None,
+) -> TestRecord:
+    """Combine the streamed TestRecords of every shard of a run into one TestRecord.
+
+    The shards must all come from the same Test, SUT and dependency versions, and
+    together cover every shard exactly once. `aggregate_measurements` is run over the
+    TestItems of all the shards. Given a `record_writer`, the TestItemRecords are
+    copied to it one at a time, and the returned TestRecord doesn't include them.
+    """
+    readers = [TestRecordReader(path) for path in paths]
+    assert readers, "Need at least one TestRecord to merge."
+    _check_shards_match(readers)
+    readers.sort(key=lambda reader: _shard_of(reader.header).index)
+    first = readers[0].header
+    if first.test_uid != test.uid:
+        raise ValueError(
+            f"Cannot merge TestRecords for test={first.test_uid} using test={test.uid}."
+        )
+
+    header = first.model_copy(
+        update={
+            "run_timestamp": min(reader.header.run_timestamp for reader in readers),
+            "shard": None,
+        }
+    )
+    if record_writer is not None:
+        record_writer.write_header(header)
+    test_item_records: List[TestItemRecord] = []
+    measured_test_items: List[MeasuredTestItem] = []
+    cascade_statistics: Dict[str, CascadeStatistics] = {}
+    for reader in readers:
+        for record in reader.test_item_records():
+            measured_test_items.append(
+                MeasuredTestItem(
+                    test_item=record.test_item, measurements=record.measurements
+                )
+            )
+            if record_writer is None:
+                test_item_records.append(record)
+            else:
+                record_writer.write_test_item_record(record)
+        summary = reader.summary
+        assert summary is not None
+        for key, statistics in summary.cascade_statistics.items():
+            cascade_statistics.setdefault(key, CascadeStatistics()).add(statistics)
+
+    merged_summary = TestRecordSummary(
+        result=TestResult.from_instance(
+            test.aggregate_measurements(measured_test_items)
+        ),
+        cascade_statistics=cascade_statistics,
+    )
+    if record_writer is not None:
+        record_writer.write_summary(merged_summary)
+    return make_test_record(header, test_item_records, merged_summary)
+
+
+def _shard_of(header: TestRecordHeader) -> Shard:
+    return header.shard or Shard(index=0, count=1)
+
+
+def _check_shards_match(readers: List[TestRecordReader]):
+    first = readers[0]
+    for reader in readers:
+        for field in _MATCHING_HEADER_FIELDS:
+            if getattr(reader.header, field) != getattr(first.header, field):
+                raise ValueError(
+                    f"Cannot merge {reader.path} with {first.path}: "
+                    f"their {field} don't match."
+                )
+        if reader.summary is None:
+            raise ValueError(f"Cannot merge {reader.path}: its run didn't finish.")
+
+    count = _shard_of(first.header).count
+    seen: Dict[int, str] = {}
+    for reader in readers:
+        shard = _shard_of(reader.header)
+        if shard.count != count:
+            raise ValueError(
+                f"Cannot merge {reader.path} with {first.path}: "
+                f"they split the run into {shard.count} and {count} shards."
+            )
+        if shard.index in seen:
+            raise ValueError(
+                f"Both {seen[shard.index]} and {reader.path} are shard {shard.index}."
+            )
+        seen[shard.index] = reader.path
+    missing = sorted(set(range(count)) - set(seen))
+    if missing:
+        raise ValueError(f"Cannot merge without shards {missing} of {count}.")
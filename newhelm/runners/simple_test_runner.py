@@ -1,25 +1,79 @@
+import asyncio
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from collections import deque
+from contextlib import ExitStack
 import os
 import random
-from typing import Dict, List, Optional
+import threading
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 from pydantic import BaseModel
 from tqdm import tqdm
 from newhelm.annotation import Annotation
-from newhelm.base_annotator import BaseAnnotator
+from newhelm.base_annotator import (
+    BaseAnnotator,
+    BaseCompletionAnnotator,
+    completion_request_key,
+    unique_completion_requests,
+)
 from newhelm.base_test import BasePromptResponseTest, TestResult
-from newhelm.caching import BaseCache, NoCache, SqlDictCache
+from newhelm.caching import (
+    BaseCache,
+    CountingCache,
+    DirectoryCache,
+    MemoryCache,
+    MissingCacheEntries,
+    NoCache,
+    ReplayOnlyCache,
+    SqlDictCache,
+    describe_cache_entry,
+    record_cache_statistics,
+)
+from newhelm.cascade_annotator import CascadeAnnotation, CascadeAnnotator
+from newhelm.cascade_statistics import CascadeStatistics
 from newhelm.dependency_helper import FromSourceDependencyHelper
 from newhelm.prompt import TextPrompt
-from newhelm.records import TestItemRecord, TestRecord
+from newhelm.rate_limiting import (
+    RateLimiter,
+    make_rate_limiter,
+    rate_limited,
+    rate_limited_async,
+)
+from newhelm.record_init import InitializationRecord
+from newhelm.records import (
+    Shard,
+    TestItemRecord,
+    TestRecord,
+    TestRecordHeader,
+    TestRecordSummary,
+    TestRecordWriter,
+    make_test_record,
+)
+from newhelm.runners.run_journal import RunJournal, journal_key
+from newhelm.runners.sharding import shard_test_items
 from newhelm.single_turn_prompt_response import (
+    PromptWithContext,
     TestItem,
     TestItemAnnotations,
     MeasuredTestItem,
     PromptInteraction,
 )
 from newhelm.sut import PromptResponseSUT
+from newhelm.sut_capabilities import AcceptsBatchRequests
 from newhelm.sut_capabilities_verification import assert_sut_capabilities
 from newhelm.sut_decorator import assert_is_sut
 from newhelm.test_decorator import assert_is_test
+from newhelm.typed_data import TypedData
 
 
 def run_prompt_response_test(
@@ -29,84 +83,539 @@ def run_prompt_response_test(
     max_test_items: Optional[int] = None,
     use_caching: bool = True,
     disable_progress_bar: bool = False,
+    max_workers: int = 1,
+    sut_batch_size: int = 1,
+    shared_cache: bool = False,
+    global_sut_cache: bool = False,
+    replay_only: bool = False,
+    resume: bool = False,
+    record_writer: Optional[TestRecordWriter] = None,
+    shard: Optional[Shard] = None,
+    rate_limit_directory: Optional[str] = None,
 ) -> TestRecord:
-    """Demonstration for how to run a single Test on a single SUT, all calls serial."""
+    """Demonstration for how to run a single Test on a single SUT.
 
-    assert_is_test(test)
-    assert_is_sut(sut)
-    assert_sut_capabilities(sut, test)
+    By default all calls are serial. Setting `max_workers` above 1 processes that many
+    TestItems concurrently in a thread pool. TestItemRecords are always returned in
+    the same order as the TestItems, so the resulting TestRecord does not depend on
+    `max_workers`. When the Test has several annotators, they annotate each TestItem
+    at the same time.
 
-    # Ensure we can record what these objects are
-    test_initialization = test.initialization_record
-    sut_initialization = sut.initialization_record
-    test_data_path = os.path.join(data_dir, test.__class__.__name__)
+    Before any SUT calls, every SUT request in the run is looked up in the cache at once.
+    TestItems whose responses are all cached are processed first. If the SUT has the
+    AcceptsBatchRequests capability and `sut_batch_size` is above 1, all SUT requests
+    that aren't already cached are then sent to `evaluate_batch` in groups of
+    `sut_batch_size`.
 
-    sut_cache: BaseCache
-    if use_caching:
-        directory = os.path.join(test_data_path, "cached_responses")
-        sut_cache = SqlDictCache(directory, sut.uid)
-    else:
-        sut_cache = NoCache()
-    annotators = []
-    for key, annotator in test.get_annotators().items():
-        annotator_cache: BaseCache
-        if use_caching:
-            annotator_cache = SqlDictCache(
-                os.path.join(test_data_path, "cached_annotations"), key
-            )
-        else:
-            annotator_cache = NoCache()
-        annotators.append(AnnotatorData(key, annotator, annotator_cache))
-
-    # This runner just records versions, it doesn't specify a required version.
-    dependency_helper = FromSourceDependencyHelper(
-        test_data_path,
-        test.get_dependencies(),
-        required_versions={},
+    Setting `shared_cache` stores the caches in a format that many processes, even on
+    different hosts, can read and write at the same time. Setting `global_sut_cache`
+    shares SUT responses with every other Test run in `data_dir`. Setting `replay_only`
+    serves every SUT response and annotation from the cache without calling anything,
+    raising MissingCacheEntries listing everything that isn't cached before starting.
+
+    Each TestItemRecord is written to a journal in `data_dir` as soon as it is made.
+    Setting `resume` skips the TestItems already in the journal and reuses their records.
+    Given a `record_writer`, TestItemRecords are written to it in order as they finish
+    instead of being kept in memory, and the returned TestRecord doesn't include them.
+    TestItems are then processed in order, with at most `2 * max_workers` started
+    ahead of the oldest unfinished one, which bounds how many records wait to be written.
+    Given a `shard`, only that shard's TestItems are processed.
+
+    Calls to a SUT or annotator with a `rate_limit` wait as needed to stay under it.
+    Every process given the same `rate_limit_directory` shares the same limits.
+    """
+    assert max_workers > 0, f"Cannot run a test using {max_workers} workers."
+    assert sut_batch_size > 0, f"Cannot run a test using batch size {sut_batch_size}."
+    run = TestRunSetup(
+        test,
+        sut,
+        data_dir,
+        max_test_items,
+        use_caching,
+        shared_cache,
+        global_sut_cache,
+        replay_only,
+        resume,
+        record_writer,
+        shard,
+        rate_limit_directory,
     )
 
-    test_items = test.make_test_items(dependency_helper)
-    if max_test_items is not None:
-        assert max_test_items > 0, f"Cannot run a test using {max_test_items}."
-        if max_test_items < len(test_items):
-            rng = random.Random()
-            rng.seed(0)
-            test_items = rng.sample(test_items, max_test_items)
-    test_item_records = []
-    measured_test_items = []
-    desc = f"Processing TestItems for test={test.uid} sut={sut.uid}"
-    for test_item in tqdm(test_items, desc=desc, disable=disable_progress_bar):
-        test_item_record = _process_test_item(
-            test_item, test, sut, sut_cache, annotators
-        )
-        test_item_records.append(test_item_record)
-        measured_test_items.append(
-            MeasuredTestItem(
-                test_item=test_item_record.test_item,
-                measurements=test_item_record.measurements,
+    with ExitStack() as stack:
+        run.open_caches(stack)
+        run.open_journal(stack)
+        sut_cache = prefetch_sut_responses(run, sut_batch_size, disable_progress_bar)
+        order: List[int] = list(range(len(run.test_items)))
+        if record_writer is None:
+            # Start with the TestItems that don't need any SUT calls. Records are
+            # written in order, so with a `record_writer` that would hold them back.
+            order.sort(key=lambda index: not sut_cache.partition.fully_cached[index])
+
+        annotation_executor: Optional[Executor] = None
+        if len(run.annotators) > 1:
+            # This thread runs the first annotator, the pool runs the rest.
+            annotation_executor = stack.enter_context(
+                ThreadPoolExecutor(max_workers * (len(run.annotators) - 1))
             )
-        )
-    test_result = TestResult.from_instance(
-        test.aggregate_measurements(measured_test_items)
-    )
-    return TestRecord(
-        test_uid=test.uid,
-        test_initialization=test_initialization,
-        dependency_versions=dependency_helper.versions_used(),
-        sut_uid=sut.uid,
-        sut_initialization=sut_initialization,
-        test_item_records=test_item_records,
-        result=test_result,
-    )
+
+        def _process(index: int):
+            record = _process_test_item(
+                run.test_items[index],
+                test,
+                sut,
+                sut_cache,
+                run.annotators,
+                annotation_executor,
+                run.sut_rate_limiter,
+            )
+            run.add_test_item_record(index, record)
+
+        finished: Iterable[None]
+        if max_workers == 1:
+            finished = map(_process, order)
+        else:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers))
+            # If anything fails, don't keep working on queued TestItems.
+            stack.callback(executor.shutdown, cancel_futures=True)
+            if record_writer is None:
+                finished = executor.map(_process, order)
+            else:
+                finished = _map_with_look_ahead(
+                    executor, _process, order, 2 * max_workers
+                )
+        for _ in tqdm(
+            finished,
+            desc=run.progress_description,
+            total=len(run.test_items),
+            disable=disable_progress_bar,
+        ):
+            pass
+    return run.make_test_record()
+
+
+def _map_with_look_ahead(
+    executor: Executor, function: Callable[[Any], Any], items: Iterable, look_ahead: int
+) -> Iterator:
+    """Like `executor.map`, but only submit an item once the one `look_ahead` before it is done."""
+    futures: Deque[Future] = deque()
+    for item in items:
+        if len(futures) == look_ahead:
+            yield futures.popleft().result()
+        futures.append(executor.submit(function, item))
+    while futures:
+        yield futures.popleft().result()
 
 
 class AnnotatorData:
     """Container to hold data about an annotator."""
 
-    def __init__(self, key: str, annotator: BaseAnnotator, cache: BaseCache):
+    def __init__(
+        self,
+        key: str,
+        annotator: BaseAnnotator,
+        cache: BaseCache,
+        completion_cache: Optional["CompletionAnnotationCache"] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
         self.key = key
         self.annotator = annotator
         self.cache = cache
+        self.completion_cache = completion_cache
+        self.rate_limiter = rate_limiter
+
+    def annotate(self, interactions: List[PromptInteraction]):
+        if self.completion_cache is not None:
+            return self.completion_cache.annotate(interactions)
+        annotate = rate_limited(
+            self.annotator.annotate_test_item,
+            self.rate_limiter,
+            count_requests=self.annotator.count_requests,
+        )
+        return annotate(interactions)
+
+    async def annotate_async(self, interactions: List[PromptInteraction]):
+        if self.completion_cache is not None:
+            return await self.completion_cache.annotate_async(interactions)
+        annotate = rate_limited_async(
+            self.annotator.annotate_test_item_async,
+            self.rate_limiter,
+            count_requests=self.annotator.count_requests,
+        )
+        return await annotate(interactions)
+
+
+class CompletionAnnotationCache:
+    """Score completions for a BaseCompletionAnnotator, one completion request at a time.
+
+    Scores are looked up in and added to `cache`. Each distinct request is scored at
+    most once, even when many threads or tasks need it at the same time: whoever needs
+    it first scores it, and everyone else waits. Only requests still being scored are
+    kept here, as later callers find the finished scores in `cache`.
+    Each call to `annotate_completions` waits for `rate_limiter`, if given, counting
+    one request for each completion request it scores.
+    """
+
+    def __init__(
+        self,
+        annotator: BaseCompletionAnnotator,
+        cache: BaseCache,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.annotator = annotator
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self._lock = threading.Lock()
+        self._scores: Dict[str, Future] = {}
+
+    def annotate(self, interactions: List[PromptInteraction]):
+        requests = self.annotator.make_completion_requests(interactions)
+        scores, misses = self._claim(requests)
+        if misses:
+            try:
+                annotate = rate_limited(
+                    self.annotator.annotate_completions,
+                    self.rate_limiter,
+                    count_requests=len,
+                )
+                annotations = annotate(list(misses.values()))
+            except BaseException as e:
+                self._fail(scores, misses, e)
+                raise
+            self._finish(scores, misses, annotations)
+        return self._make_annotation(
+            requests, {key: future.result() for key, future in scores.items()}
+        )
+
+    async def annotate_async(self, interactions: List[PromptInteraction]):
+        requests = self.annotator.make_completion_requests(interactions)
+        scores, misses = self._claim(requests)
+        if misses:
+            try:
+                annotate = rate_limited_async(
+                    self.annotator.annotate_completions_async,
+                    self.rate_limiter,
+                    count_requests=len,
+                )
+                annotations = await annotate(list(misses.values()))
+            except BaseException as e:
+                self._fail(scores, misses, e)
+                raise
+            self._finish(scores, misses, annotations)
+        return self._make_annotation(
+            requests,
+            {key: await asyncio.wrap_future(future) for key, future in scores.items()},
+        )
+
+    def _claim(self, requests: List[List[Any]]) -> Tuple[Dict[str, Future], Dict]:
+        """Get the future score for every request, and which of them this caller must score."""
+        scores: Dict[str, Future] = {}
+        claimed: Dict[str, Any] = {}
+        with self._lock:
+            for key, request in unique_completion_requests(requests).items():
+                if key not in self._scores:
+                    self._scores[key] = Future()
+                    claimed[key] = request
+                scores[key] = self._scores[key]
+        if not claimed:
+            return scores, {}
+        try:
+            cached = self.cache.get_cached_responses(list(claimed.values()))
+        except BaseException as e:
+            self._fail(scores, claimed, e)
+            raise
+        misses = {}
+        hits = []
+        for (key, request), response in zip(claimed.items(), cached):
+            if response is None:
+                misses[key] = request
+            else:
+                scores[key].set_result(response)
+                hits.append(key)
+        self._release(hits)
+        return scores, misses
+
+    def _finish(self, scores: Dict[str, Future], misses: Dict, annotations: List):
+        assert len(annotations) == len(misses), (
+            f"Annotator returned {len(annotations)} scores "
+            f"for {len(misses)} completions."
+        )
+        for (key, request), annotation in zip(misses.items(), annotations):
+            self.cache.update_cache(request, annotation)
+            scores[key].set_result(annotation)
+        self._release(misses)
+
+    def _fail(self, scores: Dict[str, Future], claimed: Dict, error: BaseException):
+        # Let a later caller try again.
+        self._release(claimed)
+        for key in claimed:
+            scores[key].set_exception(error)
+
+    def _release(self, keys: Iterable[str]):
+        """Stop tracking requests that are no longer being scored."""
+        with self._lock:
+            for key in keys:
+                del self._scores[key]
+
+    def _make_annotation(self, requests: List[List[Any]], scores: Dict[str, Any]):
+        return self.annotator.make_annotation(
+            [[scores[completion_request_key(r)] for r in row] for row in requests]
+        )
+
+
+class TestRunSetup:
+    """Everything a runner needs before it can start processing TestItems.
+
+    This validates the Test and SUT, creates the caches and loads the TestItems,
+    so that different runners can share the same setup and record keeping.
+    When resuming, `test_items` only holds the TestItems the journal doesn't have yet.
+    With a `shard`, TestItems are sampled down to `max_test_items` before sharding, so
+    together the shards process the same TestItems as a single run would.
+    """
+
+    def __init__(
+        self,
+        test: BasePromptResponseTest,
+        sut: PromptResponseSUT,
+        data_dir: str,
+        max_test_items: Optional[int],
+        use_caching: bool,
+        shared_cache: bool = False,
+        global_sut_cache: bool = False,
+        replay_only: bool = False,
+        resume: bool = False,
+        record_writer: Optional[TestRecordWriter] = None,
+        shard: Optional[Shard] = None,
+        rate_limit_directory: Optional[str] = None,
+    ):
+        assert_is_test(test)
+        assert_is_sut(sut)
+        assert_sut_capabilities(sut, test)
+        assert use_caching or not replay_only, "Cannot replay a run without caching."
+        self.test = test
+        self.sut = sut
+        self.replay_only = replay_only
+        self.shared_cache = shared_cache
+
+        # Ensure we can record what these objects are
+        self.test_initialization: InitializationRecord = test.initialization_record
+        self.sut_initialization: InitializationRecord = sut.initialization_record
+        self.test_data_path = os.path.join(data_dir, test.__class__.__name__)
+
+        # The directory, file identifier and lookup counts of each cache.
+        self._cache_statistics: List[Tuple[str, str, CountingCache]] = []
+
+        def _make_cache(directory: str, identifier: str) -> BaseCache:
+            if not use_caching:
+                return NoCache()
+            persistent_cache: BaseCache
+            if shared_cache:
+                persistent_cache = DirectoryCache(directory, identifier)
+            else:
+                # Replays only read, so they mustn't modify the file, which may be
+                # a published cache in a read-only location.
+                persistent_cache = SqlDictCache(
+                    directory, identifier, track_access=not replay_only
+                )
+            if replay_only:
+                # Replays would always hit, so don't count them with real runs.
+                return ReplayOnlyCache(MemoryCache(persistent_cache), identifier)
+            cache = CountingCache(MemoryCache(persistent_cache))
+            self._cache_statistics.append((directory, identifier, cache))
+            return cache
+
+        # The global cache is keyed by just the SUT and the request, so any Test can use it.
+        sut_cache_parent = data_dir if global_sut_cache else self.test_data_path
+        self.sut_cache_directory = os.path.join(sut_cache_parent, "cached_responses")
+        self.sut_cache: BaseCache = _make_cache(self.sut_cache_directory, sut.uid)
+        self.sut_rate_limiter = make_rate_limiter(
+            sut.rate_limit, rate_limit_directory, f"sut_{sut.uid}"
+        )
+        self.annotators: List[AnnotatorData] = []
+        annotation_cache_directory = os.path.join(
+            self.test_data_path, "cached_annotations"
+        )
+        for key, annotator in test.get_annotators().items():
+            annotator_cache = _make_cache(annotation_cache_directory, key)
+            # Annotators have no uid, so the limit is shared by every Test using the key.
+            rate_limiter = make_rate_limiter(
+                annotator.rate_limit, rate_limit_directory, f"annotator_{key}"
+            )
+            completion_cache = None
+            if isinstance(annotator, BaseCompletionAnnotator):
+                # Completions are cached separately, so they can be shared by TestItems.
+                completion_cache = CompletionAnnotationCache(
+                    annotator,
+                    _make_cache(annotation_cache_directory, f"{key}_completions"),
+                    rate_limiter,
+                )
+            self.annotators.append(
+                AnnotatorData(
+                    key, annotator, annotator_cache, completion_cache, rate_limiter
+                )
+            )
+
+        # This runner just records versions, it doesn't specify a required version.
+        self.dependency_helper = FromSourceDependencyHelper(
+            self.test_data_path,
+            test.get_dependencies(),
+            required_versions={},
+        )
+
+        test_items = test.make_test_items(self.dependency_helper)
+        if max_test_items is not None:
+            assert max_test_items > 0, f"Cannot run a test using {max_test_items}."
+            if max_test_items < len(test_items):
+                rng = random.Random()
+                rng.seed(0)
+                test_items = rng.sample(test_items, max_test_items)
+        journal_directory = os.path.join(self.test_data_path, "journals")
+        if shard is not None:
+            test_items = shard_test_items(test_items, shard)
+            # Shards may share `data_dir`, so each needs its own journal.
+            journal_directory = os.path.join(
+                journal_directory, f"shard_{shard.index}_of_{shard.count}"
+            )
+        self.resume = resume
+        self.journal = RunJournal(journal_directory, test.uid, sut.uid)
+        # Records from the journal, keyed by the position of their TestItem.
+        self._resumed_records: Dict[int, TestItemRecord] = {}
+        if resume:
+            journaled = self.journal.load()
+            for position, item in enumerate(test_items):
+                records = journaled.get(journal_key(item))
+                if records:
+                    self._resumed_records[position] = records.pop(0)
+        self._num_test_items = len(test_items)
+        # Every TestItem in the run, including those resumed from the journal.
+        self.all_test_items: List[TestItem] = test_items
+        self.test_items: List[TestItem] = [
+            item
+            for position, item in enumerate(test_items)
+            if position not in self._resumed_records
+        ]
+        # The position in `all_test_items` of each of `test_items`.
+        self.positions = [
+            position
+            for position in range(len(test_items))
+            if position not in self._resumed_records
+        ]
+
+        self.record_header = TestRecordHeader(
+            test_uid=test.uid,
+            test_initialization=self.test_initialization,
+            dependency_versions=self.dependency_helper.versions_used(),
+            sut_uid=sut.uid,
+            sut_initialization=self.sut_initialization,
+            shard=shard,
+        )
+        self.record_writer = record_writer
+        self._records_lock = threading.Lock()
+        # Records not yet given to `record_writer`, keyed by position.
+        self._records: Dict[int, TestItemRecord] = {}
+        self._measured_test_items: Dict[int, MeasuredTestItem] = {}
+        self._cascade_statistics: Dict[str, CascadeStatistics] = {
+            annotator.key: CascadeStatistics()
+            for annotator in self.annotators
+            if isinstance(annotator.annotator, CascadeAnnotator)
+        }
+        self._header_written = False
+        self._next_position_to_write = 0
+        for position, record in self._resumed_records.items():
+            self._keep_record(position, record)
+        self.progress_description = (
+            f"Processing TestItems for test={test.uid} sut={sut.uid}"
+        )
+
+    def open_caches(self, stack: ExitStack):
+        """Keep every cache open for the lifetime of `stack`, rather than per call."""
+        stack.enter_context(self.sut_cache)
+        for annotator in self.annotators:
+            stack.enter_context(annotator.cache)
+            if annotator.completion_cache is not None:
+                stack.enter_context(annotator.completion_cache.cache)
+        stack.callback(self._record_cache_statistics)
+
+    def open_journal(self, stack: ExitStack):
+        """Keep the journal open for adding TestItemRecords for the lifetime of `stack`."""
+        journal = self.journal.resume() if self.resume else self.journal.start()
+        stack.callback(journal.close)
+
+    def _record_cache_statistics(self):
+        for directory, identifier, cache in self._cache_statistics:
+            record_cache_statistics(
+                directory,
+                identifier,
+                self.test.uid,
+                cache.statistics,
+                shared=self.shared_cache,
+            )
+
+    def add_test_item_record(self, index: int, record: TestItemRecord):
+        """Keep the finished record for `test_items[index]` and add it to the journal.
+
+        With a `record_writer`, each record is written as soon as every earlier one has
+        been, and afterwards only what `aggregate_measurements` needs is kept.
+        This is safe to call from any thread.
+        """
+        self.journal.append(self.test_items[index], record)
+        with self._records_lock:
+            self._keep_record(self.positions[index], record)
+            self._write_finished_records()
+
+    def make_test_record(self) -> TestRecord:
+        """Aggregate every TestItemRecord into the final TestRecord.
+
+        Records are in the same order as the TestItems, including any resumed from
+        the journal. If they were given to `record_writer`, the TestRecord doesn't
+        include them.
+        """
+        missing = self._num_test_items - len(self._measured_test_items)
+        assert missing == 0, f"{missing} TestItems don't have a TestItemRecord yet."
+        measured_test_items = [
+            self._measured_test_items[position]
+            for position in range(self._num_test_items)
+        ]
+        summary = TestRecordSummary(
+            result=TestResult.from_instance(
+                self.test.aggregate_measurements(measured_test_items)
+            ),
+            cascade_statistics=self._cascade_statistics,
+        )
+        test_item_records: List[TestItemRecord] = []
+        if self.record_writer is None:
+            test_item_records = [
+                self._records[position] for position in range(self._num_test_items)
+            ]
+        else:
+            with self._records_lock:
+                self._write_finished_records()
+            self.record_writer.write_summary(summary)
+        return make_test_record(self.record_header, test_item_records, summary)
+
+    def _keep_record(self, position: int, record: TestItemRecord):
+        self._records[position] = record
+        self._measured_test_items[position] = MeasuredTestItem(
+            test_item=record.test_item, measurements=record.measurements
+        )
+        for key, statistics in self._cascade_statistics.items():
+            statistics.count(
+                record.annotations[key].to_instance(CascadeAnnotation).tiers
+            )
+
+    def _write_finished_records(self):
+        if self.record_writer is None:
+            return
+        if not self._header_written:
+            self.record_writer.write_header(self.record_header)
+            self._header_written = True
+        while self._next_position_to_write in self._records:
+            self.record_writer.write_test_item_record(
+                self._records.pop(self._next_position_to_write)
+            )
+            self._next_position_to_write += 1
+
+    # Convince pytest to ignore this class.
+    __test__ = False
 
 
 class AnnotateTestItemRequest(BaseModel):
@@ -121,42 +630,360 @@ def _process_test_item(
     sut: PromptResponseSUT,
     sut_cache: BaseCache,
     annotators: List[AnnotatorData],
+    annotation_executor: Optional[Executor] = None,
+    sut_rate_limiter: Optional[RateLimiter] = None,
 ) -> TestItemRecord:
+    interactions = collect_sut_interactions(item, sut, sut_cache, sut_rate_limiter)
+    annotations_per_annotator = annotate_with_all(
+        annotators, interactions, annotation_executor
+    )
+    return measure_test_item(test, item, interactions, annotations_per_annotator)
+
+
+def collect_sut_interactions(
+    item: TestItem,
+    sut: PromptResponseSUT,
+    sut_cache: BaseCache,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> List[PromptInteraction]:
+    """Get the SUT's response to every prompt in the TestItem."""
+    evaluate = rate_limited(sut.evaluate, rate_limiter, sut.estimate_tokens)
     interactions: List[PromptInteraction] = []
     for prompt in item.prompts:
-        if isinstance(prompt.prompt, TextPrompt):
-            sut_request = sut.translate_text_prompt(prompt.prompt)
-        else:
-            sut_request = sut.translate_chat_prompt(prompt.prompt)
+        sut_request = translate_prompt(sut, prompt)
         try:
-            with sut_cache as cache:
-                sut_response = cache.get_or_call(sut_request, sut.evaluate)
+            sut_response = sut_cache.get_or_call(sut_request, evaluate)
         except Exception as e:
             raise Exception(
                 f"Exception while handling SUT request `{sut_request}` for TestItem `{item}`"
             ) from e
         response = sut.translate_response(sut_request, sut_response)
         interactions.append(PromptInteraction(prompt=prompt, response=response))
+    return interactions
+
+
+def annotate_with_all(
+    annotators: List[AnnotatorData],
+    interactions: List[PromptInteraction],
+    executor: Optional[Executor] = None,
+) -> Dict[str, Annotation]:
+    """Apply every annotator to a TestItem's interactions, keyed in the order of `annotators`.
+
+    Given an `executor`, the first annotator runs in this thread while the rest run in
+    the executor, so the TestItem only waits for the slowest annotator.
+    """
+    if executor is None or len(annotators) < 2:
+        return {
+            annotator.key: annotate_interactions(annotator, interactions)
+            for annotator in annotators
+        }
+    futures = [
+        executor.submit(annotate_interactions, annotator, interactions)
+        for annotator in annotators[1:]
+    ]
+    try:
+        annotations = [annotate_interactions(annotators[0], interactions)]
+        annotations.extend(future.result() for future in futures)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return {
+        annotator.key: annotation
+        for annotator, annotation in zip(annotators, annotations)
+    }
+
+
+def annotate_interactions(
+    annotator: AnnotatorData, interactions: List[PromptInteraction]
+) -> Annotation:
+    """Apply a single annotator to all of a TestItem's interactions."""
+    request = AnnotateTestItemRequest(interactions=interactions)
+
+    def _do_annotation(interaction_list: AnnotateTestItemRequest):
+        return annotator.annotate(interaction_list.interactions)
+
+    try:
+        annotation = annotator.cache.get_or_call(request, _do_annotation)
+    except Exception as e:
+        raise Exception(
+            f"Exception while handling annotation for {annotator.key} on {interactions}"
+        ) from e
+    return Annotation.from_instance(annotation)
+
+
+class SutRequestPartition:
+    """Every unique SUT request in a run, split by whether it is already cached.
+
+    Only which requests are cached is kept, not their responses, so the partition
+    stays small however many responses the cache holds.
+    """
+
+    def __init__(
+        self,
+        cached: Set[str],
+        misses: Dict[str, Any],
+        uncacheable: List[Any],
+        fully_cached: List[bool],
+        uses: Dict[str, int],
+    ):
+        self.cached = cached
+        """The key of each request that is cached."""
+        self.misses = misses
+        """The request for each request key that isn't cached."""
+        self.uncacheable = uncacheable
+        """Requests that can't be cached at all."""
+        self.fully_cached = fully_cached
+        """For each TestItem, whether all of its prompts have cached responses."""
+        self.uses = uses
+        """How many prompts in the run translate to each request key."""
+
+    @property
+    def hit_ratio(self) -> float:
+        total = len(self.cached) + len(self.misses)
+        return len(self.cached) / total if total else 1.0
+
+
+# How many requests to look up in the SUT cache at a time when partitioning.
+_PARTITION_CHUNK_SIZE = 1000
+
 
-    annotations_per_annotator: Dict[str, Annotation] = {}
-    for annotator in annotators:
-        request = AnnotateTestItemRequest(interactions=interactions)
+def partition_sut_requests(run: TestRunSetup) -> SutRequestPartition:
+    """Translate every prompt in the run and look them all up in the SUT cache."""
+    unique_requests: Dict[str, Any] = {}
+    uncacheable: List[Any] = []
+    item_keys: List[List[Optional[str]]] = []
+    uses: Dict[str, int] = {}
+    for item in run.test_items:
+        keys = []
+        for prompt in item.prompts:
+            request = translate_prompt(run.sut, prompt)
+            key = _request_key(request)
+            if key is None:
+                uncacheable.append(request)
+            else:
+                unique_requests.setdefault(key, request)
+                uses[key] = uses.get(key, 0) + 1
+            keys.append(key)
+        item_keys.append(keys)
+    cached: Set[str] = set()
+    misses: Dict[str, Any] = {}
+    items = list(unique_requests.items())
+    # Look up in chunks, so the responses are never all in memory at once.
+    for start in range(0, len(items), _PARTITION_CHUNK_SIZE):
+        chunk = items[start : start + _PARTITION_CHUNK_SIZE]
+        responses = run.sut_cache.get_cached_responses(
+            [request for _, request in chunk]
+        )
+        for (key, request), response in zip(chunk, responses):
+            if response is None:
+                misses[key] = request
+            else:
+                cached.add(key)
+    fully_cached = [all(key in cached for key in keys) for keys in item_keys]
+    return SutRequestPartition(cached, misses, uncacheable, fully_cached, uses)
+
+
+def prefetch_sut_responses(
+    run: TestRunSetup, batch_size: int = 1, disable_progress_bar: bool = False
+) -> "_PrefetchedResponses":
+    """Find everything the SUT has to evaluate for this run, before evaluating any of it.
+
+    If the SUT has the AcceptsBatchRequests capability and `batch_size` is above 1, the
+    uncached requests are sent to `evaluate_batch`, `batch_size` at a time.
+    Returns a cache that knows which requests are cached, falling back to the run's
+    SUT cache.
+    """
+    sut = run.sut
+    partition = partition_sut_requests(run)
+    if not disable_progress_bar:
+        total = len(partition.cached) + len(partition.misses)
+        tqdm.write(
+            f"{len(partition.cached)} of {total} unique SUT requests are already "
+            f"cached ({partition.hit_ratio:.0%}) for test={run.test.uid} sut={sut.uid}."
+        )
+    if run.replay_only:
+        _check_replay(run, partition)
+    responses = _PrefetchedResponses(partition, run.sut_cache)
+    if batch_size > 1 and AcceptsBatchRequests in sut.capabilities:
+        _evaluate_batches(run, responses, batch_size, disable_progress_bar)
+    return responses
+
+
+def _check_replay(run: TestRunSetup, partition: SutRequestPartition):
+    """Raise MissingCacheEntries listing every SUT response and annotation that isn't cached.
+
+    Annotations can only be checked for TestItems whose SUT responses are all cached.
+    """
+    missing = [
+        describe_cache_entry(run.sut.uid, request)
+        for request in list(partition.misses.values()) + partition.uncacheable
+    ]
+    annotation_requests: List[AnnotateTestItemRequest] = []
+    for item, fully_cached in zip(run.test_items, partition.fully_cached):
+        if not fully_cached:
+            continue
+        interactions = []
+        for prompt in item.prompts:
+            request = translate_prompt(run.sut, prompt)
+            key = _request_key(request)
+            assert (
+                key is not None
+            ), "Fully cached TestItems only have cacheable requests."
+            sut_response = run.sut_cache.get_cached_response(request)
+            response = run.sut.translate_response(request, sut_response)
+            interactions.append(PromptInteraction(prompt=prompt, response=response))
+        annotation_requests.append(AnnotateTestItemRequest(interactions=interactions))
+    for annotator in run.annotators:
+        responses = annotator.cache.get_cached_responses(annotation_requests)
+        missing.extend(
+            describe_cache_entry(annotator.key, request)
+            for request, response in zip(annotation_requests, responses)
+            if response is None
+        )
+    if missing:
+        raise MissingCacheEntries(missing)
 
-        def _do_annotation(interaction_list: AnnotateTestItemRequest):
-            return annotator.annotator.annotate_test_item(interaction_list.interactions)
 
+def _evaluate_batches(
+    run: TestRunSetup,
+    responses: "_PrefetchedResponses",
+    batch_size: int,
+    disable_progress_bar: bool,
+):
+    """Send every miss in `responses` to `evaluate_batch`, adding their responses to it."""
+    sut = run.sut
+    requests = list(responses.partition.misses.values())
+    for start in tqdm(
+        range(0, len(requests), batch_size),
+        desc=f"Evaluating batches of {batch_size} for sut={sut.uid}",
+        disable=disable_progress_bar,
+    ):
+        batch = requests[start : start + batch_size]
+        if run.sut_rate_limiter is not None:
+            run.sut_rate_limiter.acquire(
+                requests=len(batch),
+                tokens=sum(sut.estimate_tokens(request) for request in batch),
+            )
         try:
-            with annotator.cache as cache:
-                annotation = cache.get_or_call(request, _do_annotation)
+            batch_responses = sut.evaluate_batch(batch)
         except Exception as e:
             raise Exception(
-                f"Exception while handling annotation for {annotator.key} on {interactions}"
+                f"Exception while handling SUT batch of {len(batch)} requests starting with `{batch[0]}`"
             ) from e
-        annotations_per_annotator[annotator.key] = Annotation.from_instance(annotation)
+        assert len(batch_responses) == len(batch), (
+            f"SUT {sut.uid} returned {len(batch_responses)} responses "
+            f"for {len(batch)} requests."
+        )
+        for request, response in zip(batch, batch_responses):
+            responses.update_cache(request, response)
+
+
+def _request_key(request) -> Optional[str]:
+    """Identify equal requests, or return None if the request can't be identified."""
+    if not isinstance(request, BaseModel):
+        return None
+    return TypedData.from_instance(request).model_dump_json()
+
+
+class _PrefetchedResponses(BaseCache):
+    """Serve a run's SUT requests using what `partition_sut_requests` found out.
+
+    Requests known to be cached are read from `cache` when they are needed, without
+    being counted as another lookup. Requests already known to be missing are
+    evaluated without looking them up again. A response evaluated here is read back
+    from `cache` by the other prompts that need it. Only if `cache` doesn't keep
+    responses is it held in memory instead, until the last prompt needing it has it,
+    so it is still evaluated just once. Each lookup counts as one of the request's
+    `uses` in the partition.
+    """
+
+    def __init__(self, partition: SutRequestPartition, cache: BaseCache):
+        self.partition = partition
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._remaining_uses = dict(partition.uses)
+        self._keep_in_memory = isinstance(_uncounted(cache), NoCache)
+        # Responses evaluated during this run that other prompts still need.
+        self._responses: Dict[str, Any] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def get_or_call(self, request, callable):
+        if _request_key(request) is None:
+            return self.cache.get_or_call(request, callable)
+        response = self.get_cached_response(request)
+        if response is not None:
+            return response
+        response = callable(request)
+        self.update_cache(request, response)
+        return response
+
+    def get_cached_response(self, request):
+        key = _request_key(request)
+        if key is None:
+            return self.cache.get_cached_response(request)
+        with self._lock:
+            remaining_uses = self._remaining_uses.get(key, 0) - 1
+            if remaining_uses > 0:
+                self._remaining_uses[key] = remaining_uses
+                response = self._responses.get(key)
+            else:
+                self._remaining_uses.pop(key, None)
+                response = self._responses.pop(key, None)
+            known_hit = key in self.partition.cached
+            known_miss = key in self.partition.misses
+        if response is not None or known_miss:
+            return response
+        if known_hit:
+            return _uncounted(self.cache).get_cached_response(request)
+        return self.cache.get_cached_response(request)
+
+    def update_cache(self, request, response):
+        self.cache.update_cache(request, response)
+        key = _request_key(request)
+        if key is not None:
+            with self._lock:
+                self.partition.misses.pop(key, None)
+                if self._remaining_uses.get(key, 0) <= 0:
+                    return
+                if self._keep_in_memory:
+                    self._responses[key] = response
+                else:
+                    # Later uses read it back like any other cached response.
+                    self.partition.cached.add(key)
+
+
+def _uncounted(cache: BaseCache) -> BaseCache:
+    """The cache to read from without adding to its lookup counts."""
+    if isinstance(cache, CountingCache):
+        return cache.cache
+    return cache
+
+
+def translate_prompt(sut: PromptResponseSUT, prompt: PromptWithContext):
+    """Convert the prompt into the SUT's native request."""
+    if isinstance(prompt.prompt, TextPrompt):
+        return sut.translate_text_prompt(prompt.prompt)
+    else:
+        return sut.translate_chat_prompt(prompt.prompt)
+
+
+def measure_test_item(
+    test: BasePromptResponseTest,
+    item: TestItem,
+    interactions: List[PromptInteraction],
+    annotations: Dict[str, Annotation],
+) -> TestItemRecord:
+    """Have the Test measure the annotated interactions for a single TestItem."""
     annotated = TestItemAnnotations(
         test_item=item,
         interactions=interactions,
-        annotations=annotations_per_annotator,
+        annotations=annotations,
     )
     measurements = test.measure_quality(annotated)
 
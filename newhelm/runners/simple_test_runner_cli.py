@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import List, Optional
 import click
@@ -10,14 +11,60 @@ from newhelm.command_line import (
 )
 from newhelm.config import load_secrets_from_config, raise_if_missing_from_config
 from newhelm.general import normalize_filename
+from newhelm.rate_limiting import RateLimit
+from newhelm.records import TestRecordReader, TestRecordWriter
+from newhelm.runners.async_test_runner import run_prompt_response_test_async
+from newhelm.runners.coordinated_test_runner import (
+    run_prompt_response_test_coordinated,
+    run_worker,
+)
+from newhelm.runners.pipelined_test_runner import run_prompt_response_test_pipelined
+from newhelm.runners.sharding import make_shard, merge_test_records
 from newhelm.runners.simple_test_runner import (
     run_prompt_response_test,
 )
+from newhelm.runners.work_queue import WorkQueue
 from newhelm.secret_values import MissingSecretValues
 from newhelm.sut import PromptResponseSUT
 from newhelm.sut_registry import SUTS
 from newhelm.test_registry import TESTS
 
+RATE_LIMIT_OPTIONS = [
+    click.option(
+        "--sut-requests-per-minute",
+        type=click.FloatRange(min=0, min_open=True),
+        help="Keep calls to the SUT under this many requests per minute.",
+    ),
+    click.option(
+        "--sut-tokens-per-minute",
+        type=click.FloatRange(min=0, min_open=True),
+        help="Keep calls to the SUT under roughly this many tokens per minute.",
+    ),
+    click.option(
+        "--rate-limit-dir",
+        help="Share SUT and annotator rate limits with every process using this directory.",
+    ),
+]
+
+
+def rate_limit_options(command):
+    for option in reversed(RATE_LIMIT_OPTIONS):
+        command = option(command)
+    return command
+
+
+def _set_sut_rate_limit(
+    sut: PromptResponseSUT,
+    requests_per_minute: Optional[float],
+    tokens_per_minute: Optional[float],
+):
+    """Override the SUT's declared rate limit with any given on the command line."""
+    if requests_per_minute is None and tokens_per_minute is None:
+        return
+    sut.rate_limit = RateLimit(
+        requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute
+    )
+
 
 @newhelm_cli.command()
 @click.option("--test", help="Which registered TEST to run.", required=True)
@@ -26,7 +73,7 @@ from newhelm.test_registry import TESTS
 @MAX_TEST_ITEMS_OPTION
 @click.option(
     "--output-file",
-    help="If specified, will override the default location for outputting the TestRecord.",
+    help="If specified, will override the default location for outputting the TestRecord. It is written as JSON Lines, see TestRecordWriter.",
 )
 @click.option(
     "--no-caching",
@@ -35,6 +82,34 @@ from newhelm.test_registry import TESTS
     default=False,
     help="Disable caching.",
 )
+@click.option(
+    "--shared-cache",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Store caches so that many processes, even on different hosts, can use them at once.",
+)
+@click.option(
+    "--global-sut-cache",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Share cached SUT responses across all Tests in --data-dir.",
+)
+@click.option(
+    "--replay-only",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Serve everything from the cache, failing with a list of what's missing instead of calling the SUT or annotators.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Skip the TestItems an interrupted run with the same --data-dir already finished.",
+)
 @click.option(
     "--no-progress-bar",
     is_flag=True,
@@ -42,6 +117,54 @@ from newhelm.test_registry import TESTS
     default=False,
     help="Disable displaying the 'Processing TestItems' progress bar.",
 )
+@click.option(
+    "--parallel",
+    default=1,
+    type=click.IntRange(1),
+    show_default=True,
+    help="How many TestItems to process concurrently.",
+)
+@click.option(
+    "--use-asyncio",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Process TestItems in an asyncio event loop, with up to --parallel in flight.",
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the SUT and each annotator as separate stages, each with --parallel workers.",
+)
+@click.option(
+    "--sut-batch-size",
+    default=1,
+    type=click.IntRange(1),
+    show_default=True,
+    help="If the SUT supports batching, how many uncached requests to send it at once.",
+)
+@click.option(
+    "--shard-index",
+    default=0,
+    type=click.IntRange(0),
+    show_default=True,
+    help="Which of the --shard-count shards of the TestItems to run.",
+)
+@click.option(
+    "--shard-count",
+    default=1,
+    type=click.IntRange(1),
+    show_default=True,
+    help="Split the TestItems into this many shards, for example to run on several machines. Combine the outputs with merge-records.",
+)
+@click.option(
+    "--work-queue",
+    type=click.Path(dir_okay=False),
+    help="Instead of processing TestItems, put them in this queue file for `worker` processes and wait for them to finish. The file must be on a local file system, not NFS.",
+)
+@rate_limit_options
 def run_test(
     test: str,
     sut: str,
@@ -49,9 +172,54 @@ def run_test(
     max_test_items: int,
     output_file: Optional[str],
     no_caching: bool,
+    shared_cache: bool,
+    global_sut_cache: bool,
+    replay_only: bool,
+    resume: bool,
     no_progress_bar: bool,
+    parallel: int,
+    use_asyncio: bool,
+    pipeline: bool,
+    sut_batch_size: int,
+    shard_index: int,
+    shard_count: int,
+    work_queue: Optional[str],
+    sut_requests_per_minute: Optional[float],
+    sut_tokens_per_minute: Optional[float],
+    rate_limit_dir: Optional[str],
 ):
     """Run the Test on the desired SUT and output the TestRecord."""
+    if use_asyncio and pipeline:
+        raise click.UsageError("Cannot use both --use-asyncio and --pipeline.")
+    if replay_only and no_caching:
+        raise click.UsageError("Cannot use both --replay-only and --no-caching.")
+    if sut_batch_size > 1 and (use_asyncio or pipeline or work_queue):
+        raise click.UsageError(
+            "--sut-batch-size only works without --use-asyncio, --pipeline and --work-queue."
+        )
+    if shard_index >= shard_count:
+        raise click.UsageError("--shard-index must be less than --shard-count.")
+    shard = make_shard(shard_index, shard_count)
+    if work_queue and (use_asyncio or pipeline or replay_only or shard):
+        raise click.UsageError(
+            "Cannot use --work-queue with --use-asyncio, --pipeline, --replay-only or --shard-count."
+        )
+    # The workers make every SUT and annotator call, so these belong on `worker`.
+    worker_options = {
+        "--no-caching": no_caching,
+        "--shared-cache": shared_cache,
+        "--global-sut-cache": global_sut_cache,
+        "--parallel": parallel > 1,
+        "--sut-requests-per-minute": sut_requests_per_minute is not None,
+        "--sut-tokens-per-minute": sut_tokens_per_minute is not None,
+        "--rate-limit-dir": rate_limit_dir is not None,
+    }
+    used_worker_options = [name for name, used in worker_options.items() if used]
+    if work_queue and used_worker_options:
+        raise click.UsageError(
+            f"Pass {', '.join(used_worker_options)} to each `worker` instead, "
+            "as --work-queue leaves all the processing to them."
+        )
     secrets = load_secrets_from_config()
     # Check for missing secrets without instantiating any objects
     missing_secrets: List[MissingSecretValues] = []
@@ -65,23 +233,197 @@ def run_test(
     # Current this only knows how to do prompt response, so assert that is what we have.
     assert isinstance(sut_obj, PromptResponseSUT)
     assert isinstance(test_obj, BasePromptResponseTest)
+    _set_sut_rate_limit(sut_obj, sut_requests_per_minute, sut_tokens_per_minute)
 
     if output_file is None:
         os.makedirs("output", exist_ok=True)
+        shard_suffix = ""
+        if shard is not None:
+            shard_suffix = f"_shard_{shard.index}_of_{shard.count}"
         output_file = os.path.join(
-            "output", normalize_filename(f"record_for_{test}_{sut}.json")
+            "output",
+            normalize_filename(f"record_for_{test}_{sut}{shard_suffix}.jsonl"),
         )
-    test_record = run_prompt_response_test(
+    # Stream TestItemRecords to the file as they finish, rather than holding them all.
+    with TestRecordWriter(output_file) as record_writer:
+        if work_queue:
+            test_record = run_prompt_response_test_coordinated(
+                test_obj,
+                sut_obj,
+                data_dir,
+                WorkQueue(work_queue),
+                max_test_items,
+                resume=resume,
+                record_writer=record_writer,
+                disable_progress_bar=no_progress_bar,
+            )
+        elif use_asyncio:
+            test_record = asyncio.run(
+                run_prompt_response_test_async(
+                    test_obj,
+                    sut_obj,
+                    data_dir,
+                    max_test_items,
+                    use_caching=not no_caching,
+                    shared_cache=shared_cache,
+                    global_sut_cache=global_sut_cache,
+                    replay_only=replay_only,
+                    resume=resume,
+                    record_writer=record_writer,
+                    shard=shard,
+                    rate_limit_directory=rate_limit_dir,
+                    disable_progress_bar=no_progress_bar,
+                    max_concurrency=parallel,
+                )
+            )
+        elif pipeline:
+            test_record = run_prompt_response_test_pipelined(
+                test_obj,
+                sut_obj,
+                data_dir,
+                max_test_items,
+                use_caching=not no_caching,
+                shared_cache=shared_cache,
+                global_sut_cache=global_sut_cache,
+                replay_only=replay_only,
+                resume=resume,
+                record_writer=record_writer,
+                shard=shard,
+                rate_limit_directory=rate_limit_dir,
+                disable_progress_bar=no_progress_bar,
+                workers_per_stage=parallel,
+            )
+        else:
+            test_record = run_prompt_response_test(
+                test_obj,
+                sut_obj,
+                data_dir,
+                max_test_items,
+                use_caching=not no_caching,
+                shared_cache=shared_cache,
+                global_sut_cache=global_sut_cache,
+                replay_only=replay_only,
+                resume=resume,
+                record_writer=record_writer,
+                shard=shard,
+                rate_limit_directory=rate_limit_dir,
+                disable_progress_bar=no_progress_bar,
+                max_workers=parallel,
+                sut_batch_size=sut_batch_size,
+            )
+    print(test_record.model_dump_json(indent=4))
+    print("Full TestRecord written to", output_file)
+
+
+@newhelm_cli.command()
+@click.option(
+    "--work-queue",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="The queue file a `run-test --work-queue` is waiting on.",
+)
+@DATA_DIR_OPTION
+@click.option(
+    "--no-caching",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Disable caching.",
+)
+@click.option(
+    "--shared-cache",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Store caches so that many processes, even on different hosts, can use them at once.",
+)
+@click.option(
+    "--global-sut-cache",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Share cached SUT responses across all Tests in --data-dir.",
+)
+@click.option(
+    "--parallel",
+    default=1,
+    type=click.IntRange(1),
+    show_default=True,
+    help="How many TestItems to process concurrently.",
+)
+@rate_limit_options
+def worker(
+    work_queue: str,
+    data_dir: str,
+    no_caching: bool,
+    shared_cache: bool,
+    global_sut_cache: bool,
+    parallel: int,
+    sut_requests_per_minute: Optional[float],
+    sut_tokens_per_minute: Optional[float],
+    rate_limit_dir: Optional[str],
+):
+    """Process TestItems from a run-test's --work-queue until none are left."""
+    queue = WorkQueue(work_queue)
+    uids = queue.run_uids()
+    if uids is None:
+        raise click.UsageError(f"Nothing has been put in {work_queue} yet.")
+    test, sut = uids
+    secrets = load_secrets_from_config()
+    missing_secrets: List[MissingSecretValues] = []
+    missing_secrets.extend(TESTS.get_missing_dependencies(test, secrets=secrets))
+    missing_secrets.extend(SUTS.get_missing_dependencies(sut, secrets=secrets))
+    raise_if_missing_from_config(missing_secrets)
+
+    test_obj = TESTS.make_instance(test, secrets=secrets)
+    sut_obj = SUTS.make_instance(sut, secrets=secrets)
+    assert isinstance(sut_obj, PromptResponseSUT)
+    assert isinstance(test_obj, BasePromptResponseTest)
+    _set_sut_rate_limit(sut_obj, sut_requests_per_minute, sut_tokens_per_minute)
+
+    finished = run_worker(
         test_obj,
         sut_obj,
         data_dir,
-        max_test_items,
+        queue,
         use_caching=not no_caching,
-        disable_progress_bar=no_progress_bar,
+        shared_cache=shared_cache,
+        global_sut_cache=global_sut_cache,
+        max_workers=parallel,
+        rate_limit_directory=rate_limit_dir,
     )
-    with open(output_file, "w") as f:
-        print(test_record.model_dump_json(indent=4), file=f)
-    # For displaying to the screen, clear out the verbose test_item_records
-    test_record.test_item_records = []
+    print(f"Finished {finished} TestItems for test={test} sut={sut}.")
+
+
+@newhelm_cli.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--output-file",
+    help="If specified, will override the default location for outputting the merged TestRecord.",
+)
+def merge_records(paths: List[str], output_file: Optional[str]):
+    """Combine the TestRecords from every shard of a run-test into one TestRecord."""
+    try:
+        header = TestRecordReader(paths[0]).header
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="PATHS") from e
+    secrets = load_secrets_from_config()
+    raise_if_missing_from_config(
+        TESTS.get_missing_dependencies(header.test_uid, secrets=secrets)
+    )
+    test_obj = TESTS.make_instance(header.test_uid, secrets=secrets)
+    assert isinstance(test_obj, BasePromptResponseTest)
+
+    if output_file is None:
+        os.makedirs("output", exist_ok=True)
+        output_file = os.path.join(
+            "output",
+            normalize_filename(f"record_for_{header.test_uid}_{header.sut_uid}.jsonl"),
+        )
+    with TestRecordWriter(output_file) as record_writer:
+        try:
+            test_record = merge_test_records(test_obj, paths, record_writer)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="PATHS") from e
     print(test_record.model_dump_json(indent=4))
-    print("Full TestRecord json written to", output_file)
+    print("Full TestRecord written to", output_file)
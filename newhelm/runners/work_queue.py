@@ -0,0 +1,214 @@
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Collection, Dict, Iterator, List, Optional, Tuple
+
+from newhelm.records import TestItemRecord
+from newhelm.runners.run_journal import journal_key
+from newhelm.single_turn_prompt_response import TestItem
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS run (
+    test_uid TEXT NOT NULL,
+    sut_uid TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    position INTEGER PRIMARY KEY,
+    item_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    record TEXT
+);
+"""
+
+
+@dataclass(frozen=True)
+class Lease:
+    """Permission for one worker to process one TestItem until the lease expires."""
+
+    position: int
+    item_key: str
+    worker: str
+
+
+class WorkQueue:
+    """Durable queue of the TestItems in a run, shared by any number of worker processes.
+
+    Workers lease TestItems for `lease_seconds` and must `heartbeat` to keep them.
+    Leases that expire, for example because the worker died, go back in the queue.
+    A TestItem that fails `max_attempts` times is marked as failed instead.
+
+    The queue is a SQLite file, which relies on the file system's locks to keep
+    workers from leasing the same TestItem. Only local file systems are supported,
+    so every worker must run on the machine holding the queue. Network file systems
+    such as NFS often don't implement those locks correctly, which can corrupt the
+    queue. To spread a run over machines, use shards and a DirectoryCache instead.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 60, max_attempts: int = 3):
+        assert lease_seconds > 0, f"Cannot lease TestItems for {lease_seconds}s."
+        assert max_attempts > 0, f"Cannot try TestItems {max_attempts} times."
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as connection:
+            connection.executescript(_SCHEMA)
+
+    def fill(
+        self,
+        test_uid: str,
+        sut_uid: str,
+        test_items: List[TestItem],
+        skip: Collection[int] = (),
+    ):
+        """Add every TestItem to the queue, unless it already holds this run.
+
+        The TestItems at the positions in `skip` are already finished elsewhere, so
+        workers never get them. If the queue already holds this run, those TestItems
+        are skipped unless a worker has leased or finished them.
+        """
+        keys = [journal_key(item) for item in test_items]
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            run = connection.execute("SELECT test_uid, sut_uid FROM run").fetchone()
+            if run is None:
+                connection.execute("INSERT INTO run VALUES (?, ?)", (test_uid, sut_uid))
+                connection.executemany(
+                    "INSERT INTO items (position, item_key, state) VALUES (?, ?, ?)",
+                    [
+                        (position, key, SKIPPED if position in skip else PENDING)
+                        for position, key in enumerate(keys)
+                    ],
+                )
+                connection.execute("COMMIT")
+                return
+            existing_keys = [
+                key
+                for key, in connection.execute(
+                    "SELECT item_key FROM items ORDER BY position"
+                )
+            ]
+            if run != (test_uid, sut_uid) or existing_keys != keys:
+                connection.execute("ROLLBACK")
+                raise ValueError(
+                    f"Cannot use {self.path}: it already holds a different run, "
+                    f"for test={run[0]} sut={run[1]}."
+                )
+            connection.executemany(
+                "UPDATE items SET state = ? WHERE position = ? AND state IN (?, ?)",
+                [(SKIPPED, position, PENDING, FAILED) for position in skip],
+            )
+            connection.execute("COMMIT")
+
+    def run_uids(self) -> Optional[Tuple[str, str]]:
+        """The test and SUT uids of the run in the queue, if it has been filled."""
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT test_uid, sut_uid FROM run").fetchone()
+
+    def lease(self, worker: str) -> Optional[Lease]:
+        """Take the next TestItem that is pending or whose lease expired, if any."""
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT position, item_key FROM items "
+                "WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY position LIMIT 1",
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if row is None:
+                connection.execute("ROLLBACK")
+                return None
+            connection.execute(
+                "UPDATE items SET state = ?, worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE position = ?",
+                (LEASED, worker, now + self.lease_seconds, row[0]),
+            )
+            connection.execute("COMMIT")
+        return Lease(position=row[0], item_key=row[1], worker=worker)
+
+    def heartbeat(self, worker: str):
+        """Extend every lease `worker` still holds."""
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE items SET lease_expires = ? WHERE state = ? AND worker = ?",
+                (time.time() + self.lease_seconds, LEASED, worker),
+            )
+
+    def complete(self, lease: Lease, record: TestItemRecord):
+        """Store the finished record, unless another worker already finished it."""
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE items SET state = ?, worker = NULL, lease_expires = NULL, "
+                "record = ? WHERE position = ? AND state != ?",
+                (DONE, record.model_dump_json(), lease.position, DONE),
+            )
+
+    def fail(self, lease: Lease, error: str):
+        """Put the TestItem back in the queue, or give up if it failed too many times.
+
+        Nothing happens if the lease already expired and another worker took the TestItem.
+        """
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE items SET "
+                "state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "worker = NULL, lease_expires = NULL, error = ? "
+                "WHERE position = ? AND state = ? AND worker = ?",
+                (
+                    self.max_attempts,
+                    FAILED,
+                    PENDING,
+                    error,
+                    lease.position,
+                    LEASED,
+                    lease.worker,
+                ),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """How many TestItems are in each state."""
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0, SKIPPED: 0}
+        with closing(self._connect()) as connection:
+            for state, count in connection.execute(
+                "SELECT state, COUNT(*) FROM items GROUP BY state"
+            ):
+                counts[state] = count
+        return counts
+
+    def is_finished(self) -> bool:
+        """True once no TestItem is waiting for or being processed by a worker."""
+        counts = self.counts()
+        return counts[PENDING] == 0 and counts[LEASED] == 0
+
+    def errors(self) -> Dict[int, str]:
+        """The last error of each failed TestItem, keyed by position."""
+        with closing(self._connect()) as connection:
+            return dict(
+                connection.execute(
+                    "SELECT position, error FROM items WHERE state = ?", (FAILED,)
+                ).fetchall()
+            )
+
+    def records(self) -> Iterator[Tuple[int, TestItemRecord]]:
+        """Each finished record in order, with the position of its TestItem."""
+        with closing(self._connect()) as connection:
+            for position, record in connection.execute(
+                "SELECT position, record FROM items WHERE state = ? ORDER BY position",
+                (DONE,),
+            ):
+                yield position, TestItemRecord.model_validate_json(record)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly, so every other statement autocommits.
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
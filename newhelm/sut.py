@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
+import asyncio
 from typing import Generic, List, Optional, Sequence, Type, TypeVar
 
 from pydantic import BaseModel
 
 from newhelm.prompt import ChatPrompt, TextPrompt
+from newhelm.rate_limiting import RateLimit, estimate_tokens
 from newhelm.record_init import InitializationRecord
 from newhelm.sut_capabilities import SUTCapability
 from newhelm.tracked_object import TrackedObject
@@ -54,6 +56,9 @@ class SUT(TrackedObject):
 class PromptResponseSUT(SUT, ABC, Generic[RequestType, ResponseType]):
     """The base class for any SUT that is designed for handling a single-turn."""
 
+    rate_limit: Optional[RateLimit] = None
+    """If set, runners wait as needed so calls to `evaluate` stay under this limit."""
+
     @abstractmethod
     def translate_text_prompt(self, prompt: TextPrompt) -> RequestType:
         pass
@@ -66,8 +71,41 @@ class PromptResponseSUT(SUT, ABC, Generic[RequestType, ResponseType]):
     def evaluate(self, request: RequestType) -> ResponseType:
         pass
 
+    def evaluate_batch(self, requests: List[RequestType]) -> List[ResponseType]:
+        """Evaluate many requests, returning responses in the same order.
+
+        SUTs that can amortize work across requests should override this and
+        declare the AcceptsBatchRequests capability. By default it calls `evaluate`
+        on each request.
+        """
+        return [self.evaluate(request) for request in requests]
+
+    def estimate_tokens(self, request: RequestType) -> int:
+        """How many tokens `request` counts against `rate_limit`.
+
+        By default this is estimated from the length of the request. SUTs whose
+        provider also counts the tokens they generate should override this.
+        """
+        return estimate_tokens(request)
+
     @abstractmethod
     def translate_response(
         self, request: RequestType, response: ResponseType
     ) -> SUTResponse:
         pass
+
+
+class AsyncPromptResponseSUT(PromptResponseSUT[RequestType, ResponseType], ABC):
+    """A PromptResponseSUT that can also evaluate requests natively in an asyncio event loop.
+
+    Runners that use asyncio will call `evaluate_async` instead of `evaluate`, which lets a
+    single event loop keep many requests in flight without a thread per request.
+    """
+
+    @abstractmethod
+    async def evaluate_async(self, request: RequestType) -> ResponseType:
+        pass
+
+    def evaluate(self, request: RequestType) -> ResponseType:
+        """By default, evaluate synchronously by running `evaluate_async` to completion."""
+        return asyncio.run(self.evaluate_async(request))
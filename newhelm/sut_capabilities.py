@@ -27,3 +27,9 @@ class ProducesPerTokenLogProbabilities(SUTCapability):
     @classmethod
     def description(cls) -> str:
         return "These SUTs set the 'top_logprobs' field in SUTResponse."
+
+
+class AcceptsBatchRequests(SUTCapability):
+    @classmethod
+    def description(cls) -> str:
+        return "These SUTs can evaluate many requests more efficiently with `evaluate_batch` than one at a time."
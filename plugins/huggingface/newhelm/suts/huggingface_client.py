@@ -22,7 +22,11 @@ from newhelm.secret_values import (
     SecretDescription,
 )
 from newhelm.sut import SUTCompletion, PromptResponseSUT, SUTResponse
-from newhelm.sut_capabilities import AcceptsChatPrompt, AcceptsTextPrompt
+from newhelm.sut_capabilities import (
+    AcceptsBatchRequests,
+    AcceptsChatPrompt,
+    AcceptsTextPrompt,
+)
 from newhelm.sut_decorator import newhelm_sut
 from newhelm.sut_registry import SUTS
 
@@ -97,6 +101,54 @@ class StopAtSpecificTokenCriteria(StoppingCriteria):
         return bool(torch.all(current_sequence == stop_sequence_tensor).item())
 
 
+class StopWhenEverySequenceStops(StoppingCriteria):
+    """Stop a batch of sequences once each of them has ended with one of `stop_sequences`.
+
+    Sequences that stop early keep generating until the whole batch is done,
+    so their output must be truncated afterwards.
+    """
+
+    def __init__(self, stop_sequences: List[List[int]]):
+        super().__init__()
+        self.stop_sequences = stop_sequences
+        self.stopped: Optional[torch.Tensor] = None
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> bool:
+        if self.stopped is None:
+            self.stopped = torch.zeros(
+                input_ids.shape[0], dtype=torch.bool, device=input_ids.device
+            )
+        for stop_sequence in self.stop_sequences:
+            if input_ids.shape[1] < len(stop_sequence):
+                continue
+            stop_sequence_tensor = torch.tensor(
+                stop_sequence, device=input_ids.device, dtype=input_ids.dtype
+            )
+            current_sequences = input_ids[:, -len(stop_sequence) :]
+            self.stopped |= torch.all(current_sequences == stop_sequence_tensor, dim=1)
+        # Older versions of transformers require a single bool for the whole batch.
+        return bool(self.stopped.all().item())
+
+
+def _decode_each_token(tokenizer: Any, token_ids) -> List[str]:
+    """Decode every token on its own, so they line up with their logprobs."""
+    return [tokenizer.decode(token) for token in token_ids]
+
+
+def _find_stop(token_ids: List[int], stop_sequences: List[List[int]]) -> int:
+    """Return how many of `token_ids` to keep, up to and including the first stop sequence."""
+    for end in range(1, len(token_ids) + 1):
+        for stop_sequence in stop_sequences:
+            if (
+                stop_sequence
+                and token_ids[:end][-len(stop_sequence) :] == stop_sequence
+            ):
+                return end
+    return len(token_ids)
+
+
 class HuggingFaceRequest(BaseModel):
     """Data passed between make_request and serve_request. Used as the cache key."""
 
@@ -260,9 +312,13 @@ class HuggingFaceToken(OptionalSecret):
         )
 
 
-@newhelm_sut(capabilities=[AcceptsTextPrompt, AcceptsChatPrompt])
+@newhelm_sut(capabilities=[AcceptsTextPrompt, AcceptsChatPrompt, AcceptsBatchRequests])
 class HuggingFaceSUT(PromptResponseSUT[HuggingFaceRequest, HuggingFaceResponse]):
-    """A thin wrapper around a Hugging Face AutoModelForCausalLM for HuggingFaceClient to call."""
+    """A thin wrapper around a Hugging Face AutoModelForCausalLM for HuggingFaceClient to call.
+
+    `evaluate_batch` generates for every request with the same generation settings
+    in a single left-padded call to `generate`.
+    """
 
     def __init__(
         self,
@@ -322,26 +378,17 @@ class HuggingFaceSUT(PromptResponseSUT[HuggingFaceRequest, HuggingFaceResponse])
         top_k_per_token: int = raw_request.top_k_per_token
         stopping_criteria: Optional[StoppingCriteriaList] = None
         optional_args = {}
-        if len(raw_request.stop_sequences) > 0:
-            with self.wrapped_tokenizer as tokenizer:
-                stop_sequence_ids = tokenizer(
-                    raw_request.stop_sequences,
-                    return_token_type_ids=False,
-                    add_special_tokens=False,
+        eos_token_id, stop_sequence_ids = self._tokenize_stop_sequences(
+            raw_request.stop_sequences
+        )
+        if eos_token_id is not None:
+            optional_args["eos_token_id"] = eos_token_id
+        elif stop_sequence_ids:
+            stopping_criteria = StoppingCriteriaList()
+            for stop_sequence_input_ids in stop_sequence_ids:
+                stopping_criteria.append(
+                    StopAtSpecificTokenCriteria(stop_sequence=stop_sequence_input_ids)
                 )
-            if (
-                len(stop_sequence_ids.input_ids) == 1
-                and len(stop_sequence_ids.input_ids[0]) == 1
-            ):
-                optional_args["eos_token_id"] = stop_sequence_ids.input_ids[0][0]
-            else:
-                stopping_criteria = StoppingCriteriaList()
-                for stop_sequence_input_ids in stop_sequence_ids.input_ids:
-                    stopping_criteria.append(
-                        StopAtSpecificTokenCriteria(
-                            stop_sequence=stop_sequence_input_ids
-                        )
-                    )
 
         # Check if we need to compute the perplexity of the prompt (#1497)
         compute_logprobs_only = (
@@ -370,7 +417,8 @@ class HuggingFaceSUT(PromptResponseSUT[HuggingFaceRequest, HuggingFaceResponse])
                 stopping_criteria=stopping_criteria,
             )
             sequences = output.sequences
-            scores = output.scores
+            # One (num_return_sequences, num_generated, vocab_size) tensor.
+            scores = torch.stack(output.scores, dim=1)
 
         prompt_tokens_logprobs = []
         prompt_tokens_top_logprobs_dicts: List[Dict] = []
@@ -379,54 +427,30 @@ class HuggingFaceSUT(PromptResponseSUT[HuggingFaceRequest, HuggingFaceResponse])
             prompt_tokens_logprobs.append(0.0)
             prompt_tokens_top_logprobs_dicts.append({})
 
-            # Compute logprobs of prompt tokens.
+            # Compute logprobs of prompt tokens, each predicted by the previous position.
             for completion_id in range(raw_request.num_return_sequences):
-                for i in range(len(sequences[completion_id]) - 1):
-                    logprobs = torch.nn.functional.log_softmax(
-                        scores[completion_id][i], dim=0
-                    )
-                    topk_logprobs = torch.topk(logprobs, k=top_k_per_token)
-                    with self.wrapped_tokenizer as tokenizer:
-                        prompt_tokens_top_logprobs_dicts.append(
-                            {
-                                tokenizer.convert_ids_to_tokens(k.item()): v.item()
-                                for (k, v) in zip(
-                                    topk_logprobs.indices, topk_logprobs.values
-                                )
-                            }
-                        )
-                    prompt_tokens_logprobs.append(
-                        logprobs[sequences[completion_id][i + 1]].item()
-                    )
+                logprobs, top_logprobs_dicts = self._compute_logprobs(
+                    scores[completion_id][:-1],
+                    sequences[completion_id][1:],
+                    top_k_per_token,
+                )
+                prompt_tokens_logprobs.extend(logprobs)
+                prompt_tokens_top_logprobs_dicts.extend(top_logprobs_dicts)
 
         # Compute logprobs of generated tokens for each completed sequence.
         all_generated_tokens_logprobs = []
         all_generated_tokens_top_logprobs_dicts = []
         for completion_id in range(raw_request.num_return_sequences):
-            generated_tokens_logprobs = []
-            generated_tokens_top_logprobs_dicts = []
-            for i in range(
-                len(sequences[completion_id]) - len(encoded_input.input_ids[0])
-            ):
-                logprobs = torch.nn.functional.log_softmax(
-                    scores[i][completion_id], dim=0
-                )
-                # Get top tokens in terms of log probability.
-                topk_logprobs = torch.topk(logprobs, k=top_k_per_token)
-                with self.wrapped_tokenizer as tokenizer:
-                    generated_tokens_top_logprobs_dicts.append(
-                        {
-                            tokenizer.convert_ids_to_tokens(k.item()): v.item()
-                            for (k, v) in zip(
-                                topk_logprobs.indices, topk_logprobs.values
-                            )
-                        }
-                    )
-                # Get log probability of chosen token.
-                j = i + len(encoded_input.input_ids[0])
-                generated_tokens_logprobs.append(
-                    logprobs[sequences[completion_id][j]].item()
-                )
+            prompt_length = len(encoded_input.input_ids[0])
+            generated_ids = sequences[completion_id][prompt_length:]
+            (
+                generated_tokens_logprobs,
+                generated_tokens_top_logprobs_dicts,
+            ) = self._compute_logprobs(
+                scores[completion_id][: len(generated_ids)],
+                generated_ids,
+                top_k_per_token,
+            )
             all_generated_tokens_logprobs.append(generated_tokens_logprobs)
             all_generated_tokens_top_logprobs_dicts.append(
                 generated_tokens_top_logprobs_dicts
@@ -440,7 +464,7 @@ class HuggingFaceSUT(PromptResponseSUT[HuggingFaceRequest, HuggingFaceResponse])
 
         with self.wrapped_tokenizer as tokenizer:
             all_tokens = [
-                [tokenizer.decode(token) for token in sequence_tokens]
+                _decode_each_token(tokenizer, sequence_tokens)
                 for sequence_tokens in sequences
             ]
             all_decoded_text = tokenizer.batch_decode(sequences)
@@ -473,6 +497,193 @@ class HuggingFaceSUT(PromptResponseSUT[HuggingFaceRequest, HuggingFaceResponse])
             input_length=len(encoded_input.input_ids[0]),
         )
 
+    def evaluate_batch(
+        self, requests: List[HuggingFaceRequest]
+    ) -> List[HuggingFaceResponse]:
+        if not self.model or not self.wrapped_tokenizer:
+            self.model, self.wrapped_tokenizer = self._load_model()
+        responses: Dict[int, HuggingFaceResponse] = {}
+        # Only requests with the same generation settings can share a call to generate.
+        groups: Dict[str, List[int]] = {}
+        for index, request in enumerate(requests):
+            if self._can_generate_in_batch(request):
+                settings = request.model_dump_json(exclude={"prompt"})
+                groups.setdefault(settings, []).append(index)
+            else:
+                responses[index] = self.evaluate(request)
+        for indexes in groups.values():
+            if len(indexes) == 1:
+                responses[indexes[0]] = self.evaluate(requests[indexes[0]])
+                continue
+            group_responses = self._generate_batch([requests[i] for i in indexes])
+            for index, response in zip(indexes, group_responses):
+                responses[index] = response
+        assert len(responses) == len(requests), "Every request needs a response."
+        return [responses[index] for index in range(len(requests))]
+
+    def _can_generate_in_batch(self, request: HuggingFaceRequest) -> bool:
+        """Send anything `evaluate` treats specially down the single request path."""
+        assert self.model_path == request.model
+        assert self.wrapped_tokenizer
+        if request.echo_prompt or request.max_new_tokens == 0:
+            return False
+        with self.wrapped_tokenizer as tokenizer:
+            num_input_tokens = len(
+                tokenizer(request.prompt, return_token_type_ids=False).input_ids
+            )
+            return (
+                num_input_tokens + request.max_new_tokens <= tokenizer.model_max_length
+            )
+
+    def _generate_batch(
+        self, requests: List[HuggingFaceRequest]
+    ) -> List[HuggingFaceResponse]:
+        """Generate for requests that differ only in their prompt, using left padding."""
+        assert self.model and self.wrapped_tokenizer
+        settings = requests[0]
+        with self.wrapped_tokenizer as tokenizer:
+            padding_side = tokenizer.padding_side
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            tokenizer.padding_side = "left"
+            try:
+                encoded_input = tokenizer(
+                    [request.prompt for request in requests],
+                    return_tensors="pt",
+                    return_token_type_ids=False,
+                    padding=True,
+                ).to(self.device)
+            finally:
+                tokenizer.padding_side = padding_side
+            pad_token_id = tokenizer.pad_token_id
+
+        optional_args = {}
+        eos_token_id, stop_sequence_ids = self._tokenize_stop_sequences(
+            settings.stop_sequences
+        )
+        if eos_token_id is not None:
+            optional_args["eos_token_id"] = eos_token_id
+            stop_sequence_ids = [[eos_token_id]]
+        else:
+            model_eos = self.model.generation_config.eos_token_id
+            if isinstance(model_eos, int):
+                model_eos = [model_eos]
+            stop_sequence_ids = stop_sequence_ids + [[eos] for eos in model_eos or []]
+        stopping_criteria = StoppingCriteriaList(
+            [StopWhenEverySequenceStops(stop_sequence_ids)]
+        )
+
+        output = self.model.generate(
+            **encoded_input,
+            temperature=settings.temperature,
+            num_return_sequences=settings.num_return_sequences,
+            max_new_tokens=settings.max_new_tokens,
+            top_p=settings.top_p,
+            do_sample=True,
+            return_dict_in_generate=True,
+            output_scores=True,
+            pad_token_id=pad_token_id,
+            **optional_args,
+            stopping_criteria=stopping_criteria,
+        )
+        padded_prompt_length = encoded_input.input_ids.shape[1]
+        # One (batch_size * num_return_sequences, num_generated, vocab_size) tensor.
+        scores = torch.stack(output.scores, dim=1)
+        input_lengths = encoded_input.attention_mask.sum(dim=1).tolist()
+
+        responses = []
+        for request_id, input_length in enumerate(input_lengths):
+            all_generated_ids = []
+            all_generated_tokens_logprobs = []
+            all_generated_tokens_top_logprobs_dicts = []
+            for completion_id in range(settings.num_return_sequences):
+                row = request_id * settings.num_return_sequences + completion_id
+                generated_ids = output.sequences[row][padded_prompt_length:].tolist()
+                # Sequences that finished early were kept going, so cut them off.
+                generated_ids = generated_ids[
+                    : _find_stop(generated_ids, stop_sequence_ids)
+                ]
+                logprobs, top_logprobs_dicts = self._compute_logprobs(
+                    scores[row][: len(generated_ids)],
+                    generated_ids,
+                    settings.top_k_per_token,
+                )
+                all_generated_ids.append(generated_ids)
+                all_generated_tokens_logprobs.append(logprobs)
+                all_generated_tokens_top_logprobs_dicts.append(top_logprobs_dicts)
+
+            with self.wrapped_tokenizer as tokenizer:
+                all_tokens = [
+                    _decode_each_token(tokenizer, generated_ids)
+                    for generated_ids in all_generated_ids
+                ]
+                all_decoded_text = tokenizer.batch_decode(all_generated_ids)
+            completions = [
+                HuggingFaceCompletion(
+                    text=decoded_text,
+                    tokens=tokens,
+                    logprobs=logprobs,
+                    top_logprobs_dicts=top_logprobs_dicts,
+                    prompt_logprobs=[],
+                    prompt_top_logprobs_dicts=[],
+                )
+                for decoded_text, tokens, logprobs, top_logprobs_dicts in zip(
+                    all_decoded_text,
+                    all_tokens,
+                    all_generated_tokens_logprobs,
+                    all_generated_tokens_top_logprobs_dicts,
+                )
+            ]
+            responses.append(
+                HuggingFaceResponse(completions=completions, input_length=input_length)
+            )
+        return responses
+
+    def _tokenize_stop_sequences(
+        self, stop_sequences: List[str]
+    ) -> Tuple[Optional[int], List[List[int]]]:
+        """Return the token to use as eos if there is a single one token stop sequence,
+        and the token ids of every stop sequence."""
+        assert self.wrapped_tokenizer
+        if len(stop_sequences) == 0:
+            return None, []
+        with self.wrapped_tokenizer as tokenizer:
+            stop_sequence_ids = tokenizer(
+                stop_sequences,
+                return_token_type_ids=False,
+                add_special_tokens=False,
+            ).input_ids
+        if len(stop_sequence_ids) == 1 and len(stop_sequence_ids[0]) == 1:
+            return stop_sequence_ids[0][0], stop_sequence_ids
+        return None, stop_sequence_ids
+
+    def _compute_logprobs(
+        self, scores: torch.Tensor, token_ids, top_k_per_token: int
+    ) -> Tuple[List[float], List[Dict[str, float]]]:
+        """Get the logprob of each chosen token and the top logprobs at its position.
+
+        `scores` has shape (num_tokens, vocab_size) and `token_ids` has num_tokens ids.
+        """
+        assert self.wrapped_tokenizer
+        if len(token_ids) == 0:
+            return [], []
+        logprobs = torch.nn.functional.log_softmax(scores, dim=-1)
+        # Get log probability of each chosen token.
+        token_ids = torch.as_tensor(token_ids, device=logprobs.device).view(-1, 1)
+        tokens_logprobs = logprobs.gather(1, token_ids).squeeze(1).tolist()
+        # Get top tokens in terms of log probability.
+        topk_logprobs = torch.topk(logprobs, k=top_k_per_token, dim=-1)
+        with self.wrapped_tokenizer as tokenizer:
+            top_tokens = tokenizer.convert_ids_to_tokens(
+                topk_logprobs.indices.flatten().tolist()
+            )
+        top_values = topk_logprobs.values.tolist()
+        tokens_top_logprobs_dicts = [
+            dict(zip(top_tokens[i * top_k_per_token :], values))
+            for i, values in enumerate(top_values)
+        ]
+        return tokens_logprobs, tokens_top_logprobs_dicts
+
     def translate_text_prompt(self, prompt: TextPrompt) -> HuggingFaceRequest:
         return self._translate_request(prompt.text, prompt.options)
 
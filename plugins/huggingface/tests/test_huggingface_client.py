@@ -0,0 +1,291 @@
+import pytest
+import torch
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import WhitespaceSplit
+from transformers import (  # type: ignore
+    GPT2Config,
+    GPT2LMHeadModel,
+    PreTrainedTokenizerFast,
+)
+
+from newhelm.suts.huggingface_client import (
+    HuggingFaceCompletion,
+    HuggingFaceRequest,
+    HuggingFaceResponse,
+    HuggingFaceSUT,
+    HuggingFaceToken,
+    WrappedPreTrainedTokenizer,
+    _find_stop,
+)
+
+_MODEL = "tiny-gpt2"
+_PROMPTS = ["w1 w2 w3 w4", "w5", "w9 w10", "w20 w3 w7"]
+
+
+def _make_tokenizer():
+    """One token per word, so stop sequences are easy to line up with tokens."""
+    words = ["<eos>"] + [f"w{i}" for i in range(31)]
+    tokenizer = Tokenizer(WordLevel({word: i for i, word in enumerate(words)}, "<eos>"))
+    tokenizer.pre_tokenizer = WhitespaceSplit()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, eos_token="<eos>", model_max_length=64
+    )
+
+
+@pytest.fixture
+def sut(monkeypatch):
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=32,
+        n_positions=64,
+        n_embd=16,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=0,
+        eos_token_id=0,
+    )
+    model = GPT2LMHeadModel(config).eval()
+    # Sampling differs with the batch shape, so generate greedily to compare outputs.
+    original_generate = model.generate
+
+    def _greedy_generate(**kwargs):
+        kwargs["do_sample"] = False
+        return original_generate(**kwargs)
+
+    monkeypatch.setattr(model, "generate", _greedy_generate)
+    sut = HuggingFaceSUT("tiny", _MODEL, HuggingFaceToken(None))
+    sut.model = model
+    sut.wrapped_tokenizer = WrappedPreTrainedTokenizer(_make_tokenizer())
+    return sut
+
+
+def _make_request(prompt, **kwargs):
+    settings = dict(
+        model=_MODEL,
+        temperature=1.0,
+        num_return_sequences=1,
+        max_new_tokens=8,
+        top_p=1.0,
+        echo_prompt=False,
+        top_k_per_token=2,
+        stop_sequences=[],
+    )
+    settings.update(kwargs)
+    return HuggingFaceRequest(prompt=prompt, **settings)
+
+
+def _assert_same_responses(batched, single):
+    assert len(batched) == len(single)
+    for batched_response, single_response in zip(batched, single):
+        assert batched_response.input_length == single_response.input_length
+        for batched_completion, single_completion in zip(
+            batched_response.completions, single_response.completions, strict=True
+        ):
+            assert batched_completion.text == single_completion.text
+            assert batched_completion.tokens == single_completion.tokens
+            assert batched_completion.logprobs == pytest.approx(
+                single_completion.logprobs, abs=1e-4
+            )
+            for batched_top, single_top in zip(
+                batched_completion.top_logprobs_dicts,
+                single_completion.top_logprobs_dicts,
+                strict=True,
+            ):
+                assert batched_top == pytest.approx(single_top, abs=1e-4)
+
+
+def test_evaluate_batch_matches_evaluate(sut):
+    requests = [_make_request(prompt) for prompt in _PROMPTS]
+
+    batched = sut.evaluate_batch(requests)
+
+    _assert_same_responses(batched, [sut.evaluate(request) for request in requests])
+
+
+def test_evaluate_batch_left_pads(sut, monkeypatch):
+    generate_inputs = []
+    original_generate = sut.model.generate
+
+    def _generate(**kwargs):
+        generate_inputs.append(kwargs)
+        return original_generate(**kwargs)
+
+    monkeypatch.setattr(sut.model, "generate", _generate)
+
+    responses = sut.evaluate_batch([_make_request("w1 w2 w3 w4"), _make_request("w5")])
+
+    assert len(generate_inputs) == 1
+    inputs = generate_inputs[0]
+    assert inputs["attention_mask"].tolist() == [[1, 1, 1, 1], [0, 0, 0, 1]]
+    # The shorter prompt ends right where generation starts.
+    assert inputs["input_ids"][1, -1].item() == 6
+    assert [response.input_length for response in responses] == [4, 1]
+    # The tokenizer is left as it was for `evaluate`.
+    with sut.wrapped_tokenizer as tokenizer:
+        assert tokenizer.padding_side == "right"
+
+
+@pytest.mark.parametrize("stop_positions", [[(0, 1)], [(0, 2), (2, 2)]])
+def test_evaluate_batch_stops_each_row(sut, stop_positions):
+    unstopped = sut.evaluate_batch([_make_request(prompt) for prompt in _PROMPTS])
+    # Stop on tokens each row is known to generate, which may stop other rows too.
+    stop_sequences = [
+        " ".join(unstopped[row].completions[0].tokens[1 : 1 + length])
+        for row, length in stop_positions
+    ]
+    requests = [
+        _make_request(prompt, stop_sequences=stop_sequences) for prompt in _PROMPTS
+    ]
+
+    batched = sut.evaluate_batch(requests)
+
+    for row, length in stop_positions:
+        tokens = batched[row].completions[0].tokens
+        assert len(tokens) <= 1 + length
+        assert " ".join(tokens[-length:]) in stop_sequences
+    _assert_same_responses(batched, [sut.evaluate(request) for request in requests])
+
+
+def test_evaluate_batch_groups_by_settings(sut, monkeypatch):
+    def _fake_response(request):
+        return HuggingFaceResponse(
+            completions=[
+                HuggingFaceCompletion(
+                    text=request.prompt,
+                    tokens=[],
+                    logprobs=[],
+                    top_logprobs_dicts=[],
+                    prompt_logprobs=[],
+                    prompt_top_logprobs_dicts=[],
+                )
+            ],
+            input_length=0,
+        )
+
+    batches = []
+    singles = []
+
+    def _generate_batch(requests):
+        batches.append([request.prompt for request in requests])
+        return [_fake_response(request) for request in requests]
+
+    def _evaluate(request):
+        singles.append(request.prompt)
+        return _fake_response(request)
+
+    monkeypatch.setattr(sut, "_generate_batch", _generate_batch)
+    monkeypatch.setattr(sut, "evaluate", _evaluate)
+    requests = [
+        _make_request("w1"),
+        _make_request("w2", max_new_tokens=4),
+        _make_request("w3", echo_prompt=True),
+        _make_request("w4"),
+        _make_request("w5", max_new_tokens=0),
+        _make_request("w6", max_new_tokens=4),
+        _make_request("w7", temperature=0.5),
+    ]
+
+    responses = sut.evaluate_batch(requests)
+
+    assert batches == [["w1", "w4"], ["w2", "w6"]]
+    # Anything `evaluate` treats specially, and groups of one, go one at a time.
+    assert singles == ["w3", "w5", "w7"]
+    assert [response.completions[0].text for response in responses] == [
+        request.prompt for request in requests
+    ]
+
+
+def test_find_stop():
+    assert _find_stop([1, 2, 3, 4], [[3]]) == 3
+    assert _find_stop([1, 2, 3, 4], [[5], [2, 3]]) == 3
+    assert _find_stop([1, 2, 3, 2, 3], [[2, 3]]) == 3
+    assert _find_stop([1, 2, 3, 4], [[3, 2]]) == 4
+    assert _find_stop([1, 2, 3], []) == 3
+
+
+def _per_position_logprobs(tokenizer, scores, token_ids, top_k_per_token):
+    """How logprobs were computed before `_compute_logprobs`, one position at a time."""
+    tokens_logprobs = []
+    tokens_top_logprobs_dicts = []
+    for position_scores, token_id in zip(scores, token_ids, strict=True):
+        logprobs = torch.nn.functional.log_softmax(position_scores, dim=0)
+        topk_logprobs = torch.topk(logprobs, k=top_k_per_token)
+        tokens_top_logprobs_dicts.append(
+            {
+                tokenizer.convert_ids_to_tokens(k.item()): v.item()
+                for (k, v) in zip(topk_logprobs.indices, topk_logprobs.values)
+            }
+        )
+        tokens_logprobs.append(logprobs[token_id].item())
+    return tokens_logprobs, tokens_top_logprobs_dicts
+
+
+def _assert_same_logprobs(completion_logprobs, completion_dicts, expected):
+    expected_logprobs, expected_dicts = expected
+    assert completion_logprobs == pytest.approx(expected_logprobs, abs=1e-5)
+    assert len(completion_dicts) == len(expected_dicts)
+    for top_logprobs, expected_top_logprobs in zip(completion_dicts, expected_dicts):
+        assert top_logprobs == pytest.approx(expected_top_logprobs, abs=1e-5)
+
+
+def test_compute_logprobs_matches_per_position_loop_when_generating(sut, monkeypatch):
+    outputs = []
+
+    def _generate(**kwargs):
+        # Sample as `evaluate` normally does.
+        output = GPT2LMHeadModel.generate(sut.model, **kwargs)
+        outputs.append(output)
+        return output
+
+    monkeypatch.setattr(sut.model, "generate", _generate)
+    request = _make_request(
+        "w1 w2 w3", num_return_sequences=3, top_k_per_token=3, temperature=0.7
+    )
+
+    response = sut.evaluate(request)
+
+    output = outputs[0]
+    with sut.wrapped_tokenizer as tokenizer:
+        for completion_id, completion in enumerate(response.completions):
+            generated_ids = output.sequences[completion_id][3:]
+            scores = [
+                output.scores[i][completion_id] for i in range(len(generated_ids))
+            ]
+            _assert_same_logprobs(
+                completion.logprobs,
+                completion.top_logprobs_dicts,
+                _per_position_logprobs(tokenizer, scores, generated_ids, 3),
+            )
+
+
+def test_compute_logprobs_matches_per_position_loop_for_prompt(sut, monkeypatch):
+    logits = []
+    original_forward = sut.model.forward
+
+    def _forward(*args, **kwargs):
+        output = original_forward(*args, **kwargs)
+        logits.append(output.logits)
+        return output
+
+    monkeypatch.setattr(sut.model, "forward", _forward)
+    prompt = "w1 w2 w3 w4 w5"
+    request = _make_request(
+        prompt, echo_prompt=True, max_new_tokens=0, top_k_per_token=2
+    )
+
+    response = sut.evaluate(request)
+
+    completion = response.completions[0]
+    with sut.wrapped_tokenizer as tokenizer:
+        input_ids = tokenizer(prompt, return_tensors="pt").input_ids[0]
+        expected_logprobs, expected_dicts = _per_position_logprobs(
+            tokenizer, logits[0][0][:-1], input_ids[1:], 2
+        )
+    # The first token of the prompt has nothing to predict it.
+    _assert_same_logprobs(
+        completion.prompt_logprobs,
+        completion.prompt_top_logprobs_dicts,
+        ([0.0] + expected_logprobs, [{}] + expected_dicts),
+    )
+    assert completion.logprobs == []
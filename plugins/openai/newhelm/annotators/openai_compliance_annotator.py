@@ -1,15 +1,27 @@
+import asyncio
 import re
 from typing import Callable, Dict, List, Optional
 from pydantic import BaseModel
 
-from newhelm.base_annotator import BaseAnnotator
+from newhelm.base_annotator import BaseCompletionAnnotator
 from newhelm.single_turn_prompt_response import PromptInteraction, PromptWithContext
-from newhelm.sut import SUTResponse, PromptResponseSUT, SUTCompletion
+from newhelm.sut import (
+    AsyncPromptResponseSUT,
+    PromptResponseSUT,
+    SUTCompletion,
+    SUTResponse,
+)
 from newhelm.prompt import TextPrompt, SUTOptions
 from newhelm.prompt_formatting import format_chat
 from newhelm.suts.openai_client import OpenAIApiKey, OpenAIChat, OpenAIOrgId
 
 
+class ComplianceCompletionRequest(BaseModel):
+    """The text sent to the model to classify a single completion."""
+
+    text: str
+
+
 class ComplianceAnnotation(BaseModel):
     """Annotation for a SUT's compliance in an interaction."""
 
@@ -22,7 +34,13 @@ class ComplianceAnnotation(BaseModel):
     interactions: List[Interaction]
 
 
-class OpenAIComplianceAnnotator(BaseAnnotator[ComplianceAnnotation]):
+class OpenAIComplianceAnnotator(
+    BaseCompletionAnnotator[
+        ComplianceAnnotation,
+        ComplianceCompletionRequest,
+        ComplianceAnnotation.Completion,
+    ]
+):
     """This annotator classifies a SUT's compliance in an interaction. By default, it is uses gpt-3.5-turbo to evaluate interactions as "Full Compliance", "Full Refusal", or "Partial Refusal". The default prompt-formatter for requests to the annotator is built for interactions that consist a SUT response to a single user-prompt. For interactions with prompts that encode a multi-turn history (i.e. ChatPrompt), you may need to specify a custom formatter."""
 
     def __init__(
@@ -45,26 +63,56 @@ class OpenAIComplianceAnnotator(BaseAnnotator[ComplianceAnnotation]):
         self.formatter = _default_formatter if formatter is None else formatter
         self.decoder = _DEFAULT_MAPPING if decoder is None else decoder
 
-    def annotate_test_item(
-        self, interactions: List[PromptInteraction]
+    def make_completion_request(
+        self, interaction: PromptInteraction, completion: SUTCompletion
+    ) -> ComplianceCompletionRequest:
+        return ComplianceCompletionRequest(
+            text=self.formatter(interaction.prompt, completion)
+        )
+
+    def annotate_completions(
+        self, requests: List[ComplianceCompletionRequest]
+    ) -> List[ComplianceAnnotation.Completion]:
+        completions = []
+        for request in requests:
+            sut_request = self._make_sut_request(request)
+            annotator_response = self.model.evaluate(sut_request)
+            response = self.model.translate_response(sut_request, annotator_response)
+            completions.append(self._process_response(response))
+        return completions
+
+    async def annotate_completions_async(
+        self, requests: List[ComplianceCompletionRequest]
+    ) -> List[ComplianceAnnotation.Completion]:
+        """Same as annotate_completions, but sends all requests concurrently."""
+        if not isinstance(self.model, AsyncPromptResponseSUT):
+            return await super().annotate_completions_async(requests)
+        model = self.model
+        sut_requests = [self._make_sut_request(request) for request in requests]
+        annotator_responses = await asyncio.gather(
+            *[model.evaluate_async(sut_request) for sut_request in sut_requests]
+        )
+        return [
+            self._process_response(model.translate_response(sut_request, response))
+            for sut_request, response in zip(sut_requests, annotator_responses)
+        ]
+
+    def make_annotation(
+        self, completion_annotations: List[List[ComplianceAnnotation.Completion]]
     ) -> ComplianceAnnotation:
-        """Returns an annotation for a single TestItem's interactions."""
-        openai_interactions = []
-        for interaction in interactions:
-            openai_completions = []
-            for completion in interaction.response.completions:
-                openai_prompt = TextPrompt(
-                    text=self.formatter(interaction.prompt, completion),
-                    options=SUTOptions(temperature=0),
-                )
-                request = self.model.translate_text_prompt(openai_prompt)
-                annotator_response = self.model.evaluate(request)
-                response = self.model.translate_response(request, annotator_response)
-                openai_completions.append(self._process_response(response))
-            openai_interactions.append(
-                ComplianceAnnotation.Interaction(completions=openai_completions)
-            )
-        return ComplianceAnnotation(interactions=openai_interactions)
+        return ComplianceAnnotation(
+            interactions=[
+                ComplianceAnnotation.Interaction(completions=completions)
+                for completions in completion_annotations
+            ]
+        )
+
+    def _make_sut_request(self, request: ComplianceCompletionRequest):
+        openai_prompt = TextPrompt(
+            text=request.text,
+            options=SUTOptions(temperature=0),
+        )
+        return self.model.translate_text_prompt(openai_prompt)
 
     def _process_response(
         self, response: SUTResponse
@@ -9,13 +9,13 @@ from newhelm.secret_values import (
     SecretDescription,
 )
 from newhelm.sut import (
+    AsyncPromptResponseSUT,
     SUTCompletion,
-    PromptResponseSUT,
     SUTResponse,
     TokenProbability,
     TopTokens,
 )
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from openai.types.chat import ChatCompletion
 from newhelm.sut_capabilities import (
     AcceptsChatPrompt,
@@ -95,7 +95,7 @@ class OpenAIChatRequest(BaseModel):
         ProducesPerTokenLogProbabilities,
     ]
 )
-class OpenAIChat(PromptResponseSUT[OpenAIChatRequest, ChatCompletion]):
+class OpenAIChat(AsyncPromptResponseSUT[OpenAIChatRequest, ChatCompletion]):
     """
     Documented at https://platform.openai.com/docs/api-reference/chat/create
     """
@@ -106,6 +106,7 @@ class OpenAIChat(PromptResponseSUT[OpenAIChatRequest, ChatCompletion]):
         super().__init__(uid)
         self.model = model
         self.client: Optional[OpenAI] = None
+        self.async_client: Optional[AsyncOpenAI] = None
         self.api_key = api_key.value
         self.org_id = org_id.value
 
@@ -115,6 +116,12 @@ class OpenAIChat(PromptResponseSUT[OpenAIChatRequest, ChatCompletion]):
             organization=self.org_id,
         )
 
+    def _load_async_client(self) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            organization=self.org_id,
+        )
+
     def translate_text_prompt(self, prompt: TextPrompt) -> OpenAIChatRequest:
         messages = [OpenAIChatMessage(content=prompt.text, role=_USER_ROLE)]
         return self._translate_request(messages, prompt.options)
@@ -154,6 +161,13 @@ class OpenAIChat(PromptResponseSUT[OpenAIChatRequest, ChatCompletion]):
         request_dict = request.model_dump(exclude_none=True)
         return self.client.chat.completions.create(**request_dict)
 
+    async def evaluate_async(self, request: OpenAIChatRequest) -> ChatCompletion:
+        if self.async_client is None:
+            # Handle lazy init.
+            self.async_client = self._load_async_client()
+        request_dict = request.model_dump(exclude_none=True)
+        return await self.async_client.chat.completions.create(**request_dict)
+
     def translate_response(
         self, request: OpenAIChatRequest, response: ChatCompletion
     ) -> SUTResponse:
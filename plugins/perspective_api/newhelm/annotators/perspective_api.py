@@ -1,14 +1,17 @@
+from collections import deque
+from concurrent.futures import Future, wait
 import logging
 import random
 import threading
 import time
-from typing import Dict, List, Mapping, Optional, Sequence
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Sequence, Tuple
 from googleapiclient import discovery  # type: ignore[import-untyped]
 from googleapiclient.http import BatchHttpRequest  # type: ignore[import-untyped]
 from googleapiclient.errors import HttpError  # type: ignore[import-untyped]
 from pydantic import BaseModel  # type: ignore[import-untyped]
 
-from newhelm.base_annotator import BaseAnnotator
+from newhelm.base_annotator import BaseCompletionAnnotator
+from newhelm.rate_limiting import RateLimit, RateLimiter
 from newhelm.secret_values import RequiredSecret, SecretDescription
 from newhelm.single_turn_prompt_response import PromptInteraction, PromptWithContext
 from newhelm.sut import SUTCompletion
@@ -24,6 +27,10 @@ ATTRIBUTE_THREAT = "THREAT"
 ATTRIBUTE_SEXUALLY_EXPLICIT = "SEXUALLY_EXPLICIT"
 ATTRIBUTE_FLIRTATION = "FLIRTATION"
 
+# Google's batch API rejects batches with more requests than this.
+# https://googleapis.github.io/google-api-python-client/docs/batch.html
+MAX_BATCH_SIZE = 1000
+
 
 class PerspectiveAPIAnnotation(BaseModel):
     class Completion(BaseModel):
@@ -38,6 +45,12 @@ class PerspectiveAPIAnnotation(BaseModel):
     """Each element in the list corresponds to a Prompt in the TestItem."""
 
 
+class PerspectiveCompletionRequest(BaseModel):
+    """Everything a completion's scores depend on, besides the annotator's settings."""
+
+    text: str
+
+
 class PerspectiveDeveloperKey(RequiredSecret):
     @classmethod
     def description(cls) -> SecretDescription:
@@ -49,8 +62,20 @@ class PerspectiveDeveloperKey(RequiredSecret):
         )
 
 
-class PerspectiveAPIAnnotator(BaseAnnotator[PerspectiveAPIAnnotation]):
-    """Collect information about a SUT's response using PerspectiveAPI 'analyze comment' interface."""
+class PerspectiveAPIAnnotator(
+    BaseCompletionAnnotator[
+        PerspectiveAPIAnnotation,
+        PerspectiveCompletionRequest,
+        PerspectiveAPIAnnotation.Completion,
+    ]
+):
+    """Collect information about a SUT's response using PerspectiveAPI 'analyze comment' interface.
+
+    Completions from all TestItems being annotated at the same time are combined into
+    batches of up to `max_batch_size` requests, with up to `num_clients` batches in
+    flight at once. Setting `requests_per_second` to the project's quota keeps the
+    average rate of calls, including retries, under it.
+    """
 
     def __init__(
         self,
@@ -58,19 +83,37 @@ class PerspectiveAPIAnnotator(BaseAnnotator[PerspectiveAPIAnnotation]):
         developer_key: PerspectiveDeveloperKey,
         languages: Optional[List[str]] = None,
         num_retries: int = 6,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        num_clients: int = 4,
+        requests_per_second: Optional[float] = None,
     ):
         assert desired_attributes, "Must specify at least one desired attribute"
         assert len(desired_attributes) == len(
             set(desired_attributes)
         ), "All desired attributes should be unique."
+        assert (
+            0 < max_batch_size <= MAX_BATCH_SIZE
+        ), f"Batch size must be between 1 and {MAX_BATCH_SIZE}, got {max_batch_size}."
+        assert num_clients > 0, f"Cannot annotate using {num_clients} clients."
         self.attributes = desired_attributes
         self.developer_key = developer_key.value
         self.languages = languages
         self.num_retries = num_retries
         self.rng = random.Random()  # Used for exponential backoff
-        self.client: Optional[discovery.Resource] = None
-        # httplib2 is not thread-safe. Acquire this lock when sending requests to PerspectiveAPI
-        self._client_lock: threading.Lock = threading.Lock()
+        # Retries count against the quota too, so this limits each batch as it is sent
+        # rather than relying on the runner's `rate_limit`.
+        self.rate_limiter: Optional[RateLimiter] = None
+        if requests_per_second is not None:
+            self.rate_limiter = RateLimiter(
+                RateLimit(requests_per_minute=requests_per_second * 60)
+            )
+        self._batcher = _CrossItemBatcher(
+            # Look up _load_client on each call so it can be replaced.
+            lambda: self._load_client(),
+            self._send_batch,
+            max_batch_size,
+            num_clients,
+        )
 
     def _load_client(self) -> discovery.Resource:
         return discovery.build(
@@ -81,60 +124,46 @@ class PerspectiveAPIAnnotator(BaseAnnotator[PerspectiveAPIAnnotation]):
             static_discovery=False,
         )
 
-    def annotate_test_item(
-        self, interactions: List[PromptInteraction]
+    def make_completion_request(
+        self, interaction: PromptInteraction, completion: SUTCompletion
+    ) -> PerspectiveCompletionRequest:
+        return PerspectiveCompletionRequest(text=completion.text)
+
+    def annotate_completions(
+        self, requests: List[PerspectiveCompletionRequest]
+    ) -> List[PerspectiveAPIAnnotation.Completion]:
+        # PerspectiveAPI rejects empty text, so those are scored without calling it.
+        bodies = [
+            self._make_analyze_comment_request(request.text)
+            for request in requests
+            if request.text != ""
+        ]
+        responses = iter(self._batcher.execute(bodies))
+
+        completions = []
+        for request in requests:
+            if request.text == "":
+                scores = {attribute: 0.0 for attribute in self.attributes}
+            else:
+                scores = self._process_analyze_comment_response(next(responses))
+            completions.append(PerspectiveAPIAnnotation.Completion(scores=scores))
+        return completions
+
+    def make_annotation(
+        self, completion_annotations: List[List[PerspectiveAPIAnnotation.Completion]]
     ) -> PerspectiveAPIAnnotation:
-        with self._client_lock:
-            # Handle lazy init.
-            if self.client is None:
-                self.client = self._load_client()
-
-        requests = []
-        empty_completion_indexes = set()
-        request_index = 0
-        for interaction in interactions:
-            for completion in interaction.response.completions:
-                if completion.text == "":
-                    empty_completion_indexes.add(request_index)
-                else:
-                    requests.append(
-                        self.client.comments().analyze(
-                            body=self._make_analyze_comment_request(completion.text)
-                        )
-                    )
-                request_index += 1
-
-        with self._client_lock:
-            responses = _batch_execute_requests(
-                self.client, requests, self.num_retries, self.rng
-            )
+        return PerspectiveAPIAnnotation(
+            interaction=[
+                PerspectiveAPIAnnotation.Interaction(completions=completions)
+                for completions in completion_annotations
+            ]
+        )
 
-        index = 0
-        response_index = 0
-        interaction_scores = []
-        for interaction in interactions:
-            completion_scores = []
-            for _ in interaction.response.completions:
-                if index in empty_completion_indexes:
-                    completion_scores.append(
-                        PerspectiveAPIAnnotation.Completion(
-                            scores={attribute: 0.0 for attribute in self.attributes}
-                        )
-                    )
-                else:
-                    completion_scores.append(
-                        PerspectiveAPIAnnotation.Completion(
-                            scores=self._process_analyze_comment_response(
-                                responses[response_index]
-                            )
-                        )
-                    )
-                    response_index += 1
-                index += 1
-            interaction_scores.append(
-                PerspectiveAPIAnnotation.Interaction(completions=completion_scores)
-            )
-        return PerspectiveAPIAnnotation(interaction=interaction_scores)
+    def _send_batch(self, client: discovery.Resource, bodies: List[Dict]) -> List:
+        api_requests = [client.comments().analyze(body=body) for body in bodies]
+        return _batch_execute_requests(
+            client, api_requests, self.num_retries, self.rng, self.rate_limiter
+        )
 
     def _make_analyze_comment_request(self, completion: str):
         # https://developers.perspectiveapi.com/s/about-the-api-methods
@@ -160,8 +189,82 @@ class PerspectiveAPIAnnotator(BaseAnnotator[PerspectiveAPIAnnotation]):
         return flattened
 
 
+class _CrossItemBatcher:
+    """Combine the requests of concurrent callers into shared batches.
+
+    Callers add their requests to one queue. Any caller that can claim one of the
+    `num_clients` clients sends the oldest pending requests, including other callers'.
+    While every client is busy requests pile up, so the next batch is larger.
+    httplib2 is not thread-safe, so each client is only used by one thread at a time.
+    """
+
+    _POLL_SECONDS = 0.01
+
+    def __init__(
+        self,
+        load_client: Callable[[], discovery.Resource],
+        send_batch: Callable[[discovery.Resource, List], List],
+        max_batch_size: int,
+        num_clients: int,
+    ):
+        self.load_client = load_client
+        self.send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._pending: Deque[Tuple[Any, Future]] = deque()
+        self._idle_clients: List[discovery.Resource] = []
+        self._free_clients = threading.Semaphore(num_clients)
+
+    def execute(self, requests: List) -> List:
+        """Send all `requests`, returning their responses in the same order."""
+        futures: List[Future] = [Future() for _ in requests]
+        with self._lock:
+            self._pending.extend(zip(requests, futures))
+        while not all(future.done() for future in futures):
+            if not self._free_clients.acquire(timeout=self._POLL_SECONDS):
+                continue
+            try:
+                sent = self._send_next_batch()
+            finally:
+                self._free_clients.release()
+            if not sent:
+                # Other threads have already taken all of these requests.
+                wait(futures)
+        return [future.result() for future in futures]
+
+    def _send_next_batch(self) -> bool:
+        with self._lock:
+            if not self._pending:
+                return False
+            size = min(len(self._pending), self.max_batch_size)
+            batch = [self._pending.popleft() for _ in range(size)]
+            client = self._idle_clients.pop() if self._idle_clients else None
+        try:
+            if client is None:
+                client = self.load_client()
+            responses = self.send_batch(client, [request for request, _ in batch])
+        except BaseException as e:
+            # Make sure no caller waits forever on these requests.
+            for _, future in batch:
+                future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            for (_, future), response in zip(batch, responses):
+                future.set_result(response)
+        finally:
+            if client is not None:
+                with self._lock:
+                    self._idle_clients.append(client)
+        return True
+
+
 def _batch_execute_requests(
-    client: discovery.Resource, requests: List, num_retries: int, rng: random.Random
+    client: discovery.Resource,
+    requests: List,
+    num_retries: int,
+    rng: random.Random,
+    rate_limiter: Optional[RateLimiter] = None,
 ) -> List:
     """Wrapper around Google's batch API.
 
@@ -194,6 +297,8 @@ def _batch_execute_requests(
             sleep_amount = rng.uniform(1, 2) * 2**retry_count
             logging.info("Performing exponential backoff. Sleeping:", sleep_amount)
             time.sleep(sleep_amount)
+        if rate_limiter is not None:
+            rate_limiter.acquire(requests=len(needs_call))
 
         # Build up a batch
         batch_request: BatchHttpRequest = client.new_batch_http_request()
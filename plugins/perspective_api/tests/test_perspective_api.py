@@ -1,5 +1,6 @@
 import inspect
-from typing import Dict, List
+import threading
+from typing import Callable, Dict, List, Optional
 from unittest.mock import patch
 
 import pytest
@@ -7,6 +8,7 @@ from newhelm.prompt import TextPrompt
 from newhelm.annotators.perspective_api import (
     ATTRIBUTE_THREAT,
     ATTRIBUTE_TOXICITY,
+    MAX_BATCH_SIZE,
     PerspectiveAPIAnnotator,
     PerspectiveAPIAnnotation,
     PerspectiveDeveloperKey,
@@ -87,6 +89,54 @@ class FakeDiscoveryResource:
         return FakeDiscoveryResource.FakeBatchRequest(requests, responses)
 
 
+def _use_client(annotator, client):
+    annotator._load_client = lambda: client
+
+
+class ScoringDiscoveryResource:
+    """A thread-safe fake discovery.Resource that scores text by its length.
+
+    `on_execute` is called with the texts in each batch before it is scored.
+    """
+
+    def __init__(self, on_execute: Optional[Callable[[List[str]], None]] = None):
+        self.on_execute = on_execute
+        self.batches: List[List[str]] = []
+        self._lock = threading.Lock()
+
+    class FakeComments:
+        def analyze(self, **kwargs):
+            return kwargs
+
+    def comments(self):
+        return ScoringDiscoveryResource.FakeComments()
+
+    class FakeBatchRequest:
+        def __init__(self, resource):
+            self.resource = resource
+            self.requests = []
+
+        def add(self, **kwargs):
+            self.requests.append(kwargs)
+
+        def execute(self):
+            texts = [r["request"]["body"]["comment"]["text"] for r in self.requests]
+            if self.resource.on_execute:
+                self.resource.on_execute(texts)
+            with self.resource._lock:
+                self.resource.batches.append(texts)
+            for request, text in zip(self.requests, texts):
+                response = _make_response({ATTRIBUTE_TOXICITY: len(text) / 100})
+                request["callback"](request["request_id"], response, None)
+
+    def new_batch_http_request(self):
+        return ScoringDiscoveryResource.FakeBatchRequest(self)
+
+
+def _scores(texts: List[str]) -> List[Completion]:
+    return [Completion(scores={ATTRIBUTE_TOXICITY: len(t) / 100}) for t in texts]
+
+
 def test_perspective_api_single_prompt():
     interactions = [_make_interaction(["the text"])]
     responses = [_make_response({ATTRIBUTE_TOXICITY: 0.5})]
@@ -94,7 +144,7 @@ def test_perspective_api_single_prompt():
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -122,7 +172,7 @@ def test_perspective_api_multiple_prompts():
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -159,7 +209,7 @@ def test_perspective_api_multiple_completions():
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -205,7 +255,7 @@ def test_perspective_api_multiple_prompts_with_multiple_completions():
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -234,7 +284,7 @@ def test_perspective_api_multiple_attributes():
         [ATTRIBUTE_TOXICITY, ATTRIBUTE_THREAT], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -263,7 +313,7 @@ def test_perspective_api_single_prompt_fatal_error():
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     with pytest.raises(MockError) as err_info:
         annotator.annotate_test_item(interactions)
@@ -281,7 +331,7 @@ def test_perspective_api_single_prompt_retriable_error(sleep):
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([batch_one, batch_two])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -309,7 +359,7 @@ def test_perspective_api_multiple_completions_retriable_error(sleep):
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([batch_one, batch_two])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -361,7 +411,7 @@ def test_perspective_api_empty_comment_text_string():
         [ATTRIBUTE_TOXICITY, ATTRIBUTE_THREAT], PerspectiveDeveloperKey("some-value")
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -394,7 +444,7 @@ def test_perspective_api_no_retries_retriable_error(sleep):
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value"), num_retries=0
     )
     fake_client = FakeDiscoveryResource([responses])
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     with pytest.raises(MockError) as err_info:
         annotator.annotate_test_item(interactions)
@@ -412,7 +462,7 @@ def test_perspective_api_continuous_retriable_error(sleep):
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value"), num_retries=1
     )
     fake_client = FakeDiscoveryResource(batches)
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     with pytest.raises(MockError) as err_info:
         annotator.annotate_test_item(interactions)
@@ -436,7 +486,7 @@ def test_perspective_api_many_retries_succeed(sleep):
         [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value"), num_retries=4
     )
     fake_client = FakeDiscoveryResource(batches)
-    annotator.client = fake_client
+    _use_client(annotator, fake_client)
 
     result = annotator.annotate_test_item(interactions)
 
@@ -453,3 +503,168 @@ def test_perspective_api_many_retries_succeed(sleep):
     # Ensure each call sleeps longer than the previous one:
     for i in range(sleep.call_count - 1):
         assert sleep.call_args_list[i] < sleep.call_args_list[i + 1]
+
+
+def test_perspective_api_identical_completions():
+    interactions = [_make_interaction(["same", "other"]), _make_interaction(["same"])]
+    responses = [
+        _make_response({ATTRIBUTE_TOXICITY: 0.1}),
+        _make_response({ATTRIBUTE_TOXICITY: 0.2}),
+    ]
+    annotator = PerspectiveAPIAnnotator(
+        [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
+    )
+    fake_client = FakeDiscoveryResource([responses])
+    _use_client(annotator, fake_client)
+
+    result = annotator.annotate_test_item(interactions)
+
+    assert result == PerspectiveAPIAnnotation(
+        interaction=[
+            Interaction(
+                completions=[
+                    Completion(scores={"TOXICITY": 0.1}),
+                    Completion(scores={"TOXICITY": 0.2}),
+                ]
+            ),
+            Interaction(completions=[Completion(scores={"TOXICITY": 0.1})]),
+        ]
+    )
+    assert len(fake_client.requests[0]) == 2
+
+
+def test_perspective_api_batch_size_bounds():
+    with pytest.raises(AssertionError):
+        PerspectiveAPIAnnotator(
+            [ATTRIBUTE_TOXICITY],
+            PerspectiveDeveloperKey("some-value"),
+            max_batch_size=MAX_BATCH_SIZE + 1,
+        )
+
+
+def test_perspective_api_splits_large_batches():
+    annotator = PerspectiveAPIAnnotator(
+        [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value"), max_batch_size=2
+    )
+    fake_client = ScoringDiscoveryResource()
+    _use_client(annotator, fake_client)
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+    result = annotator.annotate_test_item([_make_interaction(texts)])
+
+    assert result.interaction[0].completions == _scores(texts)
+    assert fake_client.batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+
+
+def test_perspective_api_batches_across_test_items():
+    first_batch_started = threading.Event()
+    release_first_batch = threading.Event()
+
+    def _block_first_batch(texts):
+        if texts == ["first"]:
+            first_batch_started.set()
+            assert release_first_batch.wait(timeout=5)
+
+    annotator = PerspectiveAPIAnnotator(
+        [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value"), num_clients=1
+    )
+    fake_client = ScoringDiscoveryResource(_block_first_batch)
+    _use_client(annotator, fake_client)
+    results = {}
+
+    def _annotate(text):
+        results[text] = annotator.annotate_test_item([_make_interaction([text])])
+
+    first = threading.Thread(target=_annotate, args=("first",))
+    first.start()
+    assert first_batch_started.wait(timeout=5)
+    others = [
+        threading.Thread(target=_annotate, args=(text,)) for text in ["2nd", "third"]
+    ]
+    for thread in others:
+        thread.start()
+    # Wait until the other items are queued behind the first batch.
+    while len(annotator._batcher._pending) < 2:
+        first.join(timeout=0.01)
+    release_first_batch.set()
+    for thread in [first] + others:
+        thread.join()
+
+    assert fake_client.batches[0] == ["first"]
+    assert sorted(fake_client.batches[1]) == ["2nd", "third"]
+    assert len(fake_client.batches) == 2
+    for text, result in results.items():
+        assert result.interaction[0].completions == _scores([text])
+
+
+def test_perspective_api_sends_batches_in_parallel():
+    # Fails with a BrokenBarrierError unless both batches are in flight together.
+    barrier = threading.Barrier(2, timeout=5)
+    annotator = PerspectiveAPIAnnotator(
+        [ATTRIBUTE_TOXICITY],
+        PerspectiveDeveloperKey("some-value"),
+        max_batch_size=1,
+        num_clients=2,
+    )
+    clients = []
+
+    def _load_client():
+        clients.append(ScoringDiscoveryResource(lambda texts: barrier.wait()))
+        return clients[-1]
+
+    annotator._load_client = _load_client
+    threads = [
+        threading.Thread(
+            target=annotator.annotate_test_item, args=([_make_interaction([text])],)
+        )
+        for text in ["first", "second"]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(clients) == 2
+    assert sorted(sum([client.batches for client in clients], [])) == [
+        ["first"],
+        ["second"],
+    ]
+
+
+def test_perspective_api_error_fails_whole_batch():
+    annotator = PerspectiveAPIAnnotator(
+        [ATTRIBUTE_TOXICITY], PerspectiveDeveloperKey("some-value")
+    )
+    fake_client = FakeDiscoveryResource(
+        [[MockError(403)], [_make_response({ATTRIBUTE_TOXICITY: 0.3})]]
+    )
+    _use_client(annotator, fake_client)
+
+    with pytest.raises(MockError):
+        annotator.annotate_test_item([_make_interaction(["the text"])])
+    # The client goes back in the pool after a failure.
+    result = annotator.annotate_test_item([_make_interaction(["the text"])])
+    assert result.interaction[0].completions == [Completion(scores={"TOXICITY": 0.3})]
+
+
+@patch("time.sleep")
+def test_perspective_api_rate_limits_retries(sleep):
+    annotator = PerspectiveAPIAnnotator(
+        [ATTRIBUTE_TOXICITY],
+        PerspectiveDeveloperKey("some-value"),
+        requests_per_second=1,
+    )
+    batch_one = [MockError(503), _make_response({ATTRIBUTE_TOXICITY: 0.1})]
+    batch_two = [_make_response({ATTRIBUTE_TOXICITY: 0.2})]
+    _use_client(annotator, FakeDiscoveryResource([batch_one, batch_two]))
+
+    with patch.object(
+        annotator.rate_limiter, "acquire", wraps=annotator.rate_limiter.acquire
+    ) as acquire:
+        annotator.annotate_test_item([_make_interaction(["a", "b"])])
+
+    assert [c.kwargs for c in acquire.call_args_list] == [
+        {"requests": 2},
+        {"requests": 1},
+    ]
+    assert annotator.rate_limiter.limit.requests_per_minute == 60
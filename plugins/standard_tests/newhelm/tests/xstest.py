@@ -8,7 +8,7 @@ from newhelm.annotators.openai_compliance_annotator import (
     OpenAIComplianceAnnotator,
     ComplianceAnnotation,
 )
-from newhelm.base_annotator import BaseAnnotator
+from newhelm.base_annotator import BaseAnnotator, BaseCompletionAnnotator
 from newhelm.base_test import BasePromptResponseTest, TestMetadata
 from newhelm.dependency_helper import DependencyHelper
 from newhelm.external_data import ExternalData, WebData
@@ -21,6 +21,7 @@ from newhelm.single_turn_prompt_response import (
     TestItemAnnotations,
     TestItem,
 )
+from newhelm.sut import SUTCompletion
 from newhelm.sut_capabilities import AcceptsTextPrompt
 from newhelm.test_decorator import newhelm_test
 from newhelm.test_registry import TESTS
@@ -201,25 +202,46 @@ class XSTest(BasePromptResponseTest):
         )
 
 
-class StrMatchAnnotator(BaseAnnotator[ComplianceAnnotation]):
-    """Simple annotator class that classifies SUT compliance to a prompt by string_matching. Does not distringuish between Partial and Full Refusal."""
+class StrMatchCompletionRequest(BaseModel):
+    """The completion text StrMatchAnnotator classifies."""
 
-    def annotate_test_item(
-        self, interactions: List[PromptInteraction]
+    text: str
+
+
+class StrMatchAnnotator(
+    BaseCompletionAnnotator[
+        ComplianceAnnotation,
+        StrMatchCompletionRequest,
+        ComplianceAnnotation.Completion,
+    ]
+):
+    """Simple annotator class that classifies SUT compliance to a prompt by string_matching. Does not distringuish between Partial and Full Refusal.
+
+    It scores completions the same way as OpenAIComplianceAnnotator, so it can be the cheap tier of a CascadeAnnotator in front of it.
+    """
+
+    def make_completion_request(
+        self, interaction: PromptInteraction, completion: SUTCompletion
+    ) -> StrMatchCompletionRequest:
+        return StrMatchCompletionRequest(text=completion.text)
+
+    def annotate_completions(
+        self, requests: List[StrMatchCompletionRequest]
+    ) -> List[ComplianceAnnotation.Completion]:
+        return [
+            ComplianceAnnotation.Completion(compliance=self._str_match(request.text))
+            for request in requests
+        ]
+
+    def make_annotation(
+        self, completion_annotations: List[List[ComplianceAnnotation.Completion]]
     ) -> ComplianceAnnotation:
-        annotator_interactions = []
-        for interaction in interactions:
-            annotator_completions = []
-            for completion in interaction.response.completions:
-                annotator_completions.append(
-                    ComplianceAnnotation.Completion(
-                        compliance=self._str_match(completion.text)
-                    )
-                )
-            annotator_interactions.append(
-                ComplianceAnnotation.Interaction(completions=annotator_completions)
-            )
-        return ComplianceAnnotation(interactions=annotator_interactions)
+        return ComplianceAnnotation(
+            interactions=[
+                ComplianceAnnotation.Interaction(completions=completions)
+                for completions in completion_annotations
+            ]
+        )
 
     def _str_match(self, completion: str) -> str:
         """String-matching method for automatic evaluation of SUT responses.
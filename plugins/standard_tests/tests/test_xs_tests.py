@@ -1,6 +1,11 @@
 from newhelm.suts.openai_client import OpenAIApiKey, OpenAIOrgId
 import pytest
 
+from newhelm.annotators.openai_compliance_annotator import (
+    ComplianceAnnotation,
+    OpenAIComplianceAnnotator,
+)
+from newhelm.cascade_annotator import CascadeAnnotator
 from newhelm.prompt import TextPrompt
 from newhelm.tests.xstest import (
     XSTest,
@@ -210,3 +215,38 @@ def test_string_match_annotator():
         [_make_interaction("I cannot help with this.")]
     )
     assert annotated.interactions[0].completions[0].compliance == "Full Refusal"
+
+
+def test_string_match_annotator_in_front_of_openai_annotator():
+    openai_annotator = OpenAIComplianceAnnotator(
+        openai_api_key=_FAKE_API_KEY, openai_api_org_id=_FAKE_ORG_ID
+    )
+    scored_texts = []
+
+    def _annotate_completions(requests):
+        scored_texts.extend(request.text for request in requests)
+        return [
+            ComplianceAnnotation.Completion(compliance="Partial Refusal")
+            for _ in requests
+        ]
+
+    openai_annotator.annotate_completions = _annotate_completions  # type: ignore
+    # Only trust string matching when it spots a refusal.
+    cascade = CascadeAnnotator(
+        StrMatchAnnotator(),
+        openai_annotator,
+        is_confident=lambda score: score.compliance == "Full Refusal",
+    )
+
+    annotated = cascade.annotate_test_item(
+        [_make_interaction("I cannot help with this."), _make_interaction("Sure.")]
+    )
+
+    assert annotated.tiers == [["cheap"], ["expensive"]]
+    compliance = annotated.get_annotation(ComplianceAnnotation)
+    assert [i.completions[0].compliance for i in compliance.interactions] == [
+        "Full Refusal",
+        "Partial Refusal",
+    ]
+    assert len(scored_texts) == 1
+    assert "Sure." in scored_texts[0]
@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from string import Template
 from typing import Callable, Dict, List, Optional
 from newhelm.suts.together_client import (
@@ -9,8 +11,9 @@ from newhelm.suts.together_client import (
 
 from pydantic import BaseModel
 
-from newhelm.base_annotator import BaseAnnotator
+from newhelm.base_annotator import BaseCompletionAnnotator
 from newhelm.single_turn_prompt_response import PromptInteraction
+from newhelm.sut import SUTCompletion
 
 
 class LlamaGuardAnnotation(BaseModel):
@@ -30,41 +33,83 @@ class LlamaGuardAnnotation(BaseModel):
     interactions: List[Interaction]
 
 
-class LlamaGuardAnnotator(BaseAnnotator[LlamaGuardAnnotation]):
-    """Send the SUT's completions to LlamaGuard to get safety ratings."""
+class LlamaGuardAnnotator(
+    BaseCompletionAnnotator[
+        LlamaGuardAnnotation,
+        TogetherCompletionsRequest,
+        LlamaGuardAnnotation.Completion,
+    ]
+):
+    """Send the SUT's completions to LlamaGuard to get safety ratings.
+
+    Identical formatted prompts are sent once, and up to `max_concurrent_requests`
+    are sent at the same time. Calls go through the same pooled connections as the
+    Together SUTs.
+    """
 
     def __init__(
         self,
         together_api_key: TogetherApiKey,
         formatter: Optional[Callable[[str, str], str]] = None,
         decoder: Optional[Dict[str, str]] = None,
+        max_concurrent_requests: int = 8,
     ):
+        assert (
+            max_concurrent_requests > 0
+        ), f"Cannot annotate with {max_concurrent_requests} concurrent requests."
         self.model = TogetherCompletionsSUT("annotator", _MODEL_NAME, together_api_key)
         self.formatter = _default_formatter if formatter is None else formatter
         self.decoder = _DEFAULT_MAPPING if decoder is None else decoder
-
-    def annotate_test_item(
-        self, interactions: List[PromptInteraction]
+        self.max_concurrent_requests = max_concurrent_requests
+
+    def make_completion_request(
+        self, interaction: PromptInteraction, completion: SUTCompletion
+    ) -> TogetherCompletionsRequest:
+        return self._make_request(completion)
+
+    def annotate_completions(
+        self, requests: List[TogetherCompletionsRequest]
+    ) -> List[LlamaGuardAnnotation.Completion]:
+        if len(requests) <= 1 or self.max_concurrent_requests == 1:
+            responses = [self.model.evaluate(request) for request in requests]
+        else:
+            num_workers = min(len(requests), self.max_concurrent_requests)
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                responses = list(executor.map(self.model.evaluate, requests))
+        return [self._process_response(response) for response in responses]
+
+    async def annotate_completions_async(
+        self, requests: List[TogetherCompletionsRequest]
+    ) -> List[LlamaGuardAnnotation.Completion]:
+        """Same as annotate_completions, but in the event loop."""
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+        async def _evaluate(request: TogetherCompletionsRequest):
+            async with semaphore:
+                return await self.model.evaluate_async(request)
+
+        responses = await asyncio.gather(*[_evaluate(request) for request in requests])
+        return [self._process_response(response) for response in responses]
+
+    def make_annotation(
+        self, completion_annotations: List[List[LlamaGuardAnnotation.Completion]]
     ) -> LlamaGuardAnnotation:
-        """Returns an annotation for a single TestItem's interactions."""
-        llama_interactions = []
-        for interaction in interactions:
-            llama_completions = []
-            for completion in interaction.response.completions:
-                # TODO Consider giving more than just the agent's response
-                request = TogetherCompletionsRequest(
-                    prompt=self.formatter(_AGENT, f"{_AGENT}: {completion.text}"),
-                    model=_MODEL_NAME,
-                    # This might need to be dynamic if the decoder is complicated.
-                    max_tokens=20,
-                    n=1,
-                )
-                response = self.model.evaluate(request)
-                llama_completions.append(self._process_response(response))
-            llama_interactions.append(
-                LlamaGuardAnnotation.Interaction(completions=llama_completions)
-            )
-        return LlamaGuardAnnotation(interactions=llama_interactions)
+        return LlamaGuardAnnotation(
+            interactions=[
+                LlamaGuardAnnotation.Interaction(completions=completions)
+                for completions in completion_annotations
+            ]
+        )
+
+    def _make_request(self, completion: SUTCompletion) -> TogetherCompletionsRequest:
+        # TODO Consider giving more than just the agent's response
+        return TogetherCompletionsRequest(
+            prompt=self.formatter(_AGENT, f"{_AGENT}: {completion.text}"),
+            model=_MODEL_NAME,
+            # This might need to be dynamic if the decoder is complicated.
+            max_tokens=20,
+            n=1,
+        )
 
     def _process_response(
         self, response: TogetherCompletionsResponse
@@ -1,16 +1,21 @@
-from typing import Any, List, Optional
+import asyncio
+import threading
+from typing import Any, AsyncGenerator, Dict, List, Optional
+import weakref
+import aiohttp
 from pydantic import BaseModel, Field
 import requests
 from requests.adapters import HTTPAdapter, Retry
 from together.utils import response_status_exception  # type: ignore
 from newhelm.prompt import ChatPrompt, ChatRole, SUTOptions, TextPrompt
 from newhelm.prompt_formatting import format_chat
+from newhelm.rate_limiting import estimate_tokens
 from newhelm.secret_values import (
     InjectSecret,
     RequiredSecret,
     SecretDescription,
 )
-from newhelm.sut import PromptResponseSUT, SUTCompletion, SUTResponse
+from newhelm.sut import AsyncPromptResponseSUT, SUTCompletion, SUTResponse
 from newhelm.sut_capabilities import AcceptsChatPrompt, AcceptsTextPrompt
 from newhelm.sut_decorator import newhelm_sut
 
@@ -37,25 +42,48 @@ _ROLE_MAP = {
 }
 
 
+_MAX_RETRIES = 6
+_BACKOFF_FACTOR = 2
+_RETRY_STATUSES = [
+    408,  # Request Timeout
+    421,  # Misdirected Request
+    423,  # Locked
+    424,  # Failed Dependency
+    425,  # Too Early
+    429,  # Too Many Requests
+    *range(500, 599),  # Add all 5XX.
+]
+
+
+_POOL_SIZE = 32
+"""How many connections to Together to keep open, across all threads."""
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _shared_session() -> requests.Session:
+    """The Session for all Together calls, so SUTs and annotators reuse connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(
+                total=_MAX_RETRIES,
+                backoff_factor=_BACKOFF_FACTOR,
+                status_forcelist=_RETRY_STATUSES,
+                allowed_methods=["POST"],
+            )
+            session = requests.Session()
+            session.mount(
+                "https://", HTTPAdapter(max_retries=retries, pool_maxsize=_POOL_SIZE)
+            )
+            _session = session
+        return _session
+
+
 def _retrying_post(url, headers, json_payload):
     """HTTP Post with retry behavior."""
-    session = requests.Session()
-    retries = Retry(
-        total=6,
-        backoff_factor=2,
-        status_forcelist=[
-            408,  # Request Timeout
-            421,  # Misdirected Request
-            423,  # Locked
-            424,  # Failed Dependency
-            425,  # Too Early
-            429,  # Too Many Requests
-        ]
-        + list(range(500, 599)),  # Add all 5XX.
-        allowed_methods=["POST"],
-    )
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-    response = session.post(url, headers=headers, json=json_payload)
+    response = _shared_session().post(url, headers=headers, json=json_payload)
     try:
         response_status_exception(response)
     except Exception as e:
@@ -65,6 +93,77 @@ def _retrying_post(url, headers, json_payload):
     return response
 
 
+# For each event loop, its ClientSession and the generator that closes it.
+_async_sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+async def _close_at_shutdown(session: aiohttp.ClientSession) -> AsyncGenerator:
+    """Close `session` when its event loop shuts down its async generators."""
+    try:
+        yield
+    finally:
+        await session.close()
+
+
+async def _shared_async_session() -> aiohttp.ClientSession:
+    """The ClientSession for all Together calls in the running event loop.
+
+    aiohttp sessions can't be shared across event loops, so each loop gets its own.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_sessions.get(loop)
+    if entry is None or entry[0].closed:
+        session = aiohttp.ClientSession()
+        closer = _close_at_shutdown(session)
+        await closer.__anext__()
+        # Holding the generator keeps it alive until `asyncio.run` closes it.
+        entry = (session, closer)
+        _async_sessions[loop] = entry
+    return entry[0]
+
+
+async def _retrying_post_async(url, headers, json_payload) -> Dict:
+    """Asyncio version of `_retrying_post`, returning the decoded json response.
+
+    Like urllib3's Retry, this retries on both the statuses in `_RETRY_STATUSES` and
+    on connection errors and timeouts.
+    """
+    session = await _shared_async_session()
+    retry_count = 0
+    while True:
+        try:
+            async with session.post(
+                url, headers=headers, json=json_payload
+            ) as response:
+                if (
+                    response.status not in _RETRY_STATUSES
+                    or retry_count >= _MAX_RETRIES
+                ):
+                    if response.status >= 400:
+                        text = await response.text()
+                        raise Exception(
+                            f"Exception calling {url} with {json_payload}. Response {text}"
+                        )
+                    return await response.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if retry_count >= _MAX_RETRIES:
+                raise
+        retry_count += 1
+        # Same exponential backoff as urllib3's Retry.
+        await asyncio.sleep(_BACKOFF_FACTOR * 2 ** (retry_count - 1))
+
+
+def _make_headers(api_key: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {api_key}",
+    }
+
+
+def _estimate_tokens(request: Any) -> int:
+    """Together's tokens per minute also count every token the request may generate."""
+    return estimate_tokens(request) + (request.max_tokens or 0) * (request.n or 1)
+
+
 class TogetherCompletionsRequest(BaseModel):
     # https://docs.together.ai/reference/completions
     model: str
@@ -98,7 +197,7 @@ class TogetherCompletionsResponse(BaseModel):
 
 @newhelm_sut(capabilities=[AcceptsTextPrompt, AcceptsChatPrompt])
 class TogetherCompletionsSUT(
-    PromptResponseSUT[TogetherCompletionsRequest, TogetherCompletionsResponse]
+    AsyncPromptResponseSUT[TogetherCompletionsRequest, TogetherCompletionsResponse]
 ):
     _URL = "https://api.together.xyz/v1/completions"
 
@@ -129,16 +228,25 @@ class TogetherCompletionsSUT(
             n=options.num_completions,
         )
 
+    def estimate_tokens(self, request: TogetherCompletionsRequest) -> int:
+        return _estimate_tokens(request)
+
     def evaluate(
         self, request: TogetherCompletionsRequest
     ) -> TogetherCompletionsResponse:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-        }
         as_json = request.model_dump(exclude_none=True)
-        response = _retrying_post(self._URL, headers, as_json)
+        response = _retrying_post(self._URL, _make_headers(self.api_key), as_json)
         return TogetherCompletionsResponse.model_validate(response.json(), strict=True)
 
+    async def evaluate_async(
+        self, request: TogetherCompletionsRequest
+    ) -> TogetherCompletionsResponse:
+        as_json = request.model_dump(exclude_none=True)
+        response_json = await _retrying_post_async(
+            self._URL, _make_headers(self.api_key), as_json
+        )
+        return TogetherCompletionsResponse.model_validate(response_json, strict=True)
+
     def translate_response(
         self, request: TogetherCompletionsRequest, response: TogetherCompletionsResponse
     ) -> SUTResponse:
@@ -189,7 +297,9 @@ class TogetherChatResponse(BaseModel):
 
 
 @newhelm_sut(capabilities=[AcceptsTextPrompt, AcceptsChatPrompt])
-class TogetherChatSUT(PromptResponseSUT[TogetherChatRequest, TogetherChatResponse]):
+class TogetherChatSUT(
+    AsyncPromptResponseSUT[TogetherChatRequest, TogetherChatResponse]
+):
     _URL = "https://api.together.xyz/v1/chat/completions"
 
     def __init__(self, uid: str, model, api_key: TogetherApiKey):
@@ -228,15 +338,24 @@ class TogetherChatSUT(PromptResponseSUT[TogetherChatRequest, TogetherChatRespons
             n=options.num_completions,
         )
 
+    def estimate_tokens(self, request: TogetherChatRequest) -> int:
+        return _estimate_tokens(request)
+
     def evaluate(self, request: TogetherChatRequest) -> TogetherChatResponse:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-        }
         as_json = request.model_dump(exclude_none=True)
-        response = _retrying_post(self._URL, headers, as_json)
+        response = _retrying_post(self._URL, _make_headers(self.api_key), as_json)
         response_status_exception(response)
         return TogetherChatResponse.model_validate(response.json(), strict=True)
 
+    async def evaluate_async(
+        self, request: TogetherChatRequest
+    ) -> TogetherChatResponse:
+        as_json = request.model_dump(exclude_none=True)
+        response_json = await _retrying_post_async(
+            self._URL, _make_headers(self.api_key), as_json
+        )
+        return TogetherChatResponse.model_validate(response_json, strict=True)
+
     def translate_response(
         self, request: TogetherChatRequest, response: TogetherChatResponse
     ) -> SUTResponse:
@@ -300,7 +419,7 @@ class TogetherInferenceResponse(BaseModel):
 
 @newhelm_sut(capabilities=[AcceptsTextPrompt, AcceptsChatPrompt])
 class TogetherInferenceSUT(
-    PromptResponseSUT[TogetherInferenceRequest, TogetherInferenceResponse]
+    AsyncPromptResponseSUT[TogetherInferenceRequest, TogetherInferenceResponse]
 ):
     _URL = "https://api.together.xyz/inference"
 
@@ -331,15 +450,24 @@ class TogetherInferenceSUT(
             n=options.num_completions,
         )
 
+    def estimate_tokens(self, request: TogetherInferenceRequest) -> int:
+        return _estimate_tokens(request)
+
     def evaluate(self, request: TogetherInferenceRequest) -> TogetherInferenceResponse:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-        }
         as_json = request.model_dump(exclude_none=True)
-        response = _retrying_post(self._URL, headers, as_json)
+        response = _retrying_post(self._URL, _make_headers(self.api_key), as_json)
         response_status_exception(response)
         return TogetherInferenceResponse(**response.json())
 
+    async def evaluate_async(
+        self, request: TogetherInferenceRequest
+    ) -> TogetherInferenceResponse:
+        as_json = request.model_dump(exclude_none=True)
+        response_json = await _retrying_post_async(
+            self._URL, _make_headers(self.api_key), as_json
+        )
+        return TogetherInferenceResponse(**response_json)
+
     def translate_response(
         self, request: TogetherInferenceRequest, response: TogetherInferenceResponse
     ) -> SUTResponse:
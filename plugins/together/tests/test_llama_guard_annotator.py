@@ -1,3 +1,5 @@
+import asyncio
+import threading
 from typing import List
 from newhelm.annotators.llama_guard_annotator import (
     LlamaGuardAnnotation,
@@ -7,6 +9,7 @@ from newhelm.suts.together_client import (
     TogetherApiKey,
     TogetherChatRequest,
     TogetherChatResponse,
+    TogetherCompletionsRequest,
     TogetherCompletionsResponse,
 )
 from newhelm.prompt import TextPrompt
@@ -48,6 +51,11 @@ class MockTogetherSUT:
         self.requests_received.append(request)
         return self.response_stack.pop()
 
+    async def evaluate_async(
+        self, request: TogetherChatRequest
+    ) -> TogetherChatResponse:
+        return self.evaluate(request)
+
 
 def test_safe():
     interactions = [_make_interaction(["first"])]
@@ -137,3 +145,92 @@ def test_custom_prompt_decoder():
         annotator.model.requests_received[0].prompt
         == "Is assistant saying bad things? assistant: first"
     )
+
+
+def test_async_multiple_completions():
+    interactions = [
+        _make_interaction(["first", "second"]),
+        _make_interaction(["third"]),
+    ]
+    responses = [
+        _make_response("safe"),
+        _make_response("unsafe\nO1"),
+        _make_response("safe"),
+    ]
+    annotator = LlamaGuardAnnotator(TogetherApiKey("some-value"))
+    annotator.model = MockTogetherSUT(responses)
+
+    result = asyncio.run(annotator.annotate_test_item_async(interactions))
+
+    assert result == LlamaGuardAnnotation(
+        interactions=[
+            Interaction(
+                completions=[
+                    Completion(is_safe=True, violation_categories=[]),
+                    Completion(
+                        is_safe=False, violation_categories=["Violence and Hate"]
+                    ),
+                ]
+            ),
+            Interaction(
+                completions=[Completion(is_safe=True, violation_categories=[])]
+            ),
+        ]
+    )
+    assert [r.prompt for r in annotator.model.requests_received] == [
+        annotator.formatter("assistant", "assistant: first"),
+        annotator.formatter("assistant", "assistant: second"),
+        annotator.formatter("assistant", "assistant: third"),
+    ]
+
+
+def test_identical_completions():
+    interactions = [_make_interaction(["same", "same"]), _make_interaction(["same"])]
+    annotator = LlamaGuardAnnotator(TogetherApiKey("some-value"))
+    annotator.model = MockTogetherSUT([_make_response("safe")])
+
+    result = annotator.annotate_test_item(interactions)
+
+    safe = Completion(is_safe=True, violation_categories=[])
+    assert result == LlamaGuardAnnotation(
+        interactions=[
+            Interaction(completions=[safe, safe]),
+            Interaction(completions=[safe]),
+        ]
+    )
+    assert len(annotator.model.requests_received) == 1
+
+
+class ConcurrentTogetherSUT:
+    """Answers unsafe for completions containing "bad", once `num_callers` are waiting."""
+
+    def __init__(self, num_callers: int):
+        self.barrier = threading.Barrier(num_callers, timeout=5)
+        self.requests_received: List[str] = []
+
+    def evaluate(self, request: TogetherCompletionsRequest):
+        self.requests_received.append(request.prompt)
+        self.barrier.wait()
+        return _make_response("unsafe\nO1" if "bad" in request.prompt else "safe")
+
+
+def test_completions_sent_concurrently():
+    interactions = [
+        _make_interaction(["good", "bad"]),
+        _make_interaction(["bad", "also good"]),
+    ]
+    annotator = LlamaGuardAnnotator(TogetherApiKey("some-value"))
+    # Fails with a BrokenBarrierError unless all 3 unique requests are in flight together.
+    annotator.model = ConcurrentTogetherSUT(num_callers=3)
+
+    result = annotator.annotate_test_item(interactions)
+
+    safe = Completion(is_safe=True, violation_categories=[])
+    unsafe = Completion(is_safe=False, violation_categories=["Violence and Hate"])
+    assert result == LlamaGuardAnnotation(
+        interactions=[
+            Interaction(completions=[safe, unsafe]),
+            Interaction(completions=[unsafe, safe]),
+        ]
+    )
+    assert len(annotator.model.requests_received) == 3
@@ -1,8 +1,15 @@
+import asyncio
+import threading
+import aiohttp
 from unittest import mock
 
 import pytest
 
-from newhelm.suts.together_client import _retrying_post
+from newhelm.suts.together_client import (
+    _retrying_post,
+    _retrying_post_async,
+    _shared_session,
+)
 from requests import HTTPError
 
 
@@ -18,6 +25,7 @@ class MockResponse:
             raise HTTPError(f"Status {self.status_code}")
 
 
+@mock.patch("newhelm.suts.together_client._session", None)
 @mock.patch("requests.Session")
 def test_handle_together_400(mock_session):
     """Found in the wild on 2024 Feb 07 when calling particular models with an n of 25"""
@@ -31,3 +39,135 @@ def test_handle_together_400(mock_session):
     with pytest.raises(Exception) as e:
         _retrying_post("http://example.org/together", {}, "{}")
     assert "Input validation error" in str(e.value)
+
+
+def test_session_is_shared_across_threads():
+    sessions = []
+    threads = [
+        threading.Thread(target=lambda: sessions.append(_shared_session()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sessions) == 4
+    assert all(session is sessions[0] for session in sessions)
+
+
+class MockAsyncResponse:
+    """Bare bones mock of aiohttp.ClientResponse"""
+
+    def __init__(self, status, text):
+        self.status = status
+        self._text = text
+
+    async def text(self):
+        return self._text
+
+    async def json(self):
+        return {"text": self._text}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class MockAsyncSession:
+    """Bare bones mock of aiohttp.ClientSession"""
+
+    def __init__(self, responses):
+        self.responses = list(reversed(responses))
+        self.posts = 0
+        self.closed = False
+
+    def post(self, url, headers, json):
+        self.posts += 1
+        response = self.responses.pop()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+@mock.patch("asyncio.sleep")
+@mock.patch("aiohttp.ClientSession")
+def test_retrying_post_async_retries(mock_session, mock_sleep):
+    session = MockAsyncSession(
+        [MockAsyncResponse(429, "slow down"), MockAsyncResponse(200, "some-text")]
+    )
+    mock_session.return_value = session
+    result = asyncio.run(_retrying_post_async("http://example.org/together", {}, {}))
+    assert result == {"text": "some-text"}
+    assert session.posts == 2
+    assert mock_sleep.call_count == 1
+
+
+@mock.patch("aiohttp.ClientSession")
+def test_handle_together_400_async(mock_session):
+    mock_session.return_value = MockAsyncSession(
+        [MockAsyncResponse(400, '{"error": {"message": "Input validation error"}}')]
+    )
+    with pytest.raises(Exception) as e:
+        asyncio.run(_retrying_post_async("http://example.org/together", {}, {}))
+    assert "Input validation error" in str(e.value)
+
+
+@mock.patch("asyncio.sleep")
+@mock.patch("aiohttp.ClientSession")
+def test_retrying_post_async_retries_connection_errors(mock_session, mock_sleep):
+    session = MockAsyncSession(
+        [
+            aiohttp.ServerDisconnectedError(),
+            asyncio.TimeoutError(),
+            MockAsyncResponse(200, "some-text"),
+        ]
+    )
+    mock_session.return_value = session
+    result = asyncio.run(_retrying_post_async("http://example.org/together", {}, {}))
+    assert result == {"text": "some-text"}
+    assert session.posts == 3
+    assert mock_sleep.call_count == 2
+
+
+@mock.patch("asyncio.sleep")
+@mock.patch("aiohttp.ClientSession")
+def test_retrying_post_async_gives_up_on_connection_errors(mock_session, mock_sleep):
+    mock_session.return_value = MockAsyncSession(
+        [aiohttp.ServerDisconnectedError()] * 7
+    )
+    with pytest.raises(aiohttp.ServerDisconnectedError):
+        asyncio.run(_retrying_post_async("http://example.org/together", {}, {}))
+
+
+@mock.patch("aiohttp.ClientSession")
+def test_async_session_is_shared_within_event_loop(mock_session):
+    sessions = [
+        MockAsyncSession([MockAsyncResponse(200, "a"), MockAsyncResponse(200, "b")]),
+        MockAsyncSession([MockAsyncResponse(200, "c")]),
+    ]
+    mock_session.side_effect = sessions
+
+    async def _post_twice():
+        return await asyncio.gather(
+            _retrying_post_async("http://example.org/together", {}, {}),
+            _retrying_post_async("http://example.org/together", {}, {}),
+        )
+
+    asyncio.run(_post_twice())
+    assert sessions[0].posts == 2
+    # The session is closed along with its event loop, and a new loop gets its own.
+    assert sessions[0].closed
+    asyncio.run(_retrying_post_async("http://example.org/together", {}, {}))
+    assert sessions[1].posts == 1
+    assert mock_session.call_count == 2
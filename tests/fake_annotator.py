@@ -1,7 +1,8 @@
 from typing import List
 from pydantic import BaseModel
-from newhelm.base_annotator import BaseAnnotator
+from newhelm.base_annotator import BaseAnnotator, BaseCompletionAnnotator
 from newhelm.single_turn_prompt_response import PromptInteraction
+from newhelm.sut import SUTCompletion
 
 
 class FakeAnnotation(BaseModel):
@@ -20,3 +21,44 @@ class FakeAnnotator(BaseAnnotator[FakeAnnotation]):
         self.annotate_test_item_calls += 1
         """Returns an annotation for a single TestItem's interactions."""
         return FakeAnnotation(sut_text=interactions[0].response.completions[0].text)
+
+
+class FakeCompletionRequest(BaseModel):
+    text: str
+
+
+class FakeCompletionScore(BaseModel):
+    length: int
+
+
+class FakeCompletionsAnnotation(BaseModel):
+    lengths: List[List[int]]
+
+
+class FakeCompletionAnnotator(
+    BaseCompletionAnnotator[
+        FakeCompletionsAnnotation, FakeCompletionRequest, FakeCompletionScore
+    ]
+):
+    """Fake annotator that scores each completion by its length."""
+
+    def __init__(self) -> None:
+        self.scored_texts: List[str] = []
+
+    def make_completion_request(
+        self, interaction: PromptInteraction, completion: SUTCompletion
+    ) -> FakeCompletionRequest:
+        return FakeCompletionRequest(text=completion.text)
+
+    def annotate_completions(
+        self, requests: List[FakeCompletionRequest]
+    ) -> List[FakeCompletionScore]:
+        self.scored_texts.extend(request.text for request in requests)
+        return [FakeCompletionScore(length=len(request.text)) for request in requests]
+
+    def make_annotation(
+        self, completion_annotations: List[List[FakeCompletionScore]]
+    ) -> FakeCompletionsAnnotation:
+        return FakeCompletionsAnnotation(
+            lengths=[[score.length for score in row] for row in completion_annotations]
+        )
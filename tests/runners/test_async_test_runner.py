@@ -0,0 +1,229 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from newhelm.caching import MissingCacheEntries
+from newhelm.records import TestRecordWriter
+from newhelm.runners.async_test_runner import run_prompt_response_test_async
+from newhelm.runners.simple_test_runner import TestRunSetup, run_prompt_response_test
+from newhelm.sut import AsyncPromptResponseSUT
+from newhelm.sut_capabilities import AcceptsChatPrompt, AcceptsTextPrompt
+from newhelm.sut_decorator import newhelm_sut
+from tests.fake_annotator import FakeAnnotator
+from tests.fake_sut import FakeSUT, FakeSUTRequest, FakeSUTResponse
+from tests.fake_test import FakeTest, FakeTestResult, fake_test_item
+
+
+@newhelm_sut(capabilities=[AcceptsTextPrompt, AcceptsChatPrompt])
+class FakeAsyncSUT(FakeSUT, AsyncPromptResponseSUT[FakeSUTRequest, FakeSUTResponse]):
+    """Same as FakeSUT, but can be awaited."""
+
+    def __init__(self, uid: str = "fake-async-sut"):
+        super().__init__(uid)
+        self.evaluate_async_calls = 0
+
+    async def evaluate_async(self, request: FakeSUTRequest) -> FakeSUTResponse:
+        self.evaluate_async_calls += 1
+        return FakeSUTResponse(completions=[request.text] * request.num_completions)
+
+
+def _make_test(test_items, annotator=None):
+    return FakeTest(
+        test_items=test_items,
+        annotators={"some-annotator": annotator or FakeAnnotator()},
+        measurement={"some-measurement": 0.5},
+    )
+
+
+def test_run_prompt_response_test_async_matches_sync(tmpdir):
+    test_items = [fake_test_item(str(i)) for i in range(10)]
+    sync_record = run_prompt_response_test(
+        _make_test(test_items), FakeSUT(), tmpdir, use_caching=False
+    )
+    async_record = asyncio.run(
+        run_prompt_response_test_async(
+            _make_test(test_items), FakeAsyncSUT(), tmpdir, use_caching=False
+        )
+    )
+    assert async_record.test_item_records == sync_record.test_item_records
+    assert async_record.result.to_instance() == FakeTestResult(count_test_items=10)
+
+
+def test_run_prompt_response_test_async_uses_evaluate_async(tmpdir):
+    sut = FakeAsyncSUT()
+    asyncio.run(
+        run_prompt_response_test_async(
+            _make_test([fake_test_item("1")]), sut, tmpdir, use_caching=False
+        )
+    )
+    assert sut.evaluate_async_calls == 1
+    assert sut.evaluate_calls == 0
+
+
+def test_run_prompt_response_test_async_sync_sut_fallback(tmpdir):
+    sut = FakeSUT()
+    record = asyncio.run(
+        run_prompt_response_test_async(
+            _make_test([fake_test_item("1")]), sut, tmpdir, use_caching=False
+        )
+    )
+    assert sut.evaluate_calls == 1
+    assert len(record.test_item_records) == 1
+
+
+def test_run_prompt_response_test_async_caching(tmpdir):
+    test_items = [fake_test_item("1")]
+    sut_1 = FakeAsyncSUT()
+    annotator_1 = FakeAnnotator()
+    asyncio.run(
+        run_prompt_response_test_async(
+            _make_test(test_items, annotator_1), sut_1, tmpdir
+        )
+    )
+    assert sut_1.evaluate_async_calls == 1
+    assert annotator_1.annotate_test_item_calls == 1
+
+    sut_2 = FakeAsyncSUT()
+    annotator_2 = FakeAnnotator()
+    asyncio.run(
+        run_prompt_response_test_async(
+            _make_test(test_items, annotator_2), sut_2, tmpdir
+        )
+    )
+    assert sut_2.evaluate_async_calls == 0
+    assert annotator_2.annotate_test_item_calls == 0
+
+
+def test_run_prompt_response_test_async_replay_only(tmpdir):
+    test_items = [fake_test_item("1")]
+    asyncio.run(
+        run_prompt_response_test_async(_make_test(test_items), FakeAsyncSUT(), tmpdir)
+    )
+    sut = FakeAsyncSUT()
+    annotator = FakeAnnotator()
+    asyncio.run(
+        run_prompt_response_test_async(
+            _make_test(test_items, annotator), sut, tmpdir, replay_only=True
+        )
+    )
+    assert sut.evaluate_async_calls == 0
+    assert annotator.annotate_test_item_calls == 0
+    with pytest.raises(MissingCacheEntries):
+        asyncio.run(
+            run_prompt_response_test_async(
+                _make_test([fake_test_item("2")]), sut, tmpdir, replay_only=True
+            )
+        )
+    assert sut.evaluate_async_calls == 0
+
+
+def test_run_prompt_response_test_async_is_concurrent(tmpdir):
+    sut = FakeAsyncSUT()
+    original_evaluate_async = sut.evaluate_async
+    in_flight = []
+    both_started = asyncio.Event()
+
+    async def _wait_then_evaluate(request):
+        in_flight.append(request)
+        if len(in_flight) == 2:
+            both_started.set()
+        await asyncio.wait_for(both_started.wait(), timeout=5)
+        return await original_evaluate_async(request)
+
+    sut.evaluate_async = _wait_then_evaluate
+    record = asyncio.run(
+        run_prompt_response_test_async(
+            _make_test([fake_test_item("1"), fake_test_item("2")]),
+            sut,
+            tmpdir,
+            max_concurrency=2,
+        )
+    )
+    assert len(record.test_item_records) == 2
+
+
+def test_run_prompt_response_test_async_annotators_are_concurrent(tmpdir):
+    annotators = {key: FakeAnnotator() for key in ["slow", "fast"]}
+    # Both annotators must be working on the item at once to pass the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+    for annotator in annotators.values():
+
+        def _wait_then_annotate(interactions, original=annotator.annotate_test_item):
+            barrier.wait()
+            return original(interactions)
+
+        annotator.annotate_test_item = _wait_then_annotate
+    record = asyncio.run(
+        run_prompt_response_test_async(
+            FakeTest(
+                test_items=[fake_test_item("1")],
+                annotators=annotators,
+                measurement={},
+            ),
+            FakeAsyncSUT(),
+            tmpdir,
+        )
+    )
+    assert list(record.test_item_records[0].annotations) == ["slow", "fast"]
+
+
+def test_run_prompt_response_test_async_sut_exception(tmpdir):
+    sut = FakeAsyncSUT()
+
+    async def _raise_exception(*args, **kwargs):
+        raise Exception("some-exception")
+
+    sut.evaluate_async = _raise_exception
+
+    with pytest.raises(Exception) as err_info:
+        asyncio.run(
+            run_prompt_response_test_async(
+                _make_test([fake_test_item("1")]), sut, tmpdir
+            )
+        )
+    assert "SUT request `text='1' num_completions=1`" in str(err_info.value)
+    assert str(err_info.value.__cause__) == "some-exception"
+
+
+def test_run_prompt_response_test_async_record_writer_bounds_look_ahead(
+    tmpdir, monkeypatch
+):
+    class SlowFirstSUT(FakeAsyncSUT):
+        async def evaluate_async(self, request):
+            if request.text == "0":
+                # Stay unfinished while everything that can start does.
+                await asyncio.sleep(0.1)
+            return await super().evaluate_async(request)
+
+    buffered = []
+    original_write = TestRunSetup._write_finished_records
+
+    def _write_finished_records(self):
+        original_write(self)
+        buffered.append(len(self._records))
+
+    monkeypatch.setattr(
+        TestRunSetup, "_write_finished_records", _write_finished_records
+    )
+    sut = SlowFirstSUT()
+
+    with TestRecordWriter(os.path.join(tmpdir, "record.jsonl")) as record_writer:
+        asyncio.run(
+            run_prompt_response_test_async(
+                FakeTest(
+                    test_items=[fake_test_item(str(i)) for i in range(20)],
+                    annotators={},
+                    measurement={},
+                ),
+                sut,
+                tmpdir,
+                use_caching=False,
+                max_concurrency=2,
+                record_writer=record_writer,
+            )
+        )
+
+    # At most 2 * max_concurrency TestItems are started, one of them the slow one.
+    assert max(buffered) == 3
+    assert sut.evaluate_async_calls == 20
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+
+import pytest
+from newhelm.records import TestItemRecord
+from newhelm.runners.coordinated_test_runner import (
+    run_prompt_response_test_coordinated,
+    run_worker,
+)
+from newhelm.runners.simple_test_runner import run_prompt_response_test
+from newhelm.runners.work_queue import (
+    DONE,
+    FAILED,
+    LEASED,
+    PENDING,
+    SKIPPED,
+    WorkQueue,
+)
+from tests.fake_annotator import FakeAnnotator
+from tests.fake_sut import FakeSUT
+from tests.fake_test import FakeTest, fake_test_item
+
+_TEXTS = ["1", "2", "3", "4", "5"]
+
+
+def _make_test():
+    return FakeTest(
+        test_items=[fake_test_item(text) for text in _TEXTS],
+        annotators={"some-annotator": FakeAnnotator()},
+        measurement={"some-measurement": 0.5},
+    )
+
+
+def _make_queue(tmpdir, **kwargs):
+    queue = WorkQueue(os.path.join(tmpdir, "queue.sqlite"), **kwargs)
+    queue.fill("test-uid", "fake-sut", [fake_test_item(text) for text in _TEXTS])
+    return queue
+
+
+def _make_record(text):
+    return TestItemRecord(
+        test_item=fake_test_item(text),
+        interactions=[],
+        annotations={},
+        measurements={},
+    )
+
+
+def test_work_queue_leases_each_item_once(tmpdir):
+    queue = _make_queue(tmpdir)
+
+    leases = [queue.lease("worker") for _ in _TEXTS]
+
+    assert [lease.position for lease in leases] == [0, 1, 2, 3, 4]
+    assert queue.lease("other-worker") is None
+    assert queue.counts()[LEASED] == 5
+    assert not queue.is_finished()
+    for lease, text in zip(leases, _TEXTS):
+        queue.complete(lease, _make_record(text))
+    assert queue.is_finished()
+    assert [record for _, record in queue.records()] == [
+        _make_record(text) for text in _TEXTS
+    ]
+
+
+def test_work_queue_requeues_abandoned_leases(tmpdir):
+    queue = _make_queue(tmpdir, lease_seconds=0.3)
+    abandoned = queue.lease("dead-worker")
+    kept = queue.lease("live-worker")
+
+    time.sleep(0.2)
+    queue.heartbeat("live-worker")
+    time.sleep(0.2)
+
+    # Only the TestItem whose worker stopped sending heartbeats goes back in the queue.
+    assert queue.lease("other-worker").position == abandoned.position
+    assert queue.lease("other-worker").position not in [
+        abandoned.position,
+        kept.position,
+    ]
+
+
+def test_work_queue_gives_up_after_max_attempts(tmpdir):
+    queue = _make_queue(tmpdir, max_attempts=2)
+
+    queue.fail(queue.lease("worker"), "first error")
+    assert queue.counts()[PENDING] == 5
+    queue.fail(queue.lease("worker"), "second error")
+
+    assert queue.counts()[FAILED] == 1
+    assert queue.errors() == {0: "second error"}
+
+
+def test_work_queue_ignores_failures_after_lease_expires(tmpdir):
+    queue = _make_queue(tmpdir, lease_seconds=0.01)
+    expired = queue.lease("slow-worker")
+    time.sleep(0.02)
+    retaken = queue.lease("other-worker")
+    assert retaken.position == expired.position
+
+    queue.fail(expired, "too slow")
+    queue.complete(retaken, _make_record("1"))
+
+    assert queue.counts()[DONE] == 1
+    assert queue.errors() == {}
+
+
+def test_work_queue_fill_different_run(tmpdir):
+    queue = _make_queue(tmpdir)
+    queue.complete(queue.lease("worker"), _make_record("1"))
+
+    # Filling with the same run again keeps its progress.
+    queue.fill("test-uid", "fake-sut", [fake_test_item(text) for text in _TEXTS])
+    assert queue.counts()[DONE] == 1
+
+    with pytest.raises(ValueError) as err_info:
+        queue.fill("test-uid", "other-sut", [fake_test_item("1")])
+    assert "it already holds a different run, for test=test-uid sut=fake-sut" in str(
+        err_info.value
+    )
+
+
+def test_work_queue_fill_skips(tmpdir):
+    queue = WorkQueue(os.path.join(tmpdir, "queue.sqlite"))
+    items = [fake_test_item(text) for text in _TEXTS]
+
+    queue.fill("test-uid", "fake-sut", items, skip={0, 1})
+
+    assert queue.counts()[SKIPPED] == 2
+    lease = queue.lease("worker")
+    assert lease is not None and lease.position == 2
+    # Refilling can skip more, but not what a worker already has.
+    queue.fill("test-uid", "fake-sut", items, skip={2, 3})
+    assert queue.counts() == {PENDING: 1, LEASED: 1, DONE: 0, FAILED: 0, SKIPPED: 3}
+
+
+def _interrupted_run(tmpdir, fail_on):
+    sut = FakeSUT()
+    original_evaluate = sut.evaluate
+
+    def _evaluate(request):
+        if request.text == fail_on:
+            raise Exception("some-exception")
+        return original_evaluate(request)
+
+    sut.evaluate = _evaluate
+    with pytest.raises(Exception):
+        run_prompt_response_test(_make_test(), sut, tmpdir, use_caching=False)
+
+
+def test_coordinated_run_resumes_from_journal(tmpdir):
+    _interrupted_run(tmpdir, fail_on="3")
+    queue = WorkQueue(os.path.join(tmpdir, "queue.sqlite"))
+    records = []
+    coordinator = threading.Thread(
+        target=lambda: records.append(
+            run_prompt_response_test_coordinated(
+                _make_test(), FakeSUT(), tmpdir, queue, resume=True, poll_seconds=0.01
+            )
+        )
+    )
+    coordinator.start()
+    while queue.run_uids() is None:
+        time.sleep(0.01)
+    sut = FakeSUT()
+
+    finished = run_worker(_make_test(), sut, tmpdir, queue, use_caching=False)
+    coordinator.join()
+
+    # Only the TestItems the journal doesn't have are processed.
+    assert finished == 3
+    assert sut.evaluate_calls == 3
+    expected = run_prompt_response_test(
+        _make_test(), FakeSUT(), tmpdir, use_caching=False
+    )
+    assert records[0].test_item_records == expected.test_item_records
+
+
+def test_coordinator_restarted_with_resume(tmpdir):
+    # A previous coordinator filled the queue with every TestItem.
+    queue = _make_queue(tmpdir)
+    run_worker(_make_test(), FakeSUT(), tmpdir, queue, use_caching=False)
+    _interrupted_run(tmpdir, fail_on="3")
+
+    record = run_prompt_response_test_coordinated(
+        _make_test(), FakeSUT(), tmpdir, queue, resume=True, poll_seconds=0.01
+    )
+
+    expected = run_prompt_response_test(
+        _make_test(), FakeSUT(), tmpdir, use_caching=False
+    )
+    assert record.test_item_records == expected.test_item_records
+    assert record.result == expected.result
+
+
+def test_coordinated_run_matches_simple_run(tmpdir):
+    queue = _make_queue(tmpdir)
+    sut = FakeSUT()
+
+    finished = run_worker(
+        _make_test(), sut, tmpdir, queue, use_caching=False, max_workers=2
+    )
+    record = run_prompt_response_test_coordinated(
+        _make_test(), FakeSUT(), tmpdir, queue, poll_seconds=0.01
+    )
+
+    assert finished == 5
+    assert sut.evaluate_calls == 5
+    expected = run_prompt_response_test(
+        _make_test(), FakeSUT(), tmpdir, use_caching=False
+    )
+    assert record.test_item_records == expected.test_item_records
+    assert record.result == expected.result
+
+
+def test_worker_picks_up_abandoned_items(tmpdir):
+    queue = _make_queue(tmpdir, lease_seconds=0.2)
+    queue.lease("dead-worker")
+
+    finished = run_worker(
+        _make_test(), FakeSUT(), tmpdir, queue, use_caching=False, poll_seconds=0.01
+    )
+
+    assert finished == 5
+    assert queue.counts()[DONE] == 5
+
+
+def test_coordinated_run_with_failing_item(tmpdir):
+    queue = _make_queue(tmpdir)
+    sut = FakeSUT()
+    original_evaluate = sut.evaluate
+
+    def _evaluate(request):
+        if request.text == "3":
+            raise Exception("some-exception")
+        return original_evaluate(request)
+
+    sut.evaluate = _evaluate
+
+    assert run_worker(_make_test(), sut, tmpdir, queue, use_caching=False) == 4
+    with pytest.raises(Exception) as err_info:
+        run_prompt_response_test_coordinated(
+            _make_test(), FakeSUT(), tmpdir, queue, poll_seconds=0.01
+        )
+    assert "1 TestItems failed too many times" in str(err_info.value)
+    assert "some-exception" in str(err_info.value)
+
+
+def test_worker_for_other_run(tmpdir):
+    queue = _make_queue(tmpdir)
+
+    with pytest.raises(ValueError) as err_info:
+        run_worker(_make_test(), FakeSUT("other-sut"), tmpdir, queue)
+    assert "doesn't hold a run for test=test-uid sut=other-sut" in str(err_info.value)
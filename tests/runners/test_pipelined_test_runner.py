@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+from newhelm.runners.pipelined_test_runner import run_prompt_response_test_pipelined
+from newhelm.runners.simple_test_runner import run_prompt_response_test
+from tests.fake_annotator import FakeAnnotator
+from tests.fake_sut import FakeSUT
+from tests.fake_test import FakeTest, FakeTestResult, fake_test_item
+
+
+def _make_test(test_items, annotators=None):
+    if annotators is None:
+        annotators = {"some-annotator": FakeAnnotator()}
+    return FakeTest(
+        test_items=test_items,
+        annotators=annotators,
+        measurement={"some-measurement": 0.5},
+    )
+
+
+@pytest.mark.parametrize("workers_per_stage", [1, 3])
+def test_run_prompt_response_test_pipelined_matches_serial(tmpdir, workers_per_stage):
+    test_items = [fake_test_item(str(i)) for i in range(20)]
+    annotators = {"annotator-1": FakeAnnotator(), "annotator-2": FakeAnnotator()}
+    serial = run_prompt_response_test(
+        _make_test(test_items, annotators), FakeSUT(), tmpdir, use_caching=False
+    )
+    pipelined = run_prompt_response_test_pipelined(
+        _make_test(test_items, annotators),
+        FakeSUT(),
+        tmpdir,
+        use_caching=False,
+        workers_per_stage=workers_per_stage,
+    )
+    assert pipelined.test_item_records == serial.test_item_records
+    assert pipelined.result.to_instance() == FakeTestResult(count_test_items=20)
+    for record in pipelined.test_item_records:
+        assert list(record.annotations.keys()) == ["annotator-1", "annotator-2"]
+
+
+def test_run_prompt_response_test_pipelined_no_annotators(tmpdir):
+    record = run_prompt_response_test_pipelined(
+        _make_test([fake_test_item("1")], annotators={}), FakeSUT(), tmpdir
+    )
+    assert len(record.test_item_records) == 1
+
+
+def test_run_prompt_response_test_pipelined_overlaps_stages(tmpdir):
+    sut = FakeSUT()
+    original_evaluate = sut.evaluate
+    second_sut_call = threading.Event()
+
+    def _evaluate(request):
+        if request.text == "2":
+            second_sut_call.set()
+        return original_evaluate(request)
+
+    sut.evaluate = _evaluate
+    annotator = FakeAnnotator()
+    original_annotate = annotator.annotate_test_item
+
+    def _annotate(interactions):
+        if interactions[0].response.completions[0].text == "1":
+            # This only finishes if the SUT moves on while we are annotating.
+            assert second_sut_call.wait(timeout=5)
+        return original_annotate(interactions)
+
+    annotator.annotate_test_item = _annotate
+    record = run_prompt_response_test_pipelined(
+        _make_test(
+            [fake_test_item("1"), fake_test_item("2")], {"some-annotator": annotator}
+        ),
+        sut,
+        tmpdir,
+        use_caching=False,
+    )
+    assert len(record.test_item_records) == 2
+
+
+def test_run_prompt_response_test_pipelined_backpressure(tmpdir):
+    sut = FakeSUT()
+    annotator = FakeAnnotator()
+    max_ahead = []
+    original_evaluate = sut.evaluate
+
+    def _evaluate(request):
+        max_ahead.append(sut.evaluate_calls - annotator.annotate_test_item_calls)
+        return original_evaluate(request)
+
+    sut.evaluate = _evaluate
+    run_prompt_response_test_pipelined(
+        _make_test(
+            [fake_test_item(str(i)) for i in range(50)], {"some-annotator": annotator}
+        ),
+        sut,
+        tmpdir,
+        use_caching=False,
+        max_queue_size=1,
+    )
+    # Bounded by the queue between the stages, plus one item per worker.
+    assert max(max_ahead) <= 3
+
+
+def test_run_prompt_response_test_pipelined_annotator_exception(tmpdir):
+    annotator = FakeAnnotator()
+
+    def _raise_exception(*args, **kwargs):
+        raise Exception("some-exception")
+
+    annotator.annotate_test_item = _raise_exception
+
+    with pytest.raises(Exception) as err_info:
+        run_prompt_response_test_pipelined(
+            _make_test(
+                [fake_test_item(str(i)) for i in range(10)],
+                {"some-annotator": annotator},
+            ),
+            FakeSUT(),
+            tmpdir,
+        )
+    assert "Exception while handling annotation for some-annotator" in str(
+        err_info.value
+    )
+    assert str(err_info.value.__cause__) == "some-exception"
@@ -0,0 +1,216 @@
+import asyncio
+import os
+
+import pytest
+from newhelm.runners.async_test_runner import run_prompt_response_test_async
+from newhelm.runners.pipelined_test_runner import run_prompt_response_test_pipelined
+from newhelm.records import TestItemRecord
+from newhelm.runners.run_journal import RunJournal, journal_key
+from newhelm.runners.simple_test_runner import run_prompt_response_test
+from tests.fake_annotator import FakeAnnotator
+from tests.fake_sut import FakeSUT
+from tests.fake_test import FakeTest, fake_test_item
+
+
+def _make_test(texts):
+    return FakeTest(
+        test_items=[fake_test_item(text) for text in texts],
+        annotators={"some-annotator": FakeAnnotator()},
+        measurement={"some-measurement": 0.5},
+    )
+
+
+def _make_record(text):
+    return TestItemRecord(
+        test_item=fake_test_item(text),
+        interactions=[],
+        annotations={},
+        measurements={},
+    )
+
+
+def _journal_path(tmpdir):
+    return os.path.join(tmpdir, "FakeTest", "journals", "test-uid", "fake-sut.jsonl")
+
+
+def _fail_on(sut, text):
+    original_evaluate = sut.evaluate
+
+    def _evaluate(request):
+        if request.text == text:
+            raise Exception("some-exception")
+        return original_evaluate(request)
+
+    sut.evaluate = _evaluate
+
+
+def _interrupted_run(tmpdir, texts, fail_on):
+    sut = FakeSUT()
+    _fail_on(sut, fail_on)
+    with pytest.raises(Exception):
+        run_prompt_response_test(_make_test(texts), sut, tmpdir, use_caching=False)
+
+
+def test_journal_has_every_record(tmpdir):
+    record = run_prompt_response_test(_make_test(["1", "2"]), FakeSUT(), tmpdir)
+
+    journaled = RunJournal(
+        os.path.join(tmpdir, "FakeTest", "journals"), "test-uid", "fake-sut"
+    ).load()
+    assert [
+        r for records in journaled.values() for r in records
+    ] == record.test_item_records
+
+
+def test_resume_skips_finished_items(tmpdir):
+    texts = ["1", "2", "3", "4"]
+    _interrupted_run(tmpdir, texts, fail_on="3")
+
+    sut = FakeSUT()
+    resumed = run_prompt_response_test(
+        _make_test(texts), sut, tmpdir, use_caching=False, resume=True
+    )
+
+    # Only the failed item and the ones after it are processed again.
+    assert sut.evaluate_calls == 2
+    expected = run_prompt_response_test(
+        _make_test(texts), FakeSUT(), tmpdir, use_caching=False
+    )
+    assert resumed.test_item_records == expected.test_item_records
+    assert resumed.result == expected.result
+
+
+def test_without_resume_journal_starts_over(tmpdir):
+    _interrupted_run(tmpdir, ["1", "2", "3"], fail_on="3")
+
+    sut = FakeSUT()
+    run_prompt_response_test(_make_test(["1", "2", "3"]), sut, tmpdir)
+    assert sut.evaluate_calls == 3
+
+    sut = FakeSUT()
+    run_prompt_response_test(
+        _make_test(["1", "2", "3"]), sut, tmpdir, use_caching=False, resume=True
+    )
+    assert sut.evaluate_calls == 0
+
+
+def test_resume_ignores_partial_line(tmpdir):
+    _interrupted_run(tmpdir, ["1", "2", "3"], fail_on="2")
+    with open(_journal_path(tmpdir), "a") as f:
+        f.write('{"item_key": "cut off')
+
+    sut = FakeSUT()
+    record = run_prompt_response_test(
+        _make_test(["1", "2", "3"]), sut, tmpdir, use_caching=False, resume=True
+    )
+
+    assert sut.evaluate_calls == 2
+    assert [r.test_item.prompts[0].prompt.text for r in record.test_item_records] == [
+        "1",
+        "2",
+        "3",
+    ]
+    with open(_journal_path(tmpdir)) as f:
+        # The header and one line for each TestItem.
+        assert len(f.read().splitlines()) == 4
+
+
+def test_resume_ignores_long_partial_line(tmpdir):
+    _interrupted_run(tmpdir, ["1", "2", "3"], fail_on="2")
+    with open(_journal_path(tmpdir), "a") as f:
+        # Longer than each read from the end of the journal.
+        f.write('{"item_key": "' + "x" * 100_000)
+
+    sut = FakeSUT()
+    record = run_prompt_response_test(
+        _make_test(["1", "2", "3"]), sut, tmpdir, use_caching=False, resume=True
+    )
+
+    assert sut.evaluate_calls == 2
+    assert len(record.test_item_records) == 3
+    with open(_journal_path(tmpdir)) as f:
+        assert len(f.read().splitlines()) == 4
+
+
+def test_journal_in_use_by_another_run(tmpdir):
+    directory = os.path.join(tmpdir, "journals")
+    journal = RunJournal(directory, "test-uid", "fake-sut").start()
+    journal.append(fake_test_item("1"), _make_record("1"))
+
+    other = RunJournal(directory, "test-uid", "fake-sut")
+    with pytest.raises(ValueError) as err_info:
+        other.start()
+    assert "another run of test=test-uid sut=fake-sut is using it" in str(
+        err_info.value
+    )
+
+    # The first run's journal is left alone, and it can keep going.
+    journal.append(fake_test_item("2"), _make_record("2"))
+    journal.close()
+    assert list(other.load().keys()) == [
+        journal_key(fake_test_item("1")),
+        journal_key(fake_test_item("2")),
+    ]
+    # Once the first run is done, the journal can be used again.
+    other.resume().close()
+
+
+def test_test_uids_sharing_a_class_have_own_journals(tmpdir):
+    _interrupted_run(tmpdir, ["1", "2"], fail_on="2")
+    with open(_journal_path(tmpdir)) as f:
+        journal = f.read()
+
+    # Another uid for the same Test class has a journal of its own.
+    sut = FakeSUT()
+    run_prompt_response_test(
+        FakeTest("other-test", test_items=[fake_test_item("1")]),
+        sut,
+        tmpdir,
+        use_caching=False,
+        resume=True,
+    )
+
+    assert sut.evaluate_calls == 1
+    with open(_journal_path(tmpdir)) as f:
+        assert f.read() == journal
+    assert os.path.exists(
+        os.path.join(tmpdir, "FakeTest", "journals", "other-test", "fake-sut.jsonl")
+    )
+
+
+def test_resume_from_journal_for_other_run(tmpdir):
+    _interrupted_run(tmpdir, ["1", "2"], fail_on="2")
+    journal = RunJournal(
+        os.path.join(tmpdir, "FakeTest", "journals"), "test-uid", "other-sut"
+    )
+    os.rename(_journal_path(tmpdir), journal.path)
+
+    with pytest.raises(ValueError) as err_info:
+        journal.load()
+    assert "it was written for test=test-uid sut=fake-sut" in str(err_info.value)
+
+
+def test_resume_async(tmpdir):
+    _interrupted_run(tmpdir, ["1", "2", "3"], fail_on="2")
+
+    sut = FakeSUT()
+    record = asyncio.run(
+        run_prompt_response_test_async(
+            _make_test(["1", "2", "3"]), sut, tmpdir, use_caching=False, resume=True
+        )
+    )
+
+    assert sut.evaluate_calls == 2
+    assert len(record.test_item_records) == 3
+
+
+def test_resume_pipelined(tmpdir):
+    _interrupted_run(tmpdir, ["1", "2", "3"], fail_on="3")
+
+    sut = FakeSUT()
+    record = run_prompt_response_test_pipelined(
+        _make_test(["1", "2", "3"]), sut, tmpdir, use_caching=False, resume=True
+    )
+
+    assert sut.evaluate_calls == 1
+    assert len(record.test_item_records) == 3
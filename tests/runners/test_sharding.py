@@ -0,0 +1,118 @@
+import os
+
+import pytest
+from newhelm.records import Shard, TestRecordReader, TestRecordWriter
+from newhelm.runners.sharding import (
+    make_shard,
+    merge_test_records,
+    shard_test_items,
+)
+from newhelm.runners.simple_test_runner import run_prompt_response_test
+from tests.fake_sut import FakeSUT
+from tests.fake_test import FakeTest, FakeTestResult, fake_test_item
+
+_TEST_ITEMS = [fake_test_item(str(i)) for i in range(20)]
+
+
+def _run_shard(tmpdir, index, count, sut=None, test_items=_TEST_ITEMS):
+    path = os.path.join(tmpdir, f"shard_{index}.jsonl")
+    with TestRecordWriter(path) as record_writer:
+        run_prompt_response_test(
+            FakeTest(test_items=test_items, measurement={"some-measurement": 0.5}),
+            sut or FakeSUT(),
+            tmpdir,
+            use_caching=False,
+            record_writer=record_writer,
+            shard=make_shard(index, count),
+        )
+    return path
+
+
+def test_make_shard():
+    assert make_shard(0, 1) is None
+    assert make_shard(2, 3) == Shard(index=2, count=3)
+
+
+def test_shard_test_items_partitions():
+    shards = [shard_test_items(_TEST_ITEMS, Shard(index=i, count=3)) for i in range(3)]
+
+    assert sorted(item.prompts[0].prompt.text for s in shards for item in s) == sorted(
+        item.prompts[0].prompt.text for item in _TEST_ITEMS
+    )
+    assert all(shards)
+    # The partition doesn't depend on the order of the TestItems.
+    assert (
+        shard_test_items(_TEST_ITEMS[::-1], Shard(index=1, count=3)) == shards[1][::-1]
+    )
+
+
+def test_run_only_processes_shard(tmpdir):
+    sut = FakeSUT()
+    path = _run_shard(tmpdir, 1, 3, sut=sut)
+
+    expected = shard_test_items(_TEST_ITEMS, Shard(index=1, count=3))
+    reader = TestRecordReader(path)
+    assert sut.evaluate_calls == len(expected)
+    assert reader.header.shard == Shard(index=1, count=3)
+    assert [r.test_item for r in reader.test_item_records()] == expected
+
+
+def test_merge_test_records(tmpdir):
+    paths = [_run_shard(tmpdir, i, 3) for i in [2, 0, 1]]
+    test = FakeTest(test_items=_TEST_ITEMS)
+    merged_path = os.path.join(tmpdir, "merged.jsonl")
+
+    with TestRecordWriter(merged_path) as record_writer:
+        streamed = merge_test_records(test, paths, record_writer)
+    merged = merge_test_records(test, paths)
+
+    assert merged.result.to_instance(FakeTestResult) == FakeTestResult(
+        count_test_items=20
+    )
+    assert streamed.result == merged.result
+    assert streamed.test_item_records == []
+    assert sorted(
+        r.test_item.prompts[0].prompt.text for r in merged.test_item_records
+    ) == sorted(item.prompts[0].prompt.text for item in _TEST_ITEMS)
+    reader = TestRecordReader(merged_path)
+    assert reader.header.shard is None
+    assert list(reader.test_item_records()) == merged.test_item_records
+
+
+def test_merge_test_records_missing_shard(tmpdir):
+    paths = [_run_shard(tmpdir, i, 3) for i in [0, 2]]
+
+    with pytest.raises(ValueError) as err_info:
+        merge_test_records(FakeTest(), paths)
+    assert "Cannot merge without shards [1] of 3." in str(err_info.value)
+
+
+def test_merge_test_records_different_sut(tmpdir):
+    paths = [
+        _run_shard(tmpdir, 0, 2),
+        _run_shard(tmpdir, 1, 2, sut=FakeSUT("other-sut")),
+    ]
+
+    with pytest.raises(ValueError) as err_info:
+        merge_test_records(FakeTest(), paths)
+    assert "their sut_uid don't match" in str(err_info.value)
+
+
+def test_merge_test_records_different_shard_count(tmpdir):
+    paths = [_run_shard(tmpdir, 0, 2), _run_shard(tmpdir, 1, 3)]
+
+    with pytest.raises(ValueError) as err_info:
+        merge_test_records(FakeTest(), paths)
+    assert "they split the run into 3 and 2 shards" in str(err_info.value)
+
+
+def test_merge_test_records_unfinished(tmpdir):
+    paths = [_run_shard(tmpdir, 0, 2), _run_shard(tmpdir, 1, 2)]
+    with open(paths[1]) as f:
+        lines = f.readlines()
+    with open(paths[1], "w") as f:
+        f.writelines(lines[:-1])
+
+    with pytest.raises(ValueError) as err_info:
+        merge_test_records(FakeTest(), paths)
+    assert "its run didn't finish" in str(err_info.value)
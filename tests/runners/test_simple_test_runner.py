@@ -1,15 +1,47 @@
+from contextlib import ExitStack
+import os
+import threading
+import time
+from typing import List
+
 import pytest
 from newhelm.annotation import Annotation
-from newhelm.records import TestItemRecord
-from newhelm.runners.simple_test_runner import run_prompt_response_test
+from newhelm.caching import (
+    CacheStatistics,
+    MemoryCache,
+    MissingCacheEntries,
+    NoCache,
+    load_cache_statistics,
+)
+from newhelm.prompt import TextPrompt
+from newhelm.records import TestItemRecord, TestRecordReader, TestRecordWriter
+from newhelm.runners.simple_test_runner import (
+    CompletionAnnotationCache,
+    TestRunSetup,
+    partition_sut_requests,
+    prefetch_sut_responses,
+    run_prompt_response_test,
+)
 from newhelm.single_turn_prompt_response import (
     PromptInteraction,
+    PromptWithContext,
+    TestItem,
 )
 from newhelm.sut import SUTCompletion, SUTResponse
-from newhelm.sut_capabilities import ProducesPerTokenLogProbabilities
+from newhelm.sut_capabilities import (
+    AcceptsBatchRequests,
+    AcceptsChatPrompt,
+    AcceptsTextPrompt,
+    ProducesPerTokenLogProbabilities,
+)
+from newhelm.sut_decorator import newhelm_sut
 from newhelm.test_decorator import newhelm_test
-from tests.fake_annotator import FakeAnnotator
-from tests.fake_sut import FakeSUT
+from tests.fake_annotator import (
+    FakeAnnotator,
+    FakeCompletionAnnotator,
+    FakeCompletionsAnnotation,
+)
+from tests.fake_sut import FakeSUT, FakeSUTRequest, FakeSUTResponse
 from tests.fake_test import FakeTest, FakeTestResult, fake_test_item
 
 
@@ -102,6 +134,388 @@ def test_run_prompt_response_test_caching(tmpdir):
     assert record_1.result == record_2.result
 
 
+def test_run_prompt_response_test_shared_cache(tmpdir):
+    test_items = [fake_test_item("1")]
+    annotator_1 = FakeAnnotator()
+    sut_1 = FakeSUT()
+    record_1 = run_prompt_response_test(
+        FakeTest(test_items=test_items, annotators={"some-annotator": annotator_1}),
+        sut_1,
+        tmpdir,
+        shared_cache=True,
+    )
+    assert sut_1.evaluate_calls == 1
+    assert annotator_1.annotate_test_item_calls == 1
+    # Second run should be fully cached
+    annotator_2 = FakeAnnotator()
+    sut_2 = FakeSUT()
+    record_2 = run_prompt_response_test(
+        FakeTest(test_items=test_items, annotators={"some-annotator": annotator_2}),
+        sut_2,
+        tmpdir,
+        shared_cache=True,
+    )
+    assert sut_2.evaluate_calls == 0
+    assert annotator_2.annotate_test_item_calls == 0
+    assert record_1.test_item_records == record_2.test_item_records
+
+
+@newhelm_test(requires_sut_capabilities=[AcceptsTextPrompt])
+class OtherFakeTest(FakeTest):
+    pass
+
+
+def test_run_prompt_response_test_global_sut_cache(tmpdir):
+    sut_1 = FakeSUT()
+    run_prompt_response_test(
+        FakeTest("first-test", test_items=[fake_test_item("1"), fake_test_item("2")]),
+        sut_1,
+        tmpdir,
+        global_sut_cache=True,
+    )
+    assert sut_1.evaluate_calls == 2
+    # A different Test can reuse the responses.
+    sut_2 = FakeSUT()
+    run_prompt_response_test(
+        OtherFakeTest(
+            "second-test", test_items=[fake_test_item("2"), fake_test_item("3")]
+        ),
+        sut_2,
+        tmpdir,
+        global_sut_cache=True,
+    )
+    assert sut_2.evaluate_calls == 1
+    assert load_cache_statistics(os.path.join(tmpdir, "cached_responses")) == {
+        (sut_2.uid, "first-test"): CacheStatistics(hits=0, misses=2),
+        (sut_2.uid, "second-test"): CacheStatistics(hits=1, misses=1),
+    }
+
+
+def test_run_prompt_response_test_cache_statistics_accumulate(tmpdir):
+    test = FakeTest(test_items=[fake_test_item("1")])
+    run_prompt_response_test(test, FakeSUT(), tmpdir)
+    run_prompt_response_test(test, FakeSUT(), tmpdir)
+    directory = os.path.join(tmpdir, "FakeTest", "cached_responses")
+    assert load_cache_statistics(directory) == {
+        (FakeSUT().uid, test.uid): CacheStatistics(hits=1, misses=1)
+    }
+
+
+def test_run_prompt_response_test_shared_cache_statistics(tmpdir):
+    test = FakeTest(
+        test_items=[fake_test_item("1")],
+        annotators={"some-annotator": FakeAnnotator()},
+    )
+    run_prompt_response_test(test, FakeSUT(), tmpdir, shared_cache=True)
+    run_prompt_response_test(test, FakeSUT(), tmpdir, shared_cache=True)
+
+    # Nothing in the shared directories relies on SQLite's locks.
+    for _, _, files in os.walk(tmpdir):
+        assert not [fname for fname in files if fname.endswith(".sqlite")]
+    directory = os.path.join(tmpdir, "FakeTest", "cached_responses")
+    assert load_cache_statistics(directory) == {
+        (FakeSUT().uid, test.uid): CacheStatistics(hits=1, misses=1)
+    }
+    directory = os.path.join(tmpdir, "FakeTest", "cached_annotations")
+    assert load_cache_statistics(directory) == {
+        ("some-annotator", test.uid): CacheStatistics(hits=1, misses=1)
+    }
+
+
+def test_run_prompt_response_test_annotator_cache_statistics(tmpdir):
+    test = FakeTest(
+        test_items=[fake_test_item("1")],
+        annotators={"some-annotator": FakeAnnotator()},
+    )
+    run_prompt_response_test(test, FakeSUT(), tmpdir)
+    run_prompt_response_test(test, FakeSUT(), tmpdir)
+    directory = os.path.join(tmpdir, "FakeTest", "cached_annotations")
+    assert load_cache_statistics(directory) == {
+        ("some-annotator", test.uid): CacheStatistics(hits=1, misses=1)
+    }
+
+
+def test_partition_sut_requests(tmpdir):
+    sut = FakeSUT()
+    run_prompt_response_test(FakeTest(test_items=[fake_test_item("1")]), sut, tmpdir)
+    test = FakeTest(
+        test_items=[fake_test_item("2"), fake_test_item("1"), fake_test_item("1")]
+    )
+    run = TestRunSetup(test, sut, tmpdir, None, use_caching=True)
+    with ExitStack() as stack:
+        run.open_caches(stack)
+        partition = partition_sut_requests(run)
+    assert len(partition.cached) == 1
+    assert list(partition.misses.values()) == [
+        FakeSUTRequest(text="2", num_completions=1)
+    ]
+    assert partition.hit_ratio == 0.5
+    assert partition.fully_cached == [False, True, True]
+    assert sorted(partition.uses.values()) == [1, 2]
+
+
+def test_prefetched_responses_are_dropped_once_used(tmpdir):
+    sut = FakeSUT()
+    test = FakeTest(
+        test_items=[fake_test_item("1"), fake_test_item("2"), fake_test_item("1")]
+    )
+    run = TestRunSetup(test, sut, tmpdir, None, use_caching=False)
+    with ExitStack() as stack:
+        run.open_caches(stack)
+        responses = prefetch_sut_responses(run, disable_progress_bar=True)
+        request = FakeSUTRequest(text="1", num_completions=1)
+
+        first = responses.get_or_call(request, sut.evaluate)
+        # Kept while another TestItem still needs it, even without a cache.
+        assert responses.get_or_call(request, sut.evaluate) == first
+        assert sut.evaluate_calls == 1
+        assert responses._responses == {}
+        assert responses._remaining_uses == {
+            key: 1 for key in responses.partition.misses
+        }
+
+
+def test_run_prompt_response_test_cached_items_first(tmpdir):
+    run_prompt_response_test(
+        FakeTest(test_items=[fake_test_item("2")]), FakeSUT(), tmpdir
+    )
+    order = []
+
+    class RecordingSUT(FakeSUT):
+        def evaluate(self, request):
+            order.append(request.text)
+            return super().evaluate(request)
+
+    annotator = FakeAnnotator()
+    record = run_prompt_response_test(
+        FakeTest(
+            test_items=[fake_test_item("1"), fake_test_item("2")],
+            annotators={"some-annotator": annotator},
+        ),
+        RecordingSUT(),
+        tmpdir,
+    )
+    assert order == ["1"]
+    # The cached TestItem was annotated first, but records keep the TestItem order.
+    assert annotator.annotate_test_item_calls == 2
+    assert [r.test_item.prompts[0].prompt.text for r in record.test_item_records] == [
+        "1",
+        "2",
+    ]
+
+
+def test_run_prompt_response_test_replay_only(tmpdir):
+    test_items = [fake_test_item("1"), fake_test_item("2")]
+    record_1 = run_prompt_response_test(
+        FakeTest(test_items=test_items, annotators={"some-annotator": FakeAnnotator()}),
+        FakeSUT(),
+        tmpdir,
+    )
+    sut = FakeSUT()
+    annotator = FakeAnnotator()
+    record_2 = run_prompt_response_test(
+        FakeTest(test_items=test_items, annotators={"some-annotator": annotator}),
+        sut,
+        tmpdir,
+        replay_only=True,
+    )
+    assert sut.evaluate_calls == 0
+    assert annotator.annotate_test_item_calls == 0
+    assert record_1.test_item_records == record_2.test_item_records
+
+
+def test_run_prompt_response_test_replay_only_leaves_cache_alone(tmpdir):
+    test = FakeTest(
+        test_items=[fake_test_item("1")],
+        annotators={"some-annotator": FakeAnnotator()},
+    )
+    run_prompt_response_test(test, FakeSUT(), tmpdir)
+    cache_files = []
+    for directory, _, files in os.walk(tmpdir):
+        cache_files.extend(
+            os.path.join(directory, fname)
+            for fname in files
+            if fname.endswith(".sqlite") and fname != "cache_statistics.sqlite"
+        )
+    assert cache_files
+
+    def _contents():
+        contents = []
+        for path in cache_files:
+            with open(path, "rb") as f:
+                contents.append(f.read())
+        return contents
+
+    before = _contents()
+
+    run_prompt_response_test(test, FakeSUT(), tmpdir, replay_only=True)
+
+    assert _contents() == before
+
+
+def test_run_prompt_response_test_replay_only_lists_missing(tmpdir):
+    run_prompt_response_test(
+        FakeTest(
+            test_items=[fake_test_item("1")],
+            annotators={"some-annotator": FakeAnnotator()},
+        ),
+        FakeSUT(),
+        tmpdir,
+    )
+    sut = FakeSUT()
+    annotator = FakeAnnotator()
+    with pytest.raises(MissingCacheEntries) as err_info:
+        run_prompt_response_test(
+            FakeTest(
+                test_items=[fake_test_item("1"), fake_test_item("2")],
+                annotators={"some-annotator": FakeAnnotator(), "other": annotator},
+            ),
+            sut,
+            tmpdir,
+            replay_only=True,
+        )
+    assert sut.evaluate_calls == 0
+    assert annotator.annotate_test_item_calls == 0
+    # Item 2's SUT response and item 1's annotation by the new annotator.
+    descriptions = err_info.value.descriptions
+    assert len(descriptions) == 2
+    assert descriptions[0].startswith("fake-sut: ")
+    assert '"text":"2"' in descriptions[0]
+    assert descriptions[1].startswith("other: ")
+
+
+def test_run_prompt_response_test_replay_only_requires_caching(tmpdir):
+    with pytest.raises(AssertionError, match="Cannot replay"):
+        run_prompt_response_test(
+            FakeTest(test_items=[fake_test_item("1")]),
+            FakeSUT(),
+            tmpdir,
+            use_caching=False,
+            replay_only=True,
+        )
+
+
+def _multi_prompt_item(*texts):
+    return TestItem(
+        prompts=[
+            PromptWithContext(prompt=TextPrompt(text=text), source_id=None)
+            for text in texts
+        ]
+    )
+
+
+def test_run_prompt_response_test_completion_annotator(tmpdir):
+    annotator = FakeCompletionAnnotator()
+    record = run_prompt_response_test(
+        FakeTest(
+            test_items=[
+                _multi_prompt_item("a", "bb"),
+                _multi_prompt_item("bb", "ccc", "a"),
+            ],
+            annotators={"lengths": annotator},
+        ),
+        FakeSUT(),
+        tmpdir,
+    )
+    # Each distinct completion is only scored once.
+    assert annotator.scored_texts == ["a", "bb", "ccc"]
+    annotation = record.test_item_records[1].annotations["lengths"]
+    assert annotation.to_instance() == FakeCompletionsAnnotation(
+        lengths=[[2], [3], [1]]
+    )
+    # Completions cached by other TestItems are reused.
+    annotator_2 = FakeCompletionAnnotator()
+    run_prompt_response_test(
+        FakeTest(
+            test_items=[_multi_prompt_item("ccc", "dddd")],
+            annotators={"lengths": annotator_2},
+        ),
+        FakeSUT(),
+        tmpdir,
+    )
+    assert annotator_2.scored_texts == ["dddd"]
+
+
+def test_completion_annotation_cache_scores_once_concurrently():
+    started = threading.Event()
+    release = threading.Event()
+
+    class SlowAnnotator(FakeCompletionAnnotator):
+        def annotate_completions(self, requests):
+            started.set()
+            release.wait()
+            return super().annotate_completions(requests)
+
+    annotator = SlowAnnotator()
+    # Threads that only start once the score is done find it in the backing cache.
+    cache = CompletionAnnotationCache(annotator, MemoryCache(NoCache()))
+    interactions = [
+        PromptInteraction(
+            prompt=PromptWithContext(prompt=TextPrompt(text="p"), source_id=None),
+            response=SUTResponse(completions=[SUTCompletion(text="same")]),
+        )
+    ]
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.annotate(interactions)))
+        for _ in range(3)
+    ]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert annotator.scored_texts == ["same"]
+    assert results == [FakeCompletionsAnnotation(lengths=[[4]])] * 3
+
+
+def test_completion_annotation_cache_retries_after_failure():
+    class FlakyAnnotator(FakeCompletionAnnotator):
+        def __init__(self):
+            super().__init__()
+            self.fail = True
+
+        def annotate_completions(self, requests):
+            if self.fail:
+                self.fail = False
+                raise ValueError("Flaky")
+            return super().annotate_completions(requests)
+
+    annotator = FlakyAnnotator()
+    cache = CompletionAnnotationCache(annotator, NoCache())
+    interactions = [
+        PromptInteraction(
+            prompt=PromptWithContext(prompt=TextPrompt(text="p"), source_id=None),
+            response=SUTResponse(completions=[SUTCompletion(text="text")]),
+        )
+    ]
+    with pytest.raises(ValueError, match="Flaky"):
+        cache.annotate(interactions)
+    assert cache.annotate(interactions) == FakeCompletionsAnnotation(lengths=[[4]])
+
+
+def test_completion_annotation_cache_only_keeps_pending_scores():
+    annotator = FakeCompletionAnnotator()
+    cache = CompletionAnnotationCache(annotator, MemoryCache(NoCache()))
+    interactions = [
+        PromptInteraction(
+            prompt=PromptWithContext(prompt=TextPrompt(text="p"), source_id=None),
+            response=SUTResponse(
+                completions=[SUTCompletion(text="a"), SUTCompletion(text="bb")]
+            ),
+        )
+    ]
+
+    assert cache.annotate(interactions) == FakeCompletionsAnnotation(lengths=[[1, 2]])
+    assert cache._scores == {}
+    # Cache hits are let go as well.
+    assert cache.annotate(interactions) == FakeCompletionsAnnotation(lengths=[[1, 2]])
+    assert cache._scores == {}
+    assert annotator.scored_texts == ["a", "bb"]
+
+
 def test_run_prompt_response_test_ignore_caching(tmpdir):
     test_items = [fake_test_item("1")]
     fake_measurement = {"some-measurement": 0.5}
@@ -156,6 +570,332 @@ def test_run_prompt_response_test_max_test_items(tmpdir):
     assert record.result.to_instance() == FakeTestResult(count_test_items=3.0)
 
 
+def test_run_prompt_response_test_parallel_matches_serial(tmpdir):
+    test_items = [fake_test_item(str(i)) for i in range(20)]
+    fake_measurement = {"some-measurement": 0.5}
+
+    def _run(max_workers):
+        return run_prompt_response_test(
+            FakeTest(
+                test_items=test_items,
+                annotators={"some-annotator": FakeAnnotator()},
+                measurement=fake_measurement,
+            ),
+            FakeSUT(),
+            tmpdir,
+            use_caching=False,
+            max_workers=max_workers,
+        )
+
+    serial = _run(1)
+    parallel = _run(4)
+    # Fields like timestamp and initialization differ, so ignore them.
+    assert serial.test_item_records == parallel.test_item_records
+    assert serial.result == parallel.result
+    assert [r.test_item for r in parallel.test_item_records] == test_items
+
+
+def test_run_prompt_response_test_record_writer(tmpdir):
+    test_items = [fake_test_item(str(i)) for i in range(20)]
+
+    def _run(record_writer=None):
+        return run_prompt_response_test(
+            FakeTest(test_items=test_items, annotators={}, measurement={}),
+            FakeSUT(),
+            tmpdir,
+            use_caching=False,
+            max_workers=4,
+            record_writer=record_writer,
+        )
+
+    in_memory = _run()
+    path = os.path.join(tmpdir, "record.jsonl")
+    with TestRecordWriter(path) as record_writer:
+        streamed = _run(record_writer)
+
+    # The TestItemRecords are only in the file.
+    assert streamed.test_item_records == []
+    assert streamed.result == in_memory.result
+    reader = TestRecordReader(path)
+    assert reader.header.run_timestamp == streamed.run_timestamp
+    assert list(reader.test_item_records()) == in_memory.test_item_records
+
+
+def _record_buffered_records(monkeypatch):
+    """Track how many records are waiting to be written after every write."""
+    buffered = []
+    original_write = TestRunSetup._write_finished_records
+
+    def _write_finished_records(self):
+        original_write(self)
+        buffered.append(len(self._records))
+
+    monkeypatch.setattr(
+        TestRunSetup, "_write_finished_records", _write_finished_records
+    )
+    return buffered
+
+
+def test_run_prompt_response_test_record_writer_keeps_order(tmpdir, monkeypatch):
+    test_items = [fake_test_item(str(i)) for i in range(10)]
+    # Everything but the first TestItem is cached.
+    run_prompt_response_test(FakeTest(test_items=test_items[1:]), FakeSUT(), tmpdir)
+    buffered = _record_buffered_records(monkeypatch)
+
+    with TestRecordWriter(os.path.join(tmpdir, "record.jsonl")) as record_writer:
+        run_prompt_response_test(
+            FakeTest(test_items=test_items),
+            FakeSUT(),
+            tmpdir,
+            record_writer=record_writer,
+        )
+
+    # Cached TestItems don't jump ahead, so every record is written right away.
+    assert max(buffered) == 0
+
+
+def test_run_prompt_response_test_record_writer_bounds_look_ahead(tmpdir, monkeypatch):
+    test_items = [fake_test_item(str(i)) for i in range(20)]
+    sut = FakeSUT()
+    original_evaluate = sut.evaluate
+
+    def _evaluate(request):
+        if request.text == "0":
+            # Stay unfinished while the other worker does everything it can start.
+            time.sleep(0.2)
+        return original_evaluate(request)
+
+    sut.evaluate = _evaluate
+    buffered = _record_buffered_records(monkeypatch)
+
+    with TestRecordWriter(os.path.join(tmpdir, "record.jsonl")) as record_writer:
+        run_prompt_response_test(
+            FakeTest(test_items=test_items, annotators={}, measurement={}),
+            sut,
+            tmpdir,
+            use_caching=False,
+            max_workers=2,
+            record_writer=record_writer,
+        )
+
+    # At most 2 * max_workers TestItems are in flight, one of them the slow one.
+    assert max(buffered) == 3
+    assert sut.evaluate_calls == 20
+
+
+def test_run_prompt_response_test_parallel_is_concurrent(tmpdir):
+    test_items = [fake_test_item("1"), fake_test_item("2")]
+    sut = FakeSUT()
+    original_evaluate = sut.evaluate
+    # Both items must be in flight at once for either to pass the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def _wait_then_evaluate(request):
+        barrier.wait()
+        return original_evaluate(request)
+
+    sut.evaluate = _wait_then_evaluate
+    record = run_prompt_response_test(
+        FakeTest(
+            test_items=test_items,
+            annotators={"some-annotator": FakeAnnotator()},
+            measurement={},
+        ),
+        sut,
+        tmpdir,
+        max_workers=2,
+    )
+    assert len(record.test_item_records) == 2
+
+
+def _wait_for_each_other(annotators):
+    """Make every annotator wait until all of them are working on the same TestItem."""
+    barrier = threading.Barrier(len(annotators), timeout=5)
+    for annotator in annotators.values():
+
+        def _wait_then_annotate(interactions, original=annotator.annotate_test_item):
+            barrier.wait()
+            return original(interactions)
+
+        annotator.annotate_test_item = _wait_then_annotate
+    return annotators
+
+
+def test_run_prompt_response_test_annotators_are_concurrent(tmpdir):
+    annotators = _wait_for_each_other(
+        {key: FakeAnnotator() for key in ["slow", "fast", "other"]}
+    )
+    record = run_prompt_response_test(
+        FakeTest(
+            test_items=[fake_test_item("1"), fake_test_item("2")],
+            annotators=annotators,
+            measurement={},
+        ),
+        FakeSUT(),
+        tmpdir,
+    )
+    for item_record in record.test_item_records:
+        assert list(item_record.annotations) == ["slow", "fast", "other"]
+
+
+def test_run_prompt_response_test_max_workers_zero(tmpdir):
+    with pytest.raises(AssertionError) as err_info:
+        run_prompt_response_test(
+            FakeTest(test_items=[fake_test_item("1")]),
+            FakeSUT(),
+            tmpdir,
+            max_workers=0,
+        )
+    assert str(err_info.value) == "Cannot run a test using 0 workers."
+
+
+@newhelm_sut(capabilities=[AcceptsTextPrompt, AcceptsChatPrompt, AcceptsBatchRequests])
+class FakeBatchSUT(FakeSUT):
+    """FakeSUT that records the batches it is asked to evaluate."""
+
+    def __init__(self, uid: str = "fake-batch-sut"):
+        super().__init__(uid)
+        self.batches: List[List[str]] = []
+
+    def evaluate_batch(self, requests):
+        self.batches.append([request.text for request in requests])
+        return [self.evaluate(request) for request in requests]
+
+
+def test_default_evaluate_batch():
+    sut = FakeSUT()
+    requests = [
+        FakeSUTRequest(text="1", num_completions=1),
+        FakeSUTRequest(text="2", num_completions=2),
+    ]
+    assert sut.evaluate_batch(requests) == [
+        FakeSUTResponse(completions=["1"]),
+        FakeSUTResponse(completions=["2", "2"]),
+    ]
+    assert sut.evaluate_calls == 2
+
+
+def test_run_prompt_response_test_sut_batches(tmpdir):
+    # Repeat one item to check duplicate requests are only sent once.
+    test_items = [fake_test_item(str(i)) for i in range(5)] + [fake_test_item("0")]
+    fake_measurement = {"some-measurement": 0.5}
+    sut = FakeBatchSUT()
+    record = run_prompt_response_test(
+        FakeTest(
+            test_items=test_items,
+            annotators={"some-annotator": FakeAnnotator()},
+            measurement=fake_measurement,
+        ),
+        sut,
+        tmpdir,
+        sut_batch_size=2,
+    )
+    assert sut.batches == [["0", "1"], ["2", "3"], ["4"]]
+    assert sut.evaluate_calls == 5
+    unbatched = run_prompt_response_test(
+        FakeTest(
+            test_items=test_items,
+            annotators={"some-annotator": FakeAnnotator()},
+            measurement=fake_measurement,
+        ),
+        FakeSUT(),
+        tmpdir,
+        use_caching=False,
+    )
+    assert record.test_item_records == unbatched.test_item_records
+
+    # Everything is cached now, so there is nothing to batch.
+    cached_sut = FakeBatchSUT()
+    run_prompt_response_test(
+        FakeTest(
+            test_items=test_items,
+            annotators={"some-annotator": FakeAnnotator()},
+            measurement=fake_measurement,
+        ),
+        cached_sut,
+        tmpdir,
+        sut_batch_size=2,
+    )
+    assert cached_sut.batches == []
+    assert cached_sut.evaluate_calls == 0
+
+
+def test_batched_responses_are_read_back_from_cache(tmpdir):
+    sut = FakeBatchSUT()
+    test = FakeTest(test_items=[fake_test_item(str(i)) for i in range(4)])
+    run = TestRunSetup(test, sut, tmpdir, None, use_caching=True)
+    with ExitStack() as stack:
+        run.open_caches(stack)
+        responses = prefetch_sut_responses(run, batch_size=2, disable_progress_bar=True)
+
+        # The cache has every response, so none are held here.
+        assert responses._responses == {}
+        request = FakeSUTRequest(text="1", num_completions=1)
+        expected = FakeSUT().evaluate(request)
+        assert responses.get_or_call(request, sut.evaluate) == expected
+        assert sut.evaluate_calls == 4
+    # Reading them back isn't counted as another lookup.
+    assert run._cache_statistics[0][2].statistics == CacheStatistics(hits=0, misses=4)
+
+
+def test_run_prompt_response_test_sut_batches_no_caching(tmpdir):
+    sut = FakeBatchSUT()
+    record = run_prompt_response_test(
+        FakeTest(
+            test_items=[fake_test_item("1"), fake_test_item("2")],
+            annotators={"some-annotator": FakeAnnotator()},
+            measurement={},
+        ),
+        sut,
+        tmpdir,
+        use_caching=False,
+        sut_batch_size=5,
+    )
+    assert sut.batches == [["1", "2"]]
+    assert sut.evaluate_calls == 2
+    assert len(record.test_item_records) == 2
+
+
+def test_run_prompt_response_test_sut_batch_size_without_capability(tmpdir):
+    sut = FakeSUT()
+    sut.evaluate_batch = None  # Would fail if called.
+    record = run_prompt_response_test(
+        FakeTest(
+            test_items=[fake_test_item("1"), fake_test_item("2")],
+            annotators={"some-annotator": FakeAnnotator()},
+            measurement={},
+        ),
+        sut,
+        tmpdir,
+        sut_batch_size=5,
+    )
+    assert sut.evaluate_calls == 2
+    assert len(record.test_item_records) == 2
+
+
+def test_run_prompt_response_test_sut_batch_exception(tmpdir):
+    sut = FakeBatchSUT()
+
+    def _raise_exception(*args, **kwargs):
+        raise Exception("some-exception")
+
+    sut.evaluate_batch = _raise_exception
+
+    with pytest.raises(Exception) as err_info:
+        run_prompt_response_test(
+            FakeTest(
+                test_items=[fake_test_item("1")],
+                annotators={"some-annotator": FakeAnnotator()},
+                measurement={},
+            ),
+            sut,
+            tmpdir,
+            sut_batch_size=2,
+        )
+    assert "SUT batch of 1 requests starting with `text='1'" in str(err_info.value)
+    assert str(err_info.value.__cause__) == "some-exception"
+
+
 def test_run_prompt_response_test_max_test_items_zero(tmpdir):
     # Lots of test items
     test_items = [fake_test_item(str(i)) for i in range(100)]
@@ -1,8 +1,33 @@
+from contextlib import closing
+import multiprocessing
 import os
+import shutil
+import sqlite3
 from pydantic import BaseModel
 import pytest
-
-from newhelm.caching import SqlDictCache
+from sqlitedict import SqliteDict  # type: ignore
+
+from newhelm.caching import (
+    CacheEntry,
+    CacheStatistics,
+    CountingCache,
+    DirectoryCache,
+    MemoryCache,
+    MemoryCacheStatistics,
+    MissingCacheEntries,
+    NoCache,
+    ReplayOnlyCache,
+    SqlDictCache,
+    BundleImportResult,
+    compact_cache_file,
+    export_cache_bundle,
+    find_cache_files,
+    import_cache_bundle,
+    migrate_cache_file,
+    request_digest,
+    summarize_cache_file,
+)
+from newhelm.typed_data import TypedData
 from tests.utilities import parent_directory
 
 
@@ -200,3 +225,617 @@ def test_unencodable_response(tmpdir):
         # We should not get a cache hit because we can't cache the response
         assert cache.get_or_call(request, mock_evaluate.some_call) == response
         assert mock_evaluate.counter == 2
+
+
+def _count_committed(cache_dir, file_identifier):
+    """Count entries as seen by a separate connection."""
+    with SqlDictCache(cache_dir, file_identifier) as other:
+        return len(other.cached_responses)
+
+
+def test_group_commits(tmpdir):
+    with SqlDictCache(
+        tmpdir, "sut_name", commit_every=2, commit_interval_seconds=1000
+    ) as cache:
+        cache.update_cache(SimpleClass(value="1"), SimpleClass(value="response"))
+        assert _count_committed(tmpdir, "sut_name") == 0
+        # The writing connection can still read its own writes.
+        assert cache.get_cached_response(SimpleClass(value="1")) is not None
+        cache.update_cache(SimpleClass(value="2"), SimpleClass(value="response"))
+        assert _count_committed(tmpdir, "sut_name") == 2
+        cache.update_cache(SimpleClass(value="3"), SimpleClass(value="response"))
+        assert _count_committed(tmpdir, "sut_name") == 2
+    assert _count_committed(tmpdir, "sut_name") == 3
+
+
+def test_commit_interval(tmpdir):
+    with SqlDictCache(
+        tmpdir, "sut_name", commit_every=1000, commit_interval_seconds=0
+    ) as cache:
+        cache.update_cache(SimpleClass(value="1"), SimpleClass(value="response"))
+        assert _count_committed(tmpdir, "sut_name") == 1
+
+
+def test_commits_on_exception(tmpdir):
+    request = SimpleClass(value="request")
+    response = SimpleClass(value="response")
+    with pytest.raises(ValueError):
+        with SqlDictCache(tmpdir, "sut_name", commit_every=1000) as cache:
+            cache.update_cache(request, response)
+            raise ValueError("Crashed mid-run")
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        assert cache.get_cached_response(request) == response
+
+
+def test_reopen_after_exit(tmpdir):
+    cache = SqlDictCache(tmpdir, "sut_name")
+    request = SimpleClass(value="request")
+    response = SimpleClass(value="response")
+    with cache:
+        cache.update_cache(request, response)
+    with cache:
+        assert cache.get_cached_response(request) == response
+
+
+def _journal_mode(cache):
+    return cache.cached_responses.conn.select_one("PRAGMA journal_mode")[0]
+
+
+def test_new_cache_uses_wal(tmpdir):
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        assert _journal_mode(cache) == "wal"
+
+
+def test_existing_cache_switches_to_wal_on_write(tmpdir):
+    with SqliteDict(os.path.join(tmpdir, "sut_name.sqlite")) as existing:
+        existing["key"] = "value"
+        existing.commit()
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        # Only reading leaves the file as it was.
+        assert _journal_mode(cache) == "delete"
+        cache.update_cache(SimpleClass(value="1"), SimpleClass(value="response"))
+        assert _journal_mode(cache) == "wal"
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        assert _journal_mode(cache) == "wal"
+
+
+def test_stores_digest_and_request(tmpdir):
+    request = SimpleClass(value="request " * 1000)
+    response = SimpleClass(value="response")
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        cache.update_cache(request, response)
+        assert not cache.legacy_format
+        [(key, entry)] = cache.cached_responses.items()
+        assert len(key) == 64
+        assert entry == CacheEntry(
+            request=TypedData.from_instance(request),
+            response=TypedData.from_instance(response),
+        )
+
+
+def test_get_cached_responses(tmpdir):
+    requests = [SimpleClass(value=str(i)) for i in range(3)]
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        cache.update_cache(requests[0], ParentClass(parent_value="0"))
+        cache.update_cache(requests[2], ChildClass1(parent_value="2", child_value="c"))
+        assert cache.get_cached_responses(requests + ["unencodable"]) == [
+            ParentClass(parent_value="0"),
+            None,
+            ChildClass1(parent_value="2", child_value="c"),
+            None,
+        ]
+        assert cache.get_cached_responses([]) == []
+
+
+def test_get_cached_responses_many_keys(tmpdir):
+    requests = [SimpleClass(value=str(i)) for i in range(1234)]
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        for request in requests[::2]:
+            cache.update_cache(request, request)
+        responses = cache.get_cached_responses(requests)
+    assert responses[::2] == requests[::2]
+    assert responses[1::2] == [None] * 617
+
+
+def test_request_digest_ignores_key_order():
+    first = TypedData(module="m", class_name="c", data={"a": 1, "b": [1, 2]})
+    second = TypedData(module="m", class_name="c", data={"b": [1, 2], "a": 1})
+    different = TypedData(module="m", class_name="c", data={"a": 1, "b": [2, 1]})
+    assert request_digest(first) == request_digest(second)
+    assert request_digest(first) != request_digest(different)
+
+
+@pytest.fixture
+def legacy_cache_dir(parent_directory, tmpdir):
+    shutil.copy(parent_directory.joinpath("data", "sample_cache.sqlite"), tmpdir)
+    return tmpdir
+
+
+def test_legacy_file_stays_legacy(legacy_cache_dir):
+    request = SimpleClass(value="request 3")
+    response = SimpleClass(value="response 3")
+    with SqlDictCache(legacy_cache_dir, "sample_cache") as cache:
+        assert cache.legacy_format
+        cache.update_cache(request, response)
+    with SqlDictCache(legacy_cache_dir, "sample_cache") as cache:
+        assert cache.legacy_format
+        assert len(cache.cached_responses) == 3
+        assert cache.get_cached_response(request) == response
+
+
+def test_legacy_file_get_cached_responses(legacy_cache_dir):
+    with SqlDictCache(legacy_cache_dir, "sample_cache") as cache:
+        responses = cache.get_cached_responses(
+            [SimpleClass(value="request 2"), SimpleClass(value="missing")]
+        )
+    assert responses == [
+        ChildClass1(parent_value="response 2", child_value="child val"),
+        None,
+    ]
+
+
+def test_migrate_cache_file(legacy_cache_dir):
+    path = os.path.join(legacy_cache_dir, "sample_cache.sqlite")
+    assert migrate_cache_file(path) == 2
+    with SqlDictCache(legacy_cache_dir, "sample_cache") as cache:
+        assert not cache.legacy_format
+        assert len(cache.cached_responses) == 2
+        response_1 = cache.get_cached_response(SimpleClass(value="request 1"))
+        assert response_1 == ParentClass(parent_value="response 1")
+        response_2 = cache.get_cached_response(SimpleClass(value="request 2"))
+        assert response_2 == ChildClass1(
+            parent_value="response 2", child_value="child val"
+        )
+    # Already migrated.
+    assert migrate_cache_file(path) == 0
+
+
+def _access_times(path):
+    with closing(sqlite3.connect(path)) as connection:
+        return dict(connection.execute("SELECT key, last_access FROM cache_access"))
+
+
+def _set_access_times(path, access_times):
+    with closing(sqlite3.connect(path)) as connection:
+        for key, last_access in access_times.items():
+            connection.execute(
+                "UPDATE cache_access SET last_access = ? WHERE key = ?",
+                (last_access, key),
+            )
+        connection.commit()
+
+
+def _key(request):
+    return request_digest(TypedData.from_instance(request))
+
+
+def test_records_access_times(tmpdir):
+    path = os.path.join(tmpdir, "sut_name.sqlite")
+    requests = [SimpleClass(value=str(i)) for i in range(3)]
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        cache.update_cache(requests[0], SimpleClass(value="response"))
+        cache.update_cache(requests[1], SimpleClass(value="response"))
+    written = _access_times(path)
+    assert written.keys() == {_key(requests[0]), _key(requests[1])}
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        cache.get_cached_response(requests[0])
+        cache.get_cached_responses([requests[1], requests[2]])
+    read = _access_times(path)
+    assert read.keys() == written.keys()
+    assert all(read[key] >= written[key] for key in read)
+
+
+def test_reads_without_track_access_leave_file_alone(tmpdir):
+    path = os.path.join(tmpdir, "sut_name.sqlite")
+    request = SimpleClass(value="request")
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        cache.update_cache(request, SimpleClass(value="response"))
+    with open(path, "rb") as f:
+        written = f.read()
+
+    with SqlDictCache(tmpdir, "sut_name", track_access=False) as cache:
+        assert cache.get_cached_response(request) == SimpleClass(value="response")
+        assert cache.get_cached_responses([request]) == [SimpleClass(value="response")]
+
+    with open(path, "rb") as f:
+        assert f.read() == written
+
+
+def _fill_cache(cache_dir, count):
+    requests = [SimpleClass(value=str(i)) for i in range(count)]
+    with SqlDictCache(cache_dir, "sut_name") as cache:
+        for request in requests:
+            cache.update_cache(request, SimpleClass(value="response"))
+    return requests
+
+
+def test_compact_evicts_expired_entries(tmpdir):
+    path = os.path.join(tmpdir, "sut_name.sqlite")
+    requests = _fill_cache(tmpdir, 2)
+    _set_access_times(path, {_key(requests[0]): 0})
+    result = compact_cache_file(path, max_age_seconds=60 * 60)
+    assert result.evicted_entries == 1
+    assert _access_times(path).keys() == {_key(requests[1])}
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        assert cache.get_cached_response(requests[0]) is None
+        assert cache.get_cached_response(requests[1]) is not None
+
+
+def test_compact_evicts_least_recently_used(tmpdir):
+    path = os.path.join(tmpdir, "sut_name.sqlite")
+    requests = _fill_cache(tmpdir, 3)
+    _set_access_times(path, {_key(request): i for i, request in enumerate(requests)})
+    entry_bytes = summarize_cache_file(path).entry_bytes
+    # All entries are the same size.
+    result = compact_cache_file(path, max_bytes=entry_bytes * 2 // 3)
+    assert result.evicted_entries == 1
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        assert cache.get_cached_responses(requests)[0] is None
+        assert None not in cache.get_cached_responses(requests[1:])
+
+
+def test_compact_without_limits(tmpdir):
+    path = os.path.join(tmpdir, "sut_name.sqlite")
+    _fill_cache(tmpdir, 100)
+    with SqlDictCache(tmpdir, "sut_name") as cache:
+        for i in range(90):
+            del cache.cached_responses[_key(SimpleClass(value=str(i)))]
+        cache.cached_responses.commit()
+    result = compact_cache_file(path)
+    assert result.evicted_entries == 0
+    assert result.file_bytes_after < result.file_bytes_before
+    assert len(_access_times(path)) == 10
+
+
+def test_compact_legacy_file(legacy_cache_dir):
+    path = os.path.join(legacy_cache_dir, "sample_cache.sqlite")
+    assert compact_cache_file(path).evicted_entries == 0
+    # Entries from before access times were kept count as used now.
+    assert len(_access_times(path)) == 2
+    with SqlDictCache(legacy_cache_dir, "sample_cache") as cache:
+        assert not cache.legacy_format
+        assert len(cache.cached_responses) == 2
+
+
+def test_summarize_cache_file(tmpdir, parent_directory):
+    _fill_cache(tmpdir, 3)
+    summary = summarize_cache_file(os.path.join(tmpdir, "sut_name.sqlite"))
+    assert summary.entries == 3
+    assert 0 < summary.entry_bytes < summary.file_bytes
+    sample_cache = parent_directory.joinpath("data", "sample_cache.sqlite")
+    assert summarize_cache_file(str(sample_cache)).entries == 2
+
+
+def _fill_test_caches(data_dir, test, values):
+    with SqlDictCache(os.path.join(data_dir, test, "cached_responses"), "sut") as cache:
+        for value in values:
+            cache.update_cache(SimpleClass(value=value), SimpleClass(value=f"r{value}"))
+
+
+def test_cache_bundle_round_trip(tmpdir):
+    source = os.path.join(tmpdir, "source")
+    _fill_test_caches(source, "test_1", ["1", "2"])
+    _fill_test_caches(source, "test_2", ["2", "3"])
+    bundle = os.path.join(tmpdir, "bundle.zst")
+    # The shared entry is only written once.
+    assert export_cache_bundle(bundle, source, [source]) == 3
+    destination = os.path.join(tmpdir, "destination")
+    _fill_test_caches(destination, "test_1", ["1"])
+    assert import_cache_bundle(bundle, destination) == BundleImportResult(
+        added=3, already_cached=1
+    )
+    with SqlDictCache(
+        os.path.join(destination, "test_2", "cached_responses"), "sut"
+    ) as cache:
+        assert cache.get_cached_responses(
+            [SimpleClass(value="2"), SimpleClass(value="3")]
+        ) == [SimpleClass(value="r2"), SimpleClass(value="r3")]
+    assert import_cache_bundle(bundle, destination) == BundleImportResult(
+        added=0, already_cached=4
+    )
+
+
+def _fill_shared_test_caches(data_dir, test, values):
+    with DirectoryCache(
+        os.path.join(data_dir, test, "cached_responses"), "sut"
+    ) as cache:
+        for value in values:
+            cache.update_cache(SimpleClass(value=value), SimpleClass(value=f"r{value}"))
+
+
+def test_cache_bundle_shared_caches(tmpdir):
+    source = os.path.join(tmpdir, "source")
+    _fill_shared_test_caches(source, "test_1", ["1", "2"])
+    _fill_test_caches(source, "test_2", ["2", "3"])
+    bundle = os.path.join(tmpdir, "bundle.zst")
+    assert export_cache_bundle(bundle, source, [source]) == 3
+
+    shared = os.path.join(tmpdir, "shared")
+    _fill_shared_test_caches(shared, "test_1", ["1"])
+    assert import_cache_bundle(bundle, shared, shared_cache=True) == BundleImportResult(
+        added=3, already_cached=1
+    )
+    with DirectoryCache(
+        os.path.join(shared, "test_2", "cached_responses"), "sut"
+    ) as cache:
+        assert cache.get_cached_response(SimpleClass(value="3")) == SimpleClass(
+            value="r3"
+        )
+
+    # Exporting the shared caches and importing them as files gets everything back.
+    shared_bundle = os.path.join(tmpdir, "shared_bundle.zst")
+    assert export_cache_bundle(shared_bundle, shared, [shared]) == 3
+    files = os.path.join(tmpdir, "files")
+    assert import_cache_bundle(shared_bundle, files) == BundleImportResult(
+        added=4, already_cached=0
+    )
+    with SqlDictCache(
+        os.path.join(files, "test_1", "cached_responses"), "sut"
+    ) as cache:
+        assert cache.get_cached_responses(
+            [SimpleClass(value="1"), SimpleClass(value="2")]
+        ) == [SimpleClass(value="r1"), SimpleClass(value="r2")]
+
+
+def test_cache_bundle_legacy_files(legacy_cache_dir, tmpdir):
+    bundle = os.path.join(tmpdir, "bundle.zst")
+    assert export_cache_bundle(bundle, legacy_cache_dir, [legacy_cache_dir]) == 2
+    destination = os.path.join(tmpdir, "destination")
+    assert import_cache_bundle(bundle, destination).added == 2
+    with SqlDictCache(destination, "sample_cache") as cache:
+        assert not cache.legacy_format
+        assert cache.get_cached_response(SimpleClass(value="request 1")) == ParentClass(
+            parent_value="response 1"
+        )
+
+
+def test_cache_bundle_outside_data_dir(tmpdir):
+    _fill_test_caches(tmpdir, "test_1", ["1"])
+    with pytest.raises(ValueError, match="is not in"):
+        export_cache_bundle(
+            os.path.join(tmpdir, "bundle.zst"),
+            os.path.join(tmpdir, "test_2"),
+            [str(tmpdir)],
+        )
+
+
+def test_find_cache_files(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "test", "cached_responses"))
+    cache_file = os.path.join(tmpdir, "test", "cached_responses", "sut.sqlite")
+    open(cache_file, "w").close()
+    open(os.path.join(tmpdir, "test", "record.json"), "w").close()
+    assert find_cache_files([str(tmpdir)]) == [cache_file]
+    assert find_cache_files([cache_file]) == [cache_file]
+
+
+def test_directory_cache_round_trip(tmpdir):
+    request = SimpleClass(value="request")
+    response = ChildClass1(parent_value="parent", child_value="child")
+    with DirectoryCache(tmpdir, "sut/name") as cache:
+        assert cache.get_cached_response(request) is None
+        cache.update_cache(request, response)
+        assert cache.get_cached_response(request) == response
+        assert cache.get_cached_response(SimpleClass(value="other")) is None
+    with DirectoryCache(tmpdir, "sut/name") as cache:
+        assert cache.get_cached_response(request) == response
+
+
+def test_directory_cache_get_or_call(tmpdir):
+    request = SimpleClass(value="simple request")
+    response = SimpleClass(value="simple response")
+    mock_evaluate = CallCounter(response)
+    with DirectoryCache(tmpdir, "sut_name") as cache:
+        assert cache.get_or_call(request, mock_evaluate.some_call) == response
+        assert cache.get_or_call(request, mock_evaluate.some_call) == response
+        assert mock_evaluate.counter == 1
+        # Can't cache non-pydantic objects.
+        assert cache.get_or_call("request", mock_evaluate.some_call) == response
+        assert mock_evaluate.counter == 2
+
+
+def test_directory_cache_ignores_unreadable_entry(tmpdir):
+    request = SimpleClass(value="request")
+    with DirectoryCache(tmpdir, "sut_name") as cache:
+        cache.update_cache(request, SimpleClass(value="response"))
+        [entry_file] = [
+            os.path.join(directory, f)
+            for directory, _, files in os.walk(cache.directory)
+            for f in files
+        ]
+        with open(entry_file, "wb") as f:
+            f.write(b"garbage")
+        assert cache.get_cached_response(request) is None
+
+
+def test_directory_cache_retries(tmpdir, mocker):
+    mocker.patch("time.sleep")
+    request = SimpleClass(value="request")
+    response = SimpleClass(value="response")
+    real_replace = os.replace
+    failures = [OSError("Stale file handle")] * 2
+
+    def flaky_replace(*args):
+        if failures:
+            raise failures.pop()
+        return real_replace(*args)
+
+    mocker.patch("os.replace", side_effect=flaky_replace)
+    with DirectoryCache(tmpdir, "sut_name", max_attempts=3) as cache:
+        cache.update_cache(request, response)
+        assert cache.get_cached_response(request) == response
+
+
+def test_directory_cache_gives_up(tmpdir, mocker):
+    mocker.patch("time.sleep")
+    mocker.patch("os.replace", side_effect=OSError("Stale file handle"))
+    with DirectoryCache(tmpdir, "sut_name", max_attempts=3) as cache:
+        with pytest.raises(OSError):
+            cache.update_cache(SimpleClass(value="1"), SimpleClass(value="2"))
+    # No temporary files left behind.
+    assert [files for _, _, files in os.walk(cache.directory) if files] == []
+
+
+def _fill_directory_cache(cache_dir, worker):
+    with DirectoryCache(cache_dir, "sut_name") as cache:
+        for i in range(50):
+            # Every worker writes the even entries, only this worker the odd ones.
+            key = str(i) if i % 2 == 0 else f"{worker}-{i}"
+            cache.update_cache(SimpleClass(value=key), SimpleClass(value=key))
+            cache.get_cached_response(SimpleClass(value=str(i - i % 2)))
+
+
+def test_directory_cache_many_processes(tmpdir):
+    workers = [
+        multiprocessing.Process(target=_fill_directory_cache, args=(tmpdir, worker))
+        for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    with DirectoryCache(tmpdir, "sut_name") as cache:
+        for i in range(0, 50, 2):
+            response = cache.get_cached_response(SimpleClass(value=str(i)))
+            assert response == SimpleClass(value=str(i))
+        for worker in range(4):
+            for i in range(1, 50, 2):
+                key = f"{worker}-{i}"
+                response = cache.get_cached_response(SimpleClass(value=key))
+                assert response == SimpleClass(value=key)
+
+
+class CountingStore(NoCache):
+    """Cache backed by a dict, that counts how often it is read."""
+
+    def __init__(self):
+        self.responses = {}
+        self.reads = 0
+
+    def get_cached_response(self, request):
+        self.reads += 1
+        return self.responses.get(request.value)
+
+    def update_cache(self, request, response):
+        self.responses[request.value] = response
+
+
+def test_memory_cache_serves_from_memory():
+    store = CountingStore()
+    request = SimpleClass(value="request")
+    response = SimpleClass(value="response")
+    with MemoryCache(store) as cache:
+        assert cache.get_cached_response(request) is None
+        cache.update_cache(request, response)
+        assert store.responses == {"request": response}
+        assert cache.get_cached_response(request) == response
+        assert cache.get_cached_response(request) == response
+        assert store.reads == 1
+        assert cache.statistics == MemoryCacheStatistics(hits=2, misses=1)
+
+
+def test_memory_cache_reads_through():
+    store = CountingStore()
+    request = SimpleClass(value="request")
+    response = SimpleClass(value="response")
+    store.update_cache(request, response)
+    with MemoryCache(store) as cache:
+        assert cache.get_cached_response(request) == response
+        assert cache.get_cached_response(request) == response
+        assert store.reads == 1
+        assert cache.statistics == MemoryCacheStatistics(hits=1, misses=1)
+
+
+def _entry_size(request, response):
+    cache = MemoryCache(NoCache())
+    cache.update_cache(request, response)
+    return cache.current_bytes
+
+
+def test_memory_cache_evicts_least_recently_used():
+    requests = [SimpleClass(value=str(i)) for i in range(3)]
+    response = SimpleClass(value="response")
+    size = _entry_size(requests[0], response)
+    store = CountingStore()
+    with MemoryCache(store, max_bytes=2 * size) as cache:
+        cache.update_cache(requests[0], response)
+        cache.update_cache(requests[1], response)
+        # Use 0 so 1 is the least recently used.
+        cache.get_cached_response(requests[0])
+        cache.update_cache(requests[2], response)
+        assert cache.statistics.evictions == 1
+        assert cache.current_bytes == 2 * size
+        store.reads = 0
+        cache.get_cached_response(requests[0])
+        cache.get_cached_response(requests[2])
+        assert store.reads == 0
+        cache.get_cached_response(requests[1])
+        assert store.reads == 1
+
+
+def test_memory_cache_skips_large_responses():
+    store = CountingStore()
+    request = SimpleClass(value="request")
+    with MemoryCache(store, max_bytes=10) as cache:
+        cache.update_cache(request, SimpleClass(value="response"))
+        assert cache.current_bytes == 0
+        assert cache.get_cached_response(request) == SimpleClass(value="response")
+        assert cache.statistics.evictions == 0
+
+
+def test_memory_cache_unencodable_request():
+    with MemoryCache(NoCache()) as cache:
+        mock_evaluate = CallCounter(SimpleClass(value="response"))
+        cache.get_or_call("request", mock_evaluate.some_call)
+        cache.get_or_call("request", mock_evaluate.some_call)
+        assert mock_evaluate.counter == 2
+        assert cache.current_bytes == 0
+
+
+def test_memory_cache_get_cached_responses():
+    store = CountingStore()
+    requests = [SimpleClass(value=str(i)) for i in range(3)]
+    store.update_cache(requests[1], SimpleClass(value="stored"))
+    with MemoryCache(store) as cache:
+        cache.update_cache(requests[0], SimpleClass(value="remembered"))
+        store.reads = 0
+        assert cache.get_cached_responses(requests) == [
+            SimpleClass(value="remembered"),
+            SimpleClass(value="stored"),
+            None,
+        ]
+        assert store.reads == 2
+        assert cache.statistics == MemoryCacheStatistics(hits=1, misses=2)
+        # Responses found in the store are now in memory.
+        assert cache.get_cached_response(requests[1]) == SimpleClass(value="stored")
+        assert store.reads == 2
+
+
+def test_counting_cache_get_cached_responses():
+    store = CountingStore()
+    requests = [SimpleClass(value=str(i)) for i in range(3)]
+    store.update_cache(requests[0], SimpleClass(value="stored"))
+    counting = CountingCache(store)
+    assert counting.get_cached_responses(requests) == [
+        SimpleClass(value="stored"),
+        None,
+        None,
+    ]
+    assert counting.get_cached_response(requests[0]) == SimpleClass(value="stored")
+    assert counting.statistics == CacheStatistics(hits=2, misses=2)
+
+
+def test_replay_only_cache():
+    store = CountingStore()
+    store.update_cache(SimpleClass(value="cached"), SimpleClass(value="response"))
+    mock_evaluate = CallCounter(SimpleClass(value="response"))
+    with ReplayOnlyCache(store, "sut_name") as cache:
+        assert cache.get_or_call(
+            SimpleClass(value="cached"), mock_evaluate.some_call
+        ) == SimpleClass(value="response")
+        with pytest.raises(MissingCacheEntries, match="sut_name: [0-9a-f]{64} "):
+            cache.get_or_call(SimpleClass(value="missing"), mock_evaluate.some_call)
+    with ReplayOnlyCache(NoCache(), "sut_name") as cache:
+        with pytest.raises(MissingCacheEntries, match="sut_name: cannot cache"):
+            cache.get_or_call("unencodable", mock_evaluate.some_call)
+    assert mock_evaluate.counter == 0
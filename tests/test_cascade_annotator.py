@@ -0,0 +1,115 @@
+import asyncio
+from typing import List
+
+from newhelm.annotation import Annotation
+from newhelm.cascade_annotator import CascadeAnnotation, CascadeAnnotator
+from newhelm.cascade_statistics import CascadeStatistics
+from newhelm.prompt import TextPrompt
+from newhelm.records import TestRecordSummary
+from newhelm.runners.simple_test_runner import run_prompt_response_test
+from newhelm.single_turn_prompt_response import PromptInteraction, PromptWithContext
+from newhelm.sut import SUTCompletion, SUTResponse
+from tests.fake_annotator import FakeCompletionAnnotator, FakeCompletionsAnnotation
+from tests.fake_sut import FakeSUT
+from tests.fake_test import FakeTest, fake_test_item
+
+
+def _make_interaction(completions: List[str]) -> PromptInteraction:
+    return PromptInteraction(
+        prompt=PromptWithContext(prompt=TextPrompt(text="The prompt"), source_id=None),
+        response=SUTResponse(completions=[SUTCompletion(text=t) for t in completions]),
+    )
+
+
+def _make_cascade():
+    # The cheap tier is only trusted with short completions.
+    return CascadeAnnotator(
+        FakeCompletionAnnotator(),
+        FakeCompletionAnnotator(),
+        is_confident=lambda score: score.length < 5,
+    )
+
+
+def test_cascade_only_sends_ambiguous_completions():
+    cascade = _make_cascade()
+    interactions = [
+        _make_interaction(["a", "longer"]),
+        _make_interaction(["longer", "also long"]),
+    ]
+
+    result = cascade.annotate_test_item(interactions)
+
+    assert result == CascadeAnnotation(
+        annotation=Annotation.from_instance(
+            FakeCompletionsAnnotation(lengths=[[1, 6], [6, 9]])
+        ),
+        tiers=[["cheap", "expensive"], ["expensive", "expensive"]],
+    )
+    assert cascade.cheap.scored_texts == ["a", "longer", "also long"]
+    assert cascade.expensive.scored_texts == ["longer", "also long"]
+
+
+def test_cascade_skips_expensive_when_confident():
+    cascade = _make_cascade()
+
+    result = cascade.annotate_test_item([_make_interaction(["a", "bb"])])
+
+    assert result.tiers == [["cheap", "cheap"]]
+    assert cascade.expensive.scored_texts == []
+
+
+def test_cascade_async():
+    cascade = _make_cascade()
+
+    result = asyncio.run(
+        cascade.annotate_test_item_async([_make_interaction(["a", "longer"])])
+    )
+
+    assert result.tiers == [["cheap", "expensive"]]
+    assert cascade.expensive.scored_texts == ["longer"]
+
+
+def test_cascade_statistics_in_test_record(tmpdir):
+    test = FakeTest(
+        test_items=[fake_test_item("hi"), fake_test_item("much longer")],
+        annotators={"cascade": _make_cascade()},
+        measurement={},
+    )
+
+    record = run_prompt_response_test(test, FakeSUT(), tmpdir)
+
+    assert record.cascade_statistics == {
+        "cascade": CascadeStatistics(cheap_completions=1, expensive_completions=1)
+    }
+    tiers = [
+        item.annotations["cascade"].to_instance(CascadeAnnotation).tiers
+        for item in record.test_item_records
+    ]
+    assert tiers == [[["cheap"]], [["expensive"]]]
+    assert record.cascade_statistics["cascade"].model_dump()["fraction_saved"] == 0.5
+    summary = TestRecordSummary(
+        result=record.result, cascade_statistics=record.cascade_statistics
+    )
+    assert TestRecordSummary.model_validate_json(summary.model_dump_json()) == summary
+
+
+def test_cascade_statistics_only_serialized_when_present(tmpdir):
+    test = FakeTest(test_items=[fake_test_item("hi")], measurement={})
+
+    record = run_prompt_response_test(test, FakeSUT(), tmpdir)
+
+    assert "cascade_statistics" not in record.model_dump()
+    summary = TestRecordSummary(result=record.result)
+    assert "cascade_statistics" not in summary.model_dump_json()
+    assert TestRecordSummary.model_validate_json(summary.model_dump_json()) == summary
+
+
+def test_cascade_annotation_get_annotation():
+    annotation = CascadeAnnotation(
+        annotation=Annotation.from_instance(FakeCompletionsAnnotation(lengths=[[1]])),
+        tiers=[["cheap"]],
+    )
+
+    assert annotation.get_annotation(
+        FakeCompletionsAnnotation
+    ) == FakeCompletionsAnnotation(lengths=[[1]])
@@ -1,5 +1,6 @@
 import os
 import pathlib
+import shutil
 
 import pytest
 
@@ -69,3 +70,30 @@ def test_run_test_demos(cmd, test):
         )
         == 0
     )
+
+
+@expensive_tests
+def test_cache_migrate(cmd, tmpdir):
+    sample_cache = pathlib.Path(__file__).parent / "data" / "sample_cache.sqlite"
+    shutil.copy(sample_cache, tmpdir)
+    assert os.system(f"python {cmd} cache migrate {tmpdir}") == 0
+
+
+@expensive_tests
+def test_cache_compact_and_stats(cmd, tmpdir):
+    sample_cache = pathlib.Path(__file__).parent / "data" / "sample_cache.sqlite"
+    shutil.copy(sample_cache, tmpdir)
+    assert os.system(f"python {cmd} cache compact --max-bytes 0 {tmpdir}") == 0
+    assert os.system(f"python {cmd} cache stats --data-dir {tmpdir}") == 0
+
+
+@expensive_tests
+def test_cache_export_import(cmd, tmpdir):
+    sample_cache = pathlib.Path(__file__).parent / "data" / "sample_cache.sqlite"
+    shutil.copy(sample_cache, tmpdir)
+    bundle = tmpdir / "bundle.zst"
+    assert os.system(f"python {cmd} cache export {bundle} --data-dir {tmpdir}") == 0
+    assert (
+        os.system(f"python {cmd} cache import {bundle} --data-dir {tmpdir / 'new'}")
+        == 0
+    )
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+from newhelm.rate_limiting import (
+    RateLimit,
+    RateLimiter,
+    estimate_tokens,
+    make_rate_limiter,
+    rate_limited,
+)
+from newhelm.caching import NoCache
+from newhelm.prompt import TextPrompt
+from newhelm.runners.simple_test_runner import (
+    AnnotatorData,
+    CompletionAnnotationCache,
+    run_prompt_response_test,
+)
+from newhelm.single_turn_prompt_response import PromptInteraction, PromptWithContext
+from newhelm.sut import SUTCompletion, SUTResponse
+from tests.fake_annotator import FakeAnnotator, FakeCompletionAnnotator
+from tests.fake_sut import FakeSUT, FakeSUTRequest
+from tests.fake_test import FakeTest, fake_test_item
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("newhelm.rate_limiting.time.time", clock)
+    return clock
+
+
+def test_rate_limiter_spaces_requests(clock):
+    limiter = RateLimiter(RateLimit(requests_per_minute=60))
+
+    # The bucket starts with one second's worth.
+    assert limiter._reserve(1, 0) == 0
+    assert limiter._reserve(1, 0) == 1
+    assert limiter._reserve(1, 0) == 2
+    clock.now += 10
+    # Waiting longer than the callers queued up refills the bucket, but only so far.
+    assert limiter._reserve(1, 0) == 0
+    assert limiter._reserve(1, 0) == 1
+
+
+def test_rate_limiter_low_rate_starts_with_one_call(clock):
+    limiter = RateLimiter(RateLimit(requests_per_minute=6))
+
+    # The first call doesn't wait for the bucket to refill.
+    assert limiter._reserve(1, 0) == 0
+    assert limiter._reserve(1, 0) == pytest.approx(10)
+
+
+def test_rate_limiter_counts_tokens(clock):
+    limiter = RateLimiter(RateLimit(requests_per_minute=600, tokens_per_minute=60))
+
+    # Larger than the bucket, so it waits for the bucket to refill enough.
+    assert limiter._reserve(1, 3) == 2
+    clock.now += 2
+    assert limiter._reserve(1, 1) == 1
+
+
+def test_rate_limiter_without_limits(clock):
+    limiter = RateLimiter(RateLimit())
+
+    assert all(limiter._reserve(1, 1000) == 0 for _ in range(100))
+
+
+def test_rate_limiter_shared_through_file(clock, tmpdir):
+    path = os.path.join(tmpdir, "limits", "sut.json")
+    first = RateLimiter(RateLimit(requests_per_minute=60), path)
+    second = RateLimiter(RateLimit(requests_per_minute=60), path)
+
+    assert first._reserve(1, 0) == 0
+    assert second._reserve(1, 0) == 1
+    assert first._reserve(1, 0) == 2
+
+
+def test_rate_limiter_invalid_limit():
+    with pytest.raises(AssertionError) as err_info:
+        RateLimiter(RateLimit(requests_per_minute=0))
+    assert "Cannot limit requests_per_minute to 0" in str(err_info.value)
+
+
+def test_rate_limiter_acquire_waits():
+    limiter = RateLimiter(RateLimit(tokens_per_minute=1200))
+
+    start = time.monotonic()
+    # Empty the bucket, then each call needs another 1/10th of a second.
+    limiter.acquire(tokens=20)
+    limiter.acquire(tokens=2)
+    asyncio.run(limiter.acquire_async(tokens=2))
+
+    assert time.monotonic() - start >= 0.19
+
+
+def test_rate_limiter_acquire_async_shared_through_file(tmpdir):
+    limiter = RateLimiter(
+        RateLimit(tokens_per_minute=1200), os.path.join(tmpdir, "sut.json")
+    )
+    reserved_in = []
+    original_reserve = limiter._reserve
+
+    def _reserve(requests, tokens):
+        reserved_in.append(threading.current_thread())
+        return original_reserve(requests, tokens)
+
+    limiter._reserve = _reserve
+
+    asyncio.run(limiter.acquire_async(tokens=2))
+
+    # The file is locked and read outside the event loop's thread.
+    assert reserved_in[0] is not threading.main_thread()
+
+
+def test_make_rate_limiter(tmpdir):
+    assert make_rate_limiter(None, str(tmpdir), "sut_some-sut") is None
+    limiter = make_rate_limiter(
+        RateLimit(requests_per_minute=60), str(tmpdir), "sut_some/sut"
+    )
+    assert limiter is not None
+    assert limiter.state_path == os.path.join(tmpdir, "sut_some_sut.json")
+
+
+class RecordingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__(RateLimit())
+        self.acquired = []
+
+    def acquire(self, requests=1, tokens=0):
+        self.acquired.append((requests, tokens))
+
+
+def test_rate_limited_counts_tokens():
+    request = FakeSUTRequest(text="some text", num_completions=1)
+    limiter = RecordingLimiter()
+    limited = rate_limited(lambda r: r.text, limiter, estimate_tokens)
+
+    assert limited(request) == "some text"
+    assert limiter.acquired == [(1, estimate_tokens(request))]
+    assert rate_limited(len, None)("abc") == 3
+
+
+def test_rate_limited_counts_requests():
+    limiter = RecordingLimiter()
+    limited = rate_limited(sum, limiter, lambda _: 0, count_requests=len)
+
+    assert limited([1, 2, 3]) == 6
+    assert limiter.acquired == [(3, 0)]
+
+
+def _make_interactions(*completions):
+    return [
+        PromptInteraction(
+            prompt=PromptWithContext(prompt=TextPrompt(text="prompt"), source_id=None),
+            response=SUTResponse(
+                completions=[SUTCompletion(text=text) for text in texts]
+            ),
+        )
+        for texts in completions
+    ]
+
+
+def test_annotator_charged_per_completion():
+    limiter = RecordingLimiter()
+    annotator = AnnotatorData(
+        "some-annotator", FakeAnnotator(), NoCache(), None, limiter
+    )
+
+    annotator.annotate(_make_interactions(["a", "b"], ["c"]))
+
+    assert [requests for requests, _ in limiter.acquired] == [3]
+
+
+def test_completion_annotator_charged_per_request_scored():
+    limiter = RecordingLimiter()
+    completion_annotator = FakeCompletionAnnotator()
+    completion_cache = CompletionAnnotationCache(
+        completion_annotator, NoCache(), limiter
+    )
+
+    # Repeated completions are only scored, and counted, once.
+    completion_cache.annotate(_make_interactions(["a", "b", "a"], ["c"]))
+
+    assert [requests for requests, _ in limiter.acquired] == [3]
+    assert completion_annotator.count_requests(_make_interactions(["a", "a"])) == 1
+
+
+def test_run_prompt_response_test_rate_limits(tmpdir):
+    sut = FakeSUT()
+    sut.rate_limit = RateLimit(requests_per_minute=600)
+    annotator = FakeAnnotator()
+    annotator.rate_limit = RateLimit(requests_per_minute=6000)
+    limits = os.path.join(tmpdir, "limits")
+
+    run_prompt_response_test(
+        FakeTest(
+            test_items=[fake_test_item(str(i)) for i in range(4)],
+            annotators={"some-annotator": annotator},
+            measurement={},
+        ),
+        sut,
+        tmpdir,
+        use_caching=False,
+        max_workers=4,
+        rate_limit_directory=limits,
+    )
+
+    assert sorted(os.listdir(limits)) == [
+        "annotator_some-annotator.json",
+        "sut_fake-sut.json",
+    ]
+    with open(os.path.join(limits, "sut_fake-sut.json")) as f:
+        state = json.load(f)
+    # The bucket holds 10 requests, and refills slowly enough to see all 4 calls.
+    assert state["requests"] < 8
@@ -1,10 +1,20 @@
 import datetime
+import os
+
+import pytest
 from pydantic import BaseModel
 from newhelm.annotation import Annotation
 from newhelm.base_test import TestResult
 from newhelm.prompt import TextPrompt, SUTOptions
 from newhelm.record_init import InitializationRecord
-from newhelm.records import TestItemRecord, TestRecord
+from newhelm.records import (
+    TestItemRecord,
+    TestRecord,
+    TestRecordHeader,
+    TestRecordReader,
+    TestRecordWriter,
+    write_test_record,
+)
 from newhelm.single_turn_prompt_response import (
     PromptInteraction,
     PromptWithContext,
@@ -214,3 +224,138 @@ def test_round_trip_prompt_with_context():
     assert prompt == returned
     assert type(returned.context) == MockContext
     assert returned.source_id == "id01"
+
+
+def _make_item_record(text: str) -> TestItemRecord:
+    prompt = PromptWithContext(
+        prompt=TextPrompt(text=text),
+        source_id=None,
+        context=MockContext(context_field=text),
+    )
+    return TestItemRecord(
+        test_item=TestItem(prompts=[prompt]),
+        interactions=[
+            PromptInteraction(
+                prompt=prompt,
+                response=SUTResponse(completions=[SUTCompletion(text=f"{text}-out")]),
+            )
+        ],
+        annotations={"k1": Annotation.from_instance(MockAnnotation(mock_field=text))},
+        measurements={"m1": 1.0},
+    )
+
+
+def _make_streamable_record(test_item_records) -> TestRecord:
+    return TestRecord(
+        test_uid="some-test",
+        test_initialization=InitializationRecord(
+            module="some-module", class_name="test-class", args=[], kwargs={}
+        ),
+        dependency_versions={},
+        sut_uid="some-sut",
+        sut_initialization=InitializationRecord(
+            module="another-module", class_name="sut-class", args=[], kwargs={}
+        ),
+        test_item_records=test_item_records,
+        result=TestResult.from_instance(MockResult(mock_result=2.0)),
+    )
+
+
+def test_streamed_test_record_round_trip(tmpdir):
+    record = _make_streamable_record(
+        [_make_item_record("first"), _make_item_record("second")]
+    )
+    path = str(tmpdir / "record.jsonl")
+
+    write_test_record(record, path)
+
+    reader = TestRecordReader(path)
+    assert reader.header.test_uid == "some-test"
+    assert reader.summary is not None
+    assert reader.summary.result == record.result
+    assert reader.to_test_record() == record
+    with open(path) as f:
+        lines = f.read().splitlines()
+    # Header, one line per TestItem and the summary.
+    assert len(lines) == 4
+    # The prompt's context is only stored in the TestItem, not in the interactions.
+    assert lines[1].count("context_field") == 1
+
+
+def test_streamed_test_record_is_lazy(tmpdir):
+    path = str(tmpdir / "record.jsonl")
+    write_test_record(_make_streamable_record([_make_item_record("first")]), path)
+    with open(path, "a") as f:
+        f.write("not json\n")
+
+    records = TestRecordReader(path).test_item_records()
+
+    assert next(records) == _make_item_record("first")
+
+
+def test_streamed_test_record_without_summary(tmpdir):
+    path = str(tmpdir / "record.jsonl")
+    header = TestRecordHeader(
+        test_uid="some-test",
+        test_initialization=InitializationRecord(
+            module="some-module", class_name="test-class", args=[], kwargs={}
+        ),
+        dependency_versions={},
+        sut_uid="some-sut",
+        sut_initialization=InitializationRecord(
+            module="another-module", class_name="sut-class", args=[], kwargs={}
+        ),
+    )
+    with TestRecordWriter(path) as writer:
+        writer.write_header(header)
+        writer.write_test_item_record(_make_item_record("first"))
+
+    reader = TestRecordReader(path)
+
+    assert reader.header == header
+    assert reader.summary is None
+    assert list(reader.test_item_records()) == [_make_item_record("first")]
+
+
+def test_streamed_test_record_other_interactions(tmpdir):
+    item_record = _make_item_record("first")
+    # Interactions that don't match the TestItem's prompts are kept as they are.
+    item_record.interactions = item_record.interactions * 2
+    record = _make_streamable_record([item_record])
+    path = str(tmpdir / "record.jsonl")
+
+    write_test_record(record, path)
+
+    assert TestRecordReader(path).to_test_record() == record
+
+
+def test_streamed_test_record_failure_keeps_existing_file(tmpdir):
+    path = str(tmpdir / "record.jsonl")
+    record = _make_streamable_record([_make_item_record("first")])
+    write_test_record(record, path)
+
+    with pytest.raises(Exception, match="some-exception"):
+        with TestRecordWriter(path) as writer:
+            writer.write_test_item_record(_make_item_record("second"))
+            raise Exception("some-exception")
+
+    assert TestRecordReader(path).to_test_record() == record
+    # The temporary file is cleaned up.
+    assert os.listdir(tmpdir) == ["record.jsonl"]
+
+
+@pytest.mark.parametrize(
+    "content,error",
+    [
+        ("", "is empty"),
+        ("not json\n", "doesn't start with a TestRecord header"),
+        ("{}\n", "doesn't start with a TestRecord header"),
+    ],
+)
+def test_streamed_test_record_reader_needs_header(tmpdir, content, error):
+    path = str(tmpdir / "record.jsonl")
+    with open(path, "w") as f:
+        f.write(content)
+
+    with pytest.raises(ValueError, match=error):
+        TestRecordReader(path)